@@ -0,0 +1,421 @@
+"""
+Lockstep batched simulation engine.
+
+Many independent simulations are stored as one population of NumPy arrays,
+with a segment index giving the simulation each animal belongs to. Animals
+are kept sorted by segment and, within a segment, in population order, so a
+month of every simulation is a single vectorised update: resources are handed
+out by each animal's rank within its segment, and deaths and births are
+counted per segment.
+
+Checks follow `numpy_engine.advance_population()`. All simulations of a batch
+draw from one random generator, so a run's result depends on the batch it ran
+in, but each run follows the same distribution as on the other engines.
+"""
+import logging
+import time
+
+import numpy
+
+from climate import ClimateSchedule
+from models import (
+    ALLOCATION_RANDOM,
+    ALLOCATION_YOUNGEST_FIRST,
+    DEATH_OLD_AGE,
+    DEATH_STARVATION,
+    DEATH_THIRST,
+    DEATH_TOO_COLD,
+    DEATH_TOO_HOT,
+    GENDER_FEMALE,
+    MONTHS_IN_YEAR,
+)
+from numpy_engine import (
+    GENDER_CODES,
+    PopulationArrays,
+    get_initial_population,
+    get_newborns,
+)
+from parallel import run_in_pool
+from replicates import get_replicate_seed
+from reporting import SimulationStatistics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 64
+# Order in which checks are applied, which decides the death type of animals
+# that would fail several of them.
+DEATH_TYPES = (
+    DEATH_OLD_AGE,
+    DEATH_STARVATION,
+    DEATH_THIRST,
+    DEATH_TOO_COLD,
+    DEATH_TOO_HOT,
+)
+
+
+class BatchPopulation(PopulationArrays):
+    fields = PopulationArrays.fields + ('segment',)
+
+    def __init__(self, size=0):
+        super().__init__(size)
+        self.segment = numpy.zeros(size, dtype=numpy.intp)
+
+    def insert(self, other):
+        """
+        Add the animals of `other`, which is sorted by segment, after the
+        animals of the same segment.
+        """
+        indexes = numpy.searchsorted(self.segment, other.segment, side='right')
+        for field in self.fields:
+            values = numpy.insert(
+                getattr(self, field),
+                indexes,
+                getattr(other, field),
+            )
+            setattr(self, field, values)
+
+
+class BatchParameters(object):
+    """
+    Species and habitat parameters of every simulation of a batch, as arrays
+    indexed by segment.
+    """
+
+    def __init__(self, runs, rng):
+        self.size = len(runs)
+        species_list = [species for (species, _, _, _) in runs]
+        habitats = [habitat for (_, habitat, _, _) in runs]
+
+        def get_array(values):
+            return numpy.array(list(values))
+
+        self.months = get_array(
+            years * MONTHS_IN_YEAR
+            for (_, _, years, _) in runs
+        )
+        self.lifespan_months = get_array(
+            species.life_span * MONTHS_IN_YEAR
+            for species in species_list
+        )
+        self.breeding_months = get_array(
+            species.minimum_breeding_age * MONTHS_IN_YEAR
+            for species in species_list
+        )
+        self.gestation_months = get_array(
+            species.gestation_months
+            for species in species_list
+        )
+        self.food_capacity = get_capacity(
+            get_array(habitat.monthly_food for habitat in habitats),
+            get_array(
+                species.monthly_food_consumption
+                for species in species_list
+            ),
+        )
+        self.water_capacity = get_capacity(
+            get_array(habitat.monthly_water for habitat in habitats),
+            get_array(
+                species.monthly_water_consumption
+                for species in species_list
+            ),
+        )
+
+        self.youngest_first = get_array(
+            habitat.allocation == ALLOCATION_YOUNGEST_FIRST
+            for habitat in habitats
+        )
+        self.random_allocation = get_array(
+            habitat.allocation == ALLOCATION_RANDOM
+            for habitat in habitats
+        )
+        self.in_order = not (
+            self.youngest_first.any() or self.random_allocation.any()
+        )
+
+        # Whether each month is too hot or too cold, by segment and month.
+        shape = (self.size, max(self.months, default=0))
+        self.hot = numpy.zeros(shape, dtype=bool)
+        self.cold = numpy.zeros(shape, dtype=bool)
+        for (segment, (species, habitat, years, climate)) in enumerate(runs):
+            months = self.months[segment]
+            if climate is None:
+                climate = ClimateSchedule.from_habitat(habitat, months, rng)
+            (hot, cold) = climate.get_extreme_months(species)
+            self.hot[segment, :months] = hot[:months]
+            self.cold[segment, :months] = cold[:months]
+
+
+class BatchStatistics(object):
+    """
+    `SimulationStatistics` of every simulation of a batch, accumulated as
+    arrays indexed by segment.
+    """
+
+    def __init__(self, size):
+        self.step_count = numpy.zeros(size, dtype=numpy.int64)
+        self.total_population = numpy.zeros(size, dtype=numpy.int64)
+        self.max_population = numpy.zeros(size, dtype=numpy.int64)
+        self.final_population = numpy.zeros(size, dtype=numpy.int64)
+        self.deaths_by_type = {
+            death_type: numpy.zeros(size, dtype=numpy.int64)
+            for death_type in DEATH_TYPES
+        }
+
+    def add_step(self, active, population, deaths):
+        """
+        Record a month of the `active` simulations, given the population and
+        the deaths by type of every segment.
+        """
+        self.step_count += active
+        population = numpy.where(active, population, 0)
+        self.total_population += population
+        numpy.maximum(
+            self.max_population,
+            population,
+            out=self.max_population,
+        )
+        self.final_population[active] = population[active]
+        for (death_type, counts) in deaths.items():
+            self.deaths_by_type[death_type] += numpy.where(active, counts, 0)
+
+    def get_simulation_statistics(self):
+        statistics_list = []
+        for segment in range(len(self.step_count)):
+            statistics = SimulationStatistics()
+            statistics.step_count = int(self.step_count[segment])
+            statistics.total_population = int(self.total_population[segment])
+            statistics.max_population = int(self.max_population[segment])
+            statistics.final_population = int(self.final_population[segment])
+            for (death_type, counts) in self.deaths_by_type.items():
+                statistics.deaths_by_type[death_type] = int(counts[segment])
+            statistics_list.append(statistics)
+        return statistics_list
+
+
+def get_capacity(resource, consumption):
+    """
+    Vectorised `models.get_fed_count` for an unlimited number of candidates.
+    """
+    capacity = numpy.full(len(resource), numpy.iinfo(numpy.int64).max)
+    consuming = consumption > 0
+    capacity[consuming] = resource[consuming] // consumption[consuming]
+    capacity[resource < consumption] = 0
+    return capacity
+
+
+def get_allocation_order(population, parameters, rng):
+    """
+    Return the indexes of `population` in the order the allocation policy of
+    every segment serves its animals, or None when every segment serves them
+    in population order.
+    """
+    if parameters.in_order:
+        return None
+    segment = population.segment
+    keys = numpy.zeros(len(population))
+    youngest_first = parameters.youngest_first[segment]
+    keys[youngest_first] = -population.birth_month[youngest_first]
+    random_allocation = parameters.random_allocation[segment]
+    keys[random_allocation] = rng.random(
+        numpy.count_nonzero(random_allocation),
+    )
+    # Ties are broken by population order.
+    return numpy.lexsort((numpy.arange(len(population)), keys, segment))
+
+
+def get_initial_batch(size):
+    founders = get_initial_population()
+    population = BatchPopulation(size * len(founders))
+    for field in PopulationArrays.fields:
+        getattr(population, field)[:] = numpy.tile(
+            getattr(founders, field),
+            size,
+        )
+    population.segment[:] = numpy.repeat(numpy.arange(size), len(founders))
+    return population
+
+
+def advance_batch(population, month, parameters, rng):
+    """
+    Advance every simulation of `population` from `month` to the next month.
+
+    Returns the surviving population (newborns included) and a mapping of
+    death type to the number of animals of each segment that died of it.
+    """
+    next_month = month + 1
+    segment = population.segment
+    size = parameters.size
+    alive = numpy.ones(len(population), dtype=bool)
+    deaths = {}
+
+    def apply_check(death_type, still_alive):
+        nonlocal alive
+        dying = alive & ~still_alive
+        alive = alive & still_alive
+        deaths[death_type] = numpy.bincount(segment[dying], minlength=size)
+
+    def feed(field, capacity):
+        # Rank of every living animal among the living animals of its
+        # segment, in the order they are served. Serving orders keep
+        # segments apart, so `segment` stays sorted in that order too.
+        order = get_allocation_order(population, parameters, rng)
+        served = alive if order is None else alive[order]
+        alive_counts = numpy.cumsum(served)
+        segment_starts = numpy.searchsorted(segment, numpy.arange(size))
+        alive_before = numpy.concatenate(([0], alive_counts))[segment_starts]
+        ranks = alive_counts - 1 - alive_before[segment]
+        fed = served & (ranks < capacity[segment])
+        if order is not None:
+            fed = order[fed]
+        field[fed] = next_month
+
+    apply_check(
+        DEATH_OLD_AGE,
+        population.birth_month >= next_month - parameters.lifespan_months[
+            segment
+        ],
+    )
+
+    feed(population.last_feed_month, parameters.food_capacity)
+    apply_check(
+        DEATH_STARVATION,
+        population.last_feed_month >= next_month - 3,
+    )
+
+    feed(population.last_drink_month, parameters.water_capacity)
+    apply_check(
+        DEATH_THIRST,
+        population.last_drink_month >= next_month - 1,
+    )
+
+    is_cold = parameters.cold[segment, month]
+    population.consecutive_cold_months += 1
+    population.consecutive_cold_months[~is_cold] = 0
+    apply_check(DEATH_TOO_COLD, population.consecutive_cold_months <= 1)
+
+    is_hot = parameters.hot[segment, month]
+    population.consecutive_hot_months += 1
+    population.consecutive_hot_months[~is_hot] = 0
+    apply_check(DEATH_TOO_HOT, population.consecutive_hot_months <= 1)
+
+    population = population.select(alive)
+    segment = population.segment
+
+    breeding = (
+        (population.gender == GENDER_CODES[GENDER_FEMALE]) &
+        (month - population.birth_month >= parameters.breeding_months[
+            segment
+        ])
+    )
+    due = breeding & (
+        population.gestation_months == parameters.gestation_months[segment]
+    )
+    population.gestation_months[breeding & ~due] += 1
+    population.gestation_months[due] = 0
+
+    born_counts = numpy.bincount(segment[due], minlength=size)
+    born_count = int(born_counts.sum())
+    if born_count:
+        arrays = get_newborns(born_count, next_month, rng)
+        newborns = BatchPopulation()
+        for field in PopulationArrays.fields:
+            setattr(newborns, field, getattr(arrays, field))
+        newborns.segment = numpy.repeat(numpy.arange(size), born_counts)
+        population.insert(newborns)
+
+    return (population, deaths)
+
+
+def get_batch_statistics(runs, rng=None, profiler=None):
+    """
+    Simulate every `(species, habitat, simulation_years, climate)` run in
+    lockstep, and return the `SimulationStatistics` of each. Runs without a
+    climate schedule draw one from `rng`.
+    """
+    if rng is None:
+        rng = numpy.random.default_rng()
+
+    parameters = BatchParameters(runs, rng)
+    population = get_initial_batch(parameters.size)
+    statistics = BatchStatistics(parameters.size)
+    active = numpy.ones(parameters.size, dtype=bool)
+    statistics.add_step(
+        active,
+        numpy.bincount(population.segment, minlength=parameters.size),
+        {},
+    )
+
+    for month in range(max(parameters.months, default=0)):
+        # Simulations past their last month take no further part.
+        active &= parameters.months > month
+        if not active.any():
+            break
+        if not active.all():
+            population = population.select(active[population.segment])
+
+        population_count = len(population)
+        start = time.perf_counter()
+        (population, deaths) = advance_batch(
+            population,
+            month,
+            parameters,
+            rng,
+        )
+        if profiler is not None:
+            profiler.record_step(
+                month + 1,
+                population_count,
+                time.perf_counter() - start,
+            )
+
+        counts = numpy.bincount(population.segment, minlength=parameters.size)
+        statistics.add_step(active, counts, deaths)
+
+        # No reason to continue simulations in which no more animals exist
+        active &= counts > 0
+
+    return statistics.get_simulation_statistics()
+
+
+def get_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng=None,
+    profiler=None,
+    climate=None,
+):
+    """
+    Simulate a single run as a batch of one.
+    """
+    runs = [(species, habitat, simulation_years, climate)]
+    return get_batch_statistics(runs, rng, profiler)[0]
+
+
+def run_batch(runs, seed=None):
+    return get_batch_statistics(runs, numpy.random.default_rng(seed))
+
+
+def run_batched(runs, jobs, seed=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Simulate every `(species, habitat, simulation_years, climate)` run in
+    batches of `batch_size`, spread over `jobs` processes, and yield the
+    `SimulationStatistics` of each run in order.
+
+    Each batch draws from its own random stream, seeded from `seed` and the
+    batch number, so results do not depend on the number of jobs.
+    """
+    runs = list(runs)
+    batches = [
+        (
+            runs[start:start + batch_size],
+            get_replicate_seed(seed, 'batch:{:d}'.format(index)),
+        )
+        for (index, start) in enumerate(range(0, len(runs), batch_size))
+    ]
+    results = run_in_pool(run_batch, batches, jobs)
+    try:
+        for statistics_list in results:
+            yield from statistics_list
+    finally:
+        results.close()
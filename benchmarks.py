@@ -0,0 +1,351 @@
+"""
+Microbenchmarks for the simulation hot paths.
+
+    python benchmarks.py run --output baseline.json
+    python benchmarks.py run --output current.json
+    python benchmarks.py compare baseline.json current.json
+
+Every benchmark runs at fixed seeds on synthetic populations, so two runs of
+the same code time the same work. `compare` exits with a non-zero status when
+any benchmark got slower than the allowed threshold.
+"""
+from argparse import ArgumentParser
+import json
+import platform
+from random import Random
+from statistics import median
+import sys
+import time
+
+import event_engine
+from main import (
+    advance,
+    breed_animals,
+    separate_alive_from_dead,
+    simulate_species_in_habitat,
+)
+from models import (
+    ALLOCATION_FIRST_COME,
+    ALLOCATIONS,
+    GENDER_FEMALE,
+    GENDER_MALE,
+    MONTHS_IN_YEAR,
+    SEASONS,
+    AgeCheck,
+    Animal,
+    ColdCheck,
+    DrinkCheck,
+    FoodCheck,
+    Habitat,
+    HeatCheck,
+    SimulationStep,
+    Species,
+)
+
+FORMAT_VERSION = 1
+DEFAULT_SIZES = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+DEFAULT_REPEAT = 5
+DEFAULT_SEED = 0
+DEFAULT_THRESHOLD = 0.1
+BENCHMARK_MONTH = 10 * MONTHS_IN_YEAR
+
+
+def get_species():
+    species = Species()
+    species.name = 'benchmark'
+    species.life_span = 20
+    species.monthly_food_consumption = 1
+    species.monthly_water_consumption = 1
+    species.minimum_temperature = 30
+    species.maximum_temperature = 100
+    species.gestation_months = 2
+    species.minimum_breeding_age = 1
+    return species
+
+
+def get_habitat(size, allocation=ALLOCATION_FIRST_COME):
+    # Enough food and water for about half of a population of `size`, so the
+    # resource checks feed some animals and starve others.
+    habitat = Habitat()
+    habitat.name = 'benchmark'
+    habitat.allocation = allocation
+    habitat.monthly_food = size // 2
+    habitat.monthly_water = size // 2
+    for season in SEASONS:
+        habitat.average_temperatures[season] = 65
+    return habitat
+
+
+def get_population(size, seed):
+    rng = Random(seed)
+    lifespan_months = get_species().life_span * MONTHS_IN_YEAR
+    animals = []
+    for index in range(size):
+        animal = Animal()
+        animal.gender = rng.choice((GENDER_MALE, GENDER_FEMALE))
+        animal.birth_month = BENCHMARK_MONTH - rng.randrange(lifespan_months)
+        animal.last_feed_month = BENCHMARK_MONTH - rng.randrange(3)
+        animal.last_drink_month = BENCHMARK_MONTH - rng.randrange(2)
+        animal.gestation_months = rng.randrange(3)
+        animals.append(animal)
+    # Populations are kept in order of birth.
+    animals.sort(key=lambda animal: animal.birth_month)
+    return animals
+
+
+def get_simulation_step(size, seed):
+    simulation_step = SimulationStep()
+    simulation_step.month = BENCHMARK_MONTH
+    simulation_step.animals = get_population(size, seed)
+    return simulation_step
+
+
+def get_checks(simulation_step, size, allocation=ALLOCATION_FIRST_COME):
+    species = get_species()
+    habitat = get_habitat(size, allocation)
+    return {
+        'AgeCheck': AgeCheck(simulation_step, species),
+        'FoodCheck': FoodCheck(simulation_step, habitat, species),
+        'DrinkCheck': DrinkCheck(simulation_step, habitat, species),
+        'ColdCheck': ColdCheck(65, species),
+        'HeatCheck': HeatCheck(65, species),
+    }
+
+
+def benchmark_check(name, allocation=ALLOCATION_FIRST_COME):
+    # A check as `main.apply_checks` runs it, on the whole population at
+    # once.
+    def setup(size, seed):
+        simulation_step = get_simulation_step(size, seed)
+        check = get_checks(simulation_step, size, allocation)[name]
+        return (check, simulation_step.animals, Random(seed))
+
+    def run(check, animals, rng):
+        check.update_all(animals, rng)
+        check.separate(animals)
+
+    return (setup, run)
+
+
+def benchmark_advance():
+    def setup(size, seed):
+        simulation_step = get_simulation_step(size, seed)
+        return (
+            simulation_step,
+            get_species(),
+            get_habitat(size),
+            Random(seed),
+        )
+
+    return (setup, advance)
+
+
+def benchmark_breed_animals():
+    def setup(size, seed):
+        simulation_step = get_simulation_step(size, seed)
+        females = [
+            animal
+            for animal in simulation_step.animals
+            if animal.gender == GENDER_FEMALE
+        ]
+        return (females, get_species(), simulation_step, Random(seed))
+
+    return (setup, breed_animals)
+
+
+def benchmark_separate_alive_from_dead():
+    def setup(size, seed):
+        simulation_step = get_simulation_step(size, seed)
+        check = get_checks(simulation_step, size)['AgeCheck']
+        return (simulation_step.animals, check.is_still_alive)
+
+    return (setup, separate_alive_from_dead)
+
+
+def benchmark_simulation():
+    # The habitat supports a population of about `size`, and the species
+    # breeds quickly enough to reach it within the simulated years.
+    def setup(size, seed):
+        species = get_species()
+        species.minimum_breeding_age = 0
+        species.gestation_months = 1
+        return (species, get_habitat(size * 2), 5, Random(seed))
+
+    return (setup, simulate_species_in_habitat)
+
+
+def benchmark_event_engine():
+    # The setup of `simulate_species_in_habitat`, where food and water run
+    # short almost every month once the population has grown, so nearly
+    # every month is simulated in full.
+    (setup, _) = benchmark_simulation()
+    return (setup, event_engine.get_simulation_statistics)
+
+
+BENCHMARKS = {
+    'advance': benchmark_advance(),
+    'AgeCheck': benchmark_check('AgeCheck'),
+    'FoodCheck': benchmark_check('FoodCheck'),
+    'DrinkCheck': benchmark_check('DrinkCheck'),
+    'ColdCheck': benchmark_check('ColdCheck'),
+    'HeatCheck': benchmark_check('HeatCheck'),
+    **{
+        # The resource checks under every other allocation policy, which
+        # each hand resources out differently.
+        '{name}:{allocation}'.format(name=name, allocation=allocation):
+        benchmark_check(name, allocation)
+        for name in ('FoodCheck', 'DrinkCheck')
+        for allocation in ALLOCATIONS
+        if allocation != ALLOCATION_FIRST_COME
+    },
+    'breed_animals': benchmark_breed_animals(),
+    'separate_alive_from_dead': benchmark_separate_alive_from_dead(),
+    'simulate_species_in_habitat': benchmark_simulation(),
+    'event_engine': benchmark_event_engine(),
+}
+
+
+def run_benchmark(name, size, repeat, seed):
+    (setup, function) = BENCHMARKS[name]
+    timings = []
+    for iteration in range(repeat):
+        # Setup is rebuilt every time because the benchmarks mutate the
+        # population, and is never included in the timing.
+        arguments = setup(size, seed + iteration)
+        start = time.perf_counter()
+        function(*arguments)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'name': name,
+        'size': size,
+        'repeat': repeat,
+        'seed': seed,
+        'min': min(timings),
+        'median': median(timings),
+    }
+
+
+def run_benchmarks(names, sizes, repeat, seed, output_stream=None):
+    results = []
+    for name in names:
+        for size in sizes:
+            result = run_benchmark(name, size, repeat, seed)
+            results.append(result)
+            if output_stream is not None:
+                print(
+                    '{name:<30} {size:>9d} {min:>12.6f}s'.format(**result),
+                    file=output_stream,
+                )
+    return {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def find_regressions(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two benchmark documents. Returns `(name, size, ratio)` for every
+    benchmark present in both whose best time grew by more than `threshold`.
+    """
+    baseline_results = {
+        (result['name'], result['size']): result
+        for result in baseline['results']
+    }
+    regressions = []
+    for result in current['results']:
+        key = (result['name'], result['size'])
+        baseline_result = baseline_results.get(key)
+        if baseline_result is None or not baseline_result['min']:
+            continue
+        ratio = result['min'] / baseline_result['min']
+        if ratio > 1 + threshold:
+            regressions.append((result['name'], result['size'], ratio))
+    return regressions
+
+
+def run_command(arguments):
+    results = run_benchmarks(
+        arguments.benchmarks or list(BENCHMARKS),
+        arguments.sizes,
+        arguments.repeat,
+        arguments.seed,
+        sys.stderr,
+    )
+    if arguments.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return 0
+
+
+def compare_command(arguments):
+    with open(arguments.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(arguments.current) as current_file:
+        current = json.load(current_file)
+
+    regressions = find_regressions(baseline, current, arguments.threshold)
+    for (name, size, ratio) in regressions:
+        print('REGRESSION {name} at {size:d}: {ratio:.2f}x slower'.format(
+            name=name,
+            size=size,
+            ratio=ratio,
+        ))
+    if not regressions:
+        print('No regressions')
+    return 1 if regressions else 0
+
+
+def get_argument_parser():
+    parser = ArgumentParser(description='Simulation microbenchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument(
+        '--output',
+        help='Path of the JSON results. If omitted, write to stdout',
+    )
+    run_parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='Population sizes to benchmark',
+    )
+    run_parser.add_argument(
+        '--benchmarks',
+        nargs='+',
+        choices=tuple(BENCHMARKS),
+        help='Benchmarks to run. If omitted, run all of them',
+    )
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    run_parser.set_defaults(function=run_command)
+
+    compare_parser = subparsers.add_parser(
+        'compare',
+        help='Flag regressions against a stored baseline',
+    )
+    compare_parser.add_argument('baseline', help='Baseline JSON results')
+    compare_parser.add_argument('current', help='Current JSON results')
+    compare_parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='Allowed slowdown before a benchmark is flagged, as a fraction',
+    )
+    compare_parser.set_defaults(function=compare_command)
+
+    return parser
+
+
+def main():
+    arguments = get_argument_parser().parse_args()
+    return arguments.function(arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Checkpoints of long simulations.
+
+A checkpoint holds everything needed to continue a run exactly where it
+stopped: the month, the live population, the statistics gathered so far, the
+state of the random number generator and the pre-drawn temperature
+fluctuations. The population is stored as one fixed-width array per `Animal`
+field, which keeps checkpoints small and quick to write.
+"""
+from array import array
+import logging
+import os
+import pickle
+
+from fileutils import get_run_file_name, write_atomically
+from models import (
+    GENDER_FEMALE,
+    GENDER_MALE,
+    GENDER_UNKNOWN,
+    Animal,
+    SimulationStep,
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SPECIES-SIM-CHECKPOINT'
+FORMAT_VERSION = 1
+DEFAULT_INTERVAL = 120  # months
+
+GENDERS = (GENDER_UNKNOWN, GENDER_MALE, GENDER_FEMALE)
+GENDER_CODES = {gender: code for (code, gender) in enumerate(GENDERS)}
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class Checkpoint(object):
+    def __init__(self):
+        self.inputs = None
+        self.month = 0
+        self.columns = {}
+        self.statistics = None
+        self.rng_state = None
+        self.fluctuations = array('d')
+        self.finished = False
+
+    @classmethod
+    def from_simulation_step(
+        cls,
+        simulation_step,
+        statistics,
+        rng,
+        fluctuations,
+    ):
+        checkpoint = cls()
+        checkpoint.month = simulation_step.month
+        animals = simulation_step.animals
+        for field in Animal.__slots__:
+            if field == 'gender':
+                column = array('b', (
+                    GENDER_CODES[animal.gender]
+                    for animal in animals
+                ))
+            else:
+                column = array('l', (
+                    getattr(animal, field)
+                    for animal in animals
+                ))
+            checkpoint.columns[field] = column
+        checkpoint.statistics = statistics
+        checkpoint.rng_state = rng.getstate()
+        checkpoint.fluctuations = array('d', fluctuations)
+        return checkpoint
+
+    def get_simulation_step(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = self.month
+
+        columns = [self.columns[field] for field in Animal.__slots__]
+        for values in zip(*columns):
+            animal = Animal()
+            for (field, value) in zip(Animal.__slots__, values):
+                setattr(animal, field, value)
+            animal.gender = GENDERS[animal.gender]
+            simulation_step.animals.append(animal)
+
+        return simulation_step
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Write `checkpoint` to `path`. A run killed while saving leaves the
+    previous checkpoint intact.
+    """
+    data = MAGIC + pickle.dumps(
+        (FORMAT_VERSION, checkpoint),
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    write_atomically(path, data)
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as checkpoint_file:
+        if checkpoint_file.read(len(MAGIC)) != MAGIC:
+            raise CheckpointError('{path} is not a checkpoint'.format(
+                path=path,
+            ))
+        (version, checkpoint) = pickle.load(checkpoint_file)
+
+    if version != FORMAT_VERSION:
+        raise CheckpointError(
+            '{path} has unsupported checkpoint version {version}'.format(
+                path=path,
+                version=version,
+            ),
+        )
+    return checkpoint
+
+
+def get_checkpoint_path(directory, species, habitat, replicate):
+    return os.path.join(
+        directory,
+        get_run_file_name(species, habitat, replicate, '.checkpoint'),
+    )
+
+
+class Checkpointer(object):
+    """
+    Decides when a run saves checkpoints and where it resumes from.
+
+    `inputs` identifies the run, so a checkpoint written for different inputs
+    is never resumed.
+    """
+
+    def __init__(self, path, inputs, interval=DEFAULT_INTERVAL, resume=False):
+        self.path = path
+        self.inputs = inputs
+        self.interval = interval
+        self.resume = resume
+
+    def is_due(self, month):
+        return month > 0 and month % self.interval == 0
+
+    def load(self):
+        if not self.resume or not os.path.exists(self.path):
+            return None
+
+        checkpoint = load_checkpoint(self.path)
+        if checkpoint.inputs != self.inputs:
+            logger.warning(
+                'Ignoring checkpoint %s written for different inputs',
+                self.path,
+            )
+            return None
+        return checkpoint
+
+    def save(self, checkpoint):
+        checkpoint.inputs = self.inputs
+        save_checkpoint(self.path, checkpoint)
@@ -0,0 +1,175 @@
+"""
+Monthly temperatures of a habitat.
+
+A `ClimateSchedule` draws the temperature of every month of a run at once.
+Every species simulated in a habitat can share its schedule, so differences
+between species are never down to one of them having seen different weather.
+"""
+import random
+
+from models import MONTHS_IN_YEAR, get_season
+from sampling import is_numpy_generator
+
+# Most months stay within a few degrees of the seasonal average, but one in
+# twenty swings much further.
+FLUCTUATION_SCALE = 10
+EXTREME_FLUCTUATION_SCALE = 30
+EXTREME_FLUCTUATION_CHANCE = 0.05
+
+
+def get_fluctuation(rng=random):
+    if rng.random() < 1 - EXTREME_FLUCTUATION_CHANCE:
+        scale = FLUCTUATION_SCALE
+    else:
+        scale = EXTREME_FLUCTUATION_SCALE
+    return (rng.random() - 0.5) * scale
+
+
+def get_fluctuations(count, rng=random):
+    """
+    Draw the fluctuations of `count` consecutive months at once. A NumPy
+    generator draws the whole series as arrays.
+    """
+    if is_numpy_generator(rng):
+        scales = rng.choice(
+            (FLUCTUATION_SCALE, EXTREME_FLUCTUATION_SCALE),
+            size=count,
+            p=(1 - EXTREME_FLUCTUATION_CHANCE, EXTREME_FLUCTUATION_CHANCE),
+        )
+        return (rng.random(count) - 0.5) * scales
+    return [get_fluctuation(rng) for month in range(count)]
+
+
+class ClimateSchedule(object):
+    """
+    Temperature of every month of a run in one habitat, from the pre-drawn
+    temperature `fluctuations` of those months.
+    """
+
+    def __init__(self, habitat, fluctuations):
+        self.fluctuations = fluctuations
+        # Whether the fluctuations are those of another schedule with their
+        # signs flipped, as `get_mirrored_schedule` makes them.
+        self.mirrored = False
+        averages = [
+            habitat.average_temperatures[get_season(month)]
+            for month in range(MONTHS_IN_YEAR)
+        ]
+        if hasattr(fluctuations, 'dtype'):
+            # Fluctuations drawn by a NumPy generator stay arrays, which are
+            # only built when NumPy is installed.
+            import numpy
+            self.temperatures = fluctuations + numpy.resize(
+                averages,
+                len(fluctuations),
+            )
+        else:
+            self.temperatures = [
+                averages[month % MONTHS_IN_YEAR] + fluctuation
+                for (month, fluctuation) in enumerate(fluctuations)
+            ]
+
+    @classmethod
+    def from_habitat(cls, habitat, months, rng=random):
+        return cls(habitat, get_fluctuations(months, rng))
+
+    def get_extreme_months(self, species):
+        """
+        Return whether each month is too hot and whether each month is too
+        cold for `species`, as two sequences.
+        """
+        temperatures = self.temperatures
+        if hasattr(temperatures, 'dtype'):
+            return (
+                temperatures > species.maximum_temperature,
+                temperatures < species.minimum_temperature,
+            )
+        return (
+            [
+                temperature > species.maximum_temperature
+                for temperature in temperatures
+            ],
+            [
+                temperature < species.minimum_temperature
+                for temperature in temperatures
+            ],
+        )
+
+    def get_conditions(self, species):
+        """
+        Return the `(temperature, is_hot, is_cold)` conditions of every month
+        for `species`.
+        """
+        (hot_months, cold_months) = self.get_extreme_months(species)
+        return list(zip(self.temperatures, hot_months, cold_months))
+
+    def count_deadly_months(self, species):
+        """
+        Return the number of months in which the weather can kill `species`:
+        too hot or too cold months following a month that was too.
+        """
+        (hot, cold) = self.get_extreme_months(species)
+        if hasattr(hot, 'dtype'):
+            import numpy
+            return int(numpy.count_nonzero(
+                (hot[1:] & hot[:-1]) | (cold[1:] & cold[:-1]),
+            ))
+        return sum(
+            1
+            for month in range(1, len(hot))
+            if (hot[month] and hot[month - 1]) or
+            (cold[month] and cold[month - 1])
+        )
+
+
+def get_mirrored_schedule(habitat, climate):
+    """
+    Return the schedule of `habitat` whose fluctuations are those of
+    `climate` with their signs flipped. Fluctuations are symmetric about
+    zero, so it is as likely as `climate`, while a run in it tends to err
+    the other way.
+    """
+    fluctuations = climate.fluctuations
+    if hasattr(fluctuations, 'dtype'):
+        mirrored = ClimateSchedule(habitat, -fluctuations)
+    else:
+        mirrored = ClimateSchedule(
+            habitat,
+            [-fluctuation for fluctuation in fluctuations],
+        )
+    mirrored.mirrored = not climate.mirrored
+    return mirrored
+
+
+def get_exceedance_chance(margin):
+    """
+    Chance that the fluctuation of a month is above `margin`.
+    """
+    chance = 0.0
+    for (scale, weight) in (
+        (FLUCTUATION_SCALE, 1 - EXTREME_FLUCTUATION_CHANCE),
+        (EXTREME_FLUCTUATION_SCALE, EXTREME_FLUCTUATION_CHANCE),
+    ):
+        chance += weight * min(max(0.5 - margin / scale, 0.0), 1.0)
+    return chance
+
+
+def get_expected_deadly_months(habitat, species, months):
+    """
+    Expected value of `ClimateSchedule.count_deadly_months` over the
+    schedules of `months` months of `habitat`.
+    """
+    chances = []
+    for month in range(months):
+        average = habitat.average_temperatures[get_season(month)]
+        chances.append((
+            get_exceedance_chance(species.maximum_temperature - average),
+            # Fluctuations are symmetric, so falling below a margin is as
+            # likely as rising above its opposite.
+            get_exceedance_chance(average - species.minimum_temperature),
+        ))
+    return sum(
+        hot * previous_hot + cold * previous_cold
+        for ((hot, cold), (previous_hot, previous_cold))
+        in zip(chances[1:], chances)
+    )
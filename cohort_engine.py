@@ -0,0 +1,416 @@
+"""
+Cohort-aggregated simulation engine.
+
+Animals whose fields are all equal are interchangeable, so the population is
+stored as a mapping of `Cohort` state to head count and the checks in `models`
+are applied to a whole cohort at once. The cost of a month therefore grows
+with the number of distinct states rather than with the population.
+
+The per-animal engine hands out food and water in list order. That order is
+reproduced exactly: older litters come first, and within a litter the animals
+fed and watered most recently come first. Cohorts that share that position
+only differ by gender and are randomly interleaved, so when a resource runs
+out partway through them the fed animals are drawn without replacement. The
+two founders are the exception: the male always comes before the female.
+Other allocation policies only change that order, and random allocation
+draws the fed animals out of the whole population the same way.
+
+With an agent budget, every cohort is treated as a super-individual standing
+for `count` animals, and the number of cohorts is kept within the budget by
+merging similar ones. Random counts are then replaced by their expected
+value, rounded at random, since drawing them costs time proportional to the
+animals counted. Results are approximate, but the cost of a month is bounded
+however large the population grows.
+"""
+from collections import namedtuple
+from itertools import groupby
+import logging
+import random
+import time
+
+from climate import ClimateSchedule, get_fluctuation
+from models import (
+    ALLOCATION_FIRST_COME,
+    ALLOCATION_RANDOM,
+    ALLOCATION_YOUNGEST_FIRST,
+    GENDER_FEMALE,
+    GENDER_MALE,
+    GENDER_UNKNOWN,
+    MALE_BIRTH_RATIO,
+    MONTHS_IN_YEAR,
+    AgeCheck,
+    ColdCheck,
+    DrinkCheck,
+    FoodCheck,
+    HeatCheck,
+    ResourceCheck,
+    SimulationStep,
+    can_breed,
+    get_fed_count,
+)
+from reporting import SimulationStatistics
+from sampling import get_binomial, get_hypergeometric, get_rounded_share
+
+logger = logging.getLogger(__name__)
+
+Cohort = namedtuple('Cohort', (
+    'gender',
+    'birth_month',
+    'last_feed_month',
+    'last_drink_month',
+    'consecutive_hot_months',
+    'consecutive_cold_months',
+    'gestation_months',
+))
+
+
+def get_newborn_cohort(gender, month):
+    return Cohort(
+        gender=gender,
+        birth_month=month,
+        last_feed_month=month - 1,
+        last_drink_month=-1,
+        consecutive_hot_months=0,
+        consecutive_cold_months=0,
+        gestation_months=0,
+    )
+
+
+def get_initial_cohorts():
+    founder = get_newborn_cohort(GENDER_UNKNOWN, 0)
+    return {
+        founder._replace(gender=GENDER_MALE): 1,
+        founder._replace(gender=GENDER_FEMALE): 1,
+    }
+
+
+def is_female_founder(cohort):
+    # Only the founders are born in month 0. The male comes first in the
+    # per-animal engine's list, so he is served first.
+    return cohort.birth_month == 0 and cohort.gender == GENDER_FEMALE
+
+
+def get_position_key(cohort):
+    return (
+        cohort.birth_month,
+        -cohort.last_feed_month,
+        -cohort.last_drink_month,
+        is_female_founder(cohort),
+    )
+
+
+def get_youngest_first_key(cohort):
+    return (
+        -cohort.birth_month,
+        -cohort.last_feed_month,
+        -cohort.last_drink_month,
+        is_female_founder(cohort),
+    )
+
+
+def get_position_groups(cohorts, allocation=ALLOCATION_FIRST_COME):
+    """
+    Split `cohorts` into lists of `(cohort, count)` pairs that share a
+    position in the order the `allocation` policy serves animals, in that
+    order. Every animal is equally placed under random allocation, so all
+    cohorts then form a single group.
+    """
+    if allocation == ALLOCATION_RANDOM:
+        return [list(cohorts.items())] if cohorts else []
+
+    key = get_position_key
+    if allocation == ALLOCATION_YOUNGEST_FIRST:
+        key = get_youngest_first_key
+    items = sorted(cohorts.items(), key=lambda item: key(item[0]))
+    return [
+        list(group)
+        for (_, group) in groupby(items, key=lambda item: key(item[0]))
+    ]
+
+
+def update_group(check, group, rng=random, approximate=False):
+    """
+    Apply `check` to a position group. Returns the resulting groups in list
+    order, which are split in two when a resource runs out partway through.
+    When `approximate`, the fed animals are shared out in proportion to
+    counts instead of being drawn.
+    """
+    if isinstance(check, ResourceCheck):
+        total = sum(count for (_, count) in group)
+        fed_total = get_fed_count(check.resource, check.consumption, total)
+        if 0 < fed_total < total:
+            fed = []
+            unfed = []
+            for (cohort, count) in group:
+                if approximate:
+                    share = fed_total / total
+                    fed_count = get_rounded_share(count, share, rng)
+                else:
+                    fed_count = get_hypergeometric(
+                        total,
+                        count,
+                        fed_total,
+                        rng,
+                    )
+                total -= count
+                fed_total -= fed_count
+                if fed_count:
+                    fed += check.update_cohort(cohort, fed_count)
+                if count > fed_count:
+                    unfed.append((cohort, count - fed_count))
+            return [fed, unfed]
+
+    updated = []
+    for (cohort, count) in group:
+        updated += check.update_cohort(cohort, count)
+    return [updated]
+
+
+def advance_cohorts(
+    cohorts,
+    month,
+    species,
+    habitat,
+    rng=random,
+    fluctuation=None,
+    approximate=False,
+    conditions=None,
+    dead=None,
+):
+    """
+    Advance `cohorts` from `month` to the next month. `fluctuation` is the
+    month's temperature fluctuation, drawn from `rng` when omitted, unless the
+    month's `(temperature, is_hot, is_cold)` `conditions` are given. When
+    `approximate`, random counts are replaced by their expected value rounded
+    at random, which costs the same however many animals they count.
+
+    Returns the next cohorts (newborns included) and a mapping of death type to
+    the number of animals that died of it. When a mapping `dead` is given,
+    the number of those animals born each month is added to it by death type.
+    """
+    simulation_step = SimulationStep()
+    simulation_step.month = month
+    next_month = month + 1
+
+    if conditions is None:
+        if fluctuation is None:
+            fluctuation = get_fluctuation(rng)
+        season = simulation_step.get_current_season()
+        temperature = habitat.average_temperatures[season] + fluctuation
+        conditions = (temperature, None, None)
+    (temperature, is_hot, is_cold) = conditions
+
+    checks = [
+        AgeCheck(simulation_step, species),
+        FoodCheck(simulation_step, habitat, species),
+        DrinkCheck(simulation_step, habitat, species),
+        ColdCheck(temperature, species, is_cold),
+        HeatCheck(temperature, species, is_hot),
+    ]
+
+    groups = get_position_groups(cohorts, habitat.allocation)
+    deaths = {}
+    for check in checks:
+        alive_groups = []
+        dead_count = 0
+        for group in groups:
+            updated_groups = update_group(check, group, rng, approximate)
+            for updated_group in updated_groups:
+                alive = []
+                for (cohort, count) in updated_group:
+                    if check.is_still_alive(cohort):
+                        alive.append((cohort, count))
+                    else:
+                        dead_count += count
+                        if dead is not None:
+                            add_dead_cohort(
+                                dead,
+                                check.death_type,
+                                cohort,
+                                count,
+                            )
+                if alive:
+                    alive_groups.append(alive)
+
+        groups = alive_groups
+        if habitat.allocation == ALLOCATION_RANDOM and groups:
+            # Animals fed or not by one check are equally placed for the
+            # next one.
+            groups = [[item for group in groups for item in group]]
+        if dead_count:
+            deaths[check.death_type] = dead_count
+
+    next_cohorts = {}
+    born_count = 0
+    for group in groups:
+        for (cohort, count) in group:
+            is_female = cohort.gender == GENDER_FEMALE
+            if is_female and can_breed(cohort, species, simulation_step):
+                if cohort.gestation_months == species.gestation_months:
+                    born_count += count
+                    gestation_months = 0
+                else:
+                    gestation_months = cohort.gestation_months + 1
+                cohort = cohort._replace(gestation_months=gestation_months)
+            next_cohorts[cohort] = next_cohorts.get(cohort, 0) + count
+
+    if approximate:
+        male_count = get_rounded_share(born_count, MALE_BIRTH_RATIO, rng)
+    else:
+        male_count = get_binomial(born_count, MALE_BIRTH_RATIO, rng)
+    litter = (
+        (GENDER_MALE, male_count),
+        (GENDER_FEMALE, born_count - male_count),
+    )
+    for (gender, count) in litter:
+        if count:
+            newborn = get_newborn_cohort(gender, next_month)
+            next_cohorts[newborn] = next_cohorts.get(newborn, 0) + count
+
+    logger.debug(
+        'Month %d: temperature %d, born %d, cohorts %d',
+        next_month,
+        temperature,
+        born_count,
+        len(next_cohorts),
+    )
+
+    return (next_cohorts, deaths)
+
+
+def add_dead_cohort(dead, death_type, cohort, count):
+    birth_months = dead.setdefault(death_type, {})
+    birth_months[cohort.birth_month] = (
+        birth_months.get(cohort.birth_month, 0) + count
+    )
+
+
+def get_birth_month_counts(cohorts):
+    birth_months = {}
+    for (cohort, count) in cohorts.items():
+        birth_months[cohort.birth_month] = (
+            birth_months.get(cohort.birth_month, 0) + count
+        )
+    return birth_months
+
+
+def merge_cohorts(cohorts, budget, rng=random):
+    """
+    Merge cohorts of the same gender until at most `budget` remain.
+
+    The lightest pairs of cohorts that are neighbours in age order are merged
+    first. A merged cohort carries both counts and takes the state of one of
+    the pair, drawn in proportion to their counts, so every state keeps its
+    expected share of the population.
+
+    Splitting is left to the simulation itself: a cohort splits wherever its
+    animals' fates diverge, as when a resource runs out partway through it.
+    """
+    while len(cohorts) > budget:
+        excess = len(cohorts) - budget
+        by_gender = {}
+        for item in cohorts.items():
+            by_gender.setdefault(item[0].gender, []).append(item)
+
+        pairs = []
+        for items in by_gender.values():
+            items.sort(key=lambda item: item[0][1:])
+            pairs += zip(items, items[1:])
+        pairs.sort(key=lambda pair: pair[0][1] + pair[1][1])
+        if not pairs:
+            break
+
+        merged = set()
+        next_cohorts = dict(cohorts)
+        for ((first, first_count), (second, second_count)) in pairs:
+            if not excess:
+                break
+            if first in merged or second in merged:
+                continue
+            merged.update((first, second))
+            del next_cohorts[first]
+            del next_cohorts[second]
+            count = first_count + second_count
+            if rng.random() * count >= first_count:
+                first = second
+            next_cohorts[first] = count
+            excess -= 1
+        cohorts = next_cohorts
+
+    return cohorts
+
+
+def get_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng=random,
+    profiler=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    cohorts = get_initial_cohorts()
+    simulation_months = simulation_years * MONTHS_IN_YEAR
+    if climate is None:
+        climate = ClimateSchedule.from_habitat(habitat, simulation_months, rng)
+    conditions = climate.get_conditions(species)
+    statistics = SimulationStatistics()
+    statistics.add_step(sum(cohorts.values()), {})
+
+    for month in range(simulation_months):
+        population_count = sum(cohorts.values())
+        start = time.perf_counter()
+        dead = {} if trace is not None else None
+        (cohorts, deaths) = advance_cohorts(
+            cohorts,
+            month,
+            species,
+            habitat,
+            rng,
+            approximate=agent_budget is not None,
+            conditions=conditions[month],
+            dead=dead,
+        )
+        if agent_budget is not None and len(cohorts) > agent_budget:
+            cohorts = merge_cohorts(cohorts, agent_budget, rng)
+        if profiler is not None:
+            profiler.record_step(
+                month + 1,
+                population_count,
+                time.perf_counter() - start,
+            )
+        if series is not None:
+            series.record_step(
+                month + 1,
+                sum(cohorts.values()),
+                conditions[month][0],
+                deaths,
+            )
+        if trace is not None:
+            trace.record_step(
+                month + 1,
+                sum(cohorts.values()),
+                conditions[month][0],
+                sum(
+                    count
+                    for (cohort, count) in cohorts.items()
+                    if cohort.birth_month == month + 1
+                ),
+                deaths,
+                dead,
+            )
+        statistics.add_step(sum(cohorts.values()), deaths)
+        if steady_state is not None and steady_state.observe(statistics):
+            steady_state.project(statistics, simulation_months - month - 1)
+            break
+
+        # No reason to continue if no more animals exist
+        if not cohorts:
+            break
+
+    if trace is not None:
+        trace.record_survivors(get_birth_month_counts(cohorts))
+    return statistics
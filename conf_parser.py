@@ -1,4 +1,19 @@
+"""
+Loading of YAML environment configuration files.
+
+The whole file is validated before any simulation starts, so a mistake is
+reported with its location rather than partway through a long run. Parsed
+configurations can be kept in a `result_cache.ResultCache`, keyed by a hash
+of the file's contents, so loading an unchanged file again skips YAML parsing
+entirely.
+"""
+from collections import namedtuple
+from hashlib import sha256
+
+import yaml
+
 from models import (
+    ALLOCATIONS,
     Habitat,
     Species,
     SEASON_SPRING,
@@ -6,34 +21,262 @@ from models import (
     SEASON_FALL,
     SEASON_WINTER,
 )
+from result_cache import get_cache_key
+
+# The C loader is much faster on large files, but is only there when PyYAML
+# was built against LibYAML.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Bump whenever a change alters how configurations are parsed, so cached
+# configurations of older versions are not used.
+PARSER_VERSION = 3
+
+NUMBER = 'a number'
+INTEGER = 'an integer'
+STRING = 'a string'
+LIST = 'a list'
+MAPPING = 'a mapping'
+
+POSITIVE = 'positive'
+NOT_NEGATIVE = 'at least 0'
+
+# Configuration key, attribute it sets, expected type and allowed range of
+# every field. A range of None allows any value.
+SPECIES_FIELDS = (
+    ('life_span', 'life_span', INTEGER, POSITIVE),
+    (
+        'monthly_food_consumption',
+        'monthly_food_consumption',
+        NUMBER,
+        POSITIVE,
+    ),
+    (
+        'monthly_water_consumption',
+        'monthly_water_consumption',
+        NUMBER,
+        POSITIVE,
+    ),
+    ('minimum_temperature', 'minimum_temperature', NUMBER, None),
+    ('maximum_temperature', 'maximum_temperature', NUMBER, None),
+    ('gestation_period', 'gestation_months', INTEGER, POSITIVE),
+    ('minimum_breeding_age', 'minimum_breeding_age', INTEGER, NOT_NEGATIVE),
+)
+HABITAT_FIELDS = (
+    ('monthly_food', 'monthly_food', NUMBER, NOT_NEGATIVE),
+    ('monthly_water', 'monthly_water', NUMBER, NOT_NEGATIVE),
+)
+SEASONS = (
+    ('spring', SEASON_SPRING),
+    ('summer', SEASON_SUMMER),
+    ('fall', SEASON_FALL),
+    ('winter', SEASON_WINTER),
+)
+
+
+class ConfigurationError(ValueError):
+    """
+    Raised for a configuration file that cannot be parsed or does not match
+    the expected layout.
+    """
+
+
+def has_type(value, expected):
+    # Booleans are integers to Python, but never what a field means.
+    if isinstance(value, bool):
+        return False
+    if expected == NUMBER:
+        return isinstance(value, (int, float))
+    if expected == INTEGER:
+        return isinstance(value, int)
+    if expected == STRING:
+        return isinstance(value, str)
+    if expected == LIST:
+        return isinstance(value, list)
+    return isinstance(value, dict)
+
+
+def check_type(value, expected, location):
+    if not has_type(value, expected):
+        raise ConfigurationError('{location}: expected {expected}, got '
+                                 '{value!r}'.format(
+                                     location=location,
+                                     expected=expected,
+                                     value=value,
+                                 ))
+    return value
+
+
+def is_in_range(value, allowed):
+    if allowed == POSITIVE:
+        return value > 0
+    if allowed == NOT_NEGATIVE:
+        return value >= 0
+    return True
 
 
-def species_from_config(config):
-    attributes = config['attributes']
+def check_range(value, allowed, location):
+    if not is_in_range(value, allowed):
+        raise ConfigurationError('{location}: must be {allowed}, got '
+                                 '{value!r}'.format(
+                                     location=location,
+                                     allowed=allowed,
+                                     value=value,
+                                 ))
+    return value
 
+
+def get_field(config, key, expected, location, allowed=None):
+    """
+    Return the value of `key` in the mapping `config`, found at `location`,
+    after checking it is of the `expected` type and in the `allowed` range.
+    """
+    field_location = '{location}.{key}'.format(location=location, key=key)
+    if key not in config:
+        raise ConfigurationError('{location}: missing'.format(
+            location=field_location,
+        ))
+    value = check_type(config[key], expected, field_location)
+    return check_range(value, allowed, field_location)
+
+
+def check_keys(config, keys, location):
+    """
+    Reject keys of `config` other than `keys`, which are most likely typos.
+    """
+    unknown = sorted(str(key) for key in config if key not in keys)
+    if unknown:
+        raise ConfigurationError('{location}: unknown key {keys}'.format(
+            location=location,
+            keys=', '.join(unknown),
+        ))
+
+
+def get_items(config, key, location):
+    """
+    Yield the location and the mapping of every item of the list `key` of
+    `config`.
+    """
+    items = get_field(config, key, LIST, location)
+    for (index, item) in enumerate(items):
+        item_location = '{location}.{key}[{index:d}]'.format(
+            location=location,
+            key=key,
+            index=index,
+        )
+        yield (item_location, check_type(item, MAPPING, item_location))
+
+
+def species_from_config(config, location='species'):
+    check_keys(config, ('name', 'attributes'), location)
     species = Species()
-    species.name = config['name']
-    species.life_span = attributes['life_span']
-    species.monthly_food_consumption = attributes['monthly_food_consumption']
-    species.monthly_water_consumption = attributes['monthly_water_consumption']
-    species.minimum_temperature = attributes['minimum_temperature']
-    species.maximum_temperature = attributes['maximum_temperature']
-    species.gestation_months = attributes['gestation_period']
-    species.minimum_breeding_age = attributes['minimum_breeding_age']
+    species.name = get_field(config, 'name', STRING, location)
+
+    attributes = get_field(config, 'attributes', MAPPING, location)
+    location += '.attributes'
+    check_keys(attributes, [key for (key, *_) in SPECIES_FIELDS], location)
+    for (key, attribute, expected, allowed) in SPECIES_FIELDS:
+        setattr(
+            species,
+            attribute,
+            get_field(attributes, key, expected, location, allowed),
+        )
 
     return species
 
 
-def habitat_from_config(config):
+def habitat_from_config(config, location='habitat'):
+    keys = ['name', 'average_temperature', 'allocation']
+    keys += [key for (key, *_) in HABITAT_FIELDS]
+    check_keys(config, keys, location)
     habitat = Habitat()
-    habitat.name = config['name']
-    habitat.monthly_food = config['monthly_food']
-    habitat.monthly_water = config['monthly_water']
+    habitat.name = get_field(config, 'name', STRING, location)
+    for (key, attribute, expected, allowed) in HABITAT_FIELDS:
+        setattr(
+            habitat,
+            attribute,
+            get_field(config, key, expected, location, allowed),
+        )
+    if 'allocation' in config:
+        allocation = get_field(config, 'allocation', STRING, location)
+        if allocation not in ALLOCATIONS:
+            raise ConfigurationError('{location}.allocation: expected one of '
+                                     '{allocations}, got {value!r}'.format(
+                                         location=location,
+                                         allocations=', '.join(ALLOCATIONS),
+                                         value=allocation,
+                                     ))
+        habitat.allocation = allocation
 
-    config_temperatures = config['average_temperature']
-    habitat.average_temperatures[SEASON_SPRING] = config_temperatures['spring']
-    habitat.average_temperatures[SEASON_SUMMER] = config_temperatures['summer']
-    habitat.average_temperatures[SEASON_FALL] = config_temperatures['fall']
-    habitat.average_temperatures[SEASON_WINTER] = config_temperatures['winter']
+    config_temperatures = get_field(
+        config,
+        'average_temperature',
+        MAPPING,
+        location,
+    )
+    location += '.average_temperature'
+    check_keys(config_temperatures, [key for (key, _) in SEASONS], location)
+    for (key, season) in SEASONS:
+        habitat.average_temperatures[season] = get_field(
+            config_temperatures,
+            key,
+            NUMBER,
+            location,
+        )
 
     return habitat
+
+
+Configuration = namedtuple('Configuration', ('years', 'species', 'habitats'))
+
+
+def configuration_from_config(config):
+    location = 'configuration'
+    check_type(config, MAPPING, location)
+    check_keys(config, ('years', 'species', 'habitats'), location)
+    years = get_field(config, 'years', INTEGER, location, NOT_NEGATIVE)
+
+    return Configuration(
+        years=years,
+        species=tuple(
+            species_from_config(species_config, species_location)
+            for (species_location, species_config)
+            in get_items(config, 'species', location)
+        ),
+        habitats=tuple(
+            habitat_from_config(habitat_config, habitat_location)
+            for (habitat_location, habitat_config)
+            in get_items(config, 'habitats', location)
+        ),
+    )
+
+
+def load_configuration(path, cache=None):
+    """
+    Parse and validate the YAML environment configuration file at `path`.
+
+    Raises `ConfigurationError` when the file is not a valid configuration.
+    When a `ResultCache` is given, a configuration parsed from the same
+    contents before is returned from it.
+    """
+    with open(path, 'rb') as config_file:
+        data = config_file.read()
+
+    key = None
+    if cache is not None:
+        key = get_cache_key({
+            'configuration': sha256(data).hexdigest(),
+            'parser_version': PARSER_VERSION,
+        })
+        configuration = cache.get(key)
+        if configuration is not None:
+            return configuration
+
+    try:
+        config = yaml.load(data, Loader=SafeLoader)
+    except yaml.YAMLError as error:
+        raise ConfigurationError(str(error))
+    configuration = configuration_from_config(config)
+
+    if cache is not None:
+        cache.put(key, configuration)
+    return configuration
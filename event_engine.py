@@ -0,0 +1,449 @@
+"""
+Event-driven simulation engine.
+
+In most months of a sparse population nothing can happen: there is food and
+water for everyone, nobody reaches their life span, no litter is due and the
+weather cannot kill. Every outcome of such a month is known in advance, so
+this engine keeps a priority queue of the months in which one can change and
+jumps from one to the next without touching the animals in between, adding
+the months skipped to the statistics in bulk. The months queued are the due
+months of every female's litters, the months in which animals reach their
+life span and the second months of a run of too hot or too cold months in
+the climate schedule. Since the population only changes in those months, so
+does whether food or water runs short, and a month in which it does is
+always simulated.
+
+Months in which food or water runs short or the weather can kill run every
+check of `models` on every animal, as `main.advance()` does. Other queued
+months only remove the animals that reached their life span and add the
+litters due. Gestation is a fixed cycle once a female is old enough to
+breed, so her litters are scheduled from her birth month alone, and the
+feeding and temperature counters left by skipped months are only written
+back to the animals before a fully simulated month.
+
+Results match those of the object engine seed for seed, except under random
+allocation, where the object engine shuffles the animals even in months in
+which all of them are fed.
+"""
+import heapq
+import logging
+import random
+import time
+
+from climate import ClimateSchedule
+from models import (
+    DEATH_OLD_AGE,
+    GENDER_FEMALE,
+    GENDER_MALE,
+    MALE_BIRTH_RATIO,
+    MONTHS_IN_YEAR,
+    AgeCheck,
+    Animal,
+    ColdCheck,
+    DrinkCheck,
+    FoodCheck,
+    HeatCheck,
+    SimulationStep,
+    count_born_before,
+    get_fed_count,
+)
+from reporting import SimulationStatistics
+
+logger = logging.getLogger(__name__)
+
+EVENT_LITTER = 'litter'
+EVENT_OLD_AGE = 'old age'
+EVENT_WEATHER = 'weather'
+
+
+def get_first_litter_month(birth_month, species):
+    """
+    Month in which a female born in `birth_month` gives birth for the first
+    time. Her gestation counter starts once she is old enough to breed, and
+    she gives birth every `gestation_months + 1` months from then on.
+    """
+    breeding_months = species.minimum_breeding_age * MONTHS_IN_YEAR
+    return birth_month + breeding_months + species.gestation_months
+
+
+def get_next_litter_month(birth_month, month, species):
+    """
+    First month from `month` on in which a female born in `birth_month`
+    gives birth.
+    """
+    first_month = get_first_litter_month(birth_month, species)
+    if month <= first_month:
+        return first_month
+    return month + (first_month - month) % (species.gestation_months + 1)
+
+
+def get_weather_months(conditions):
+    """
+    Yield the months of `conditions` that can kill, the second and later
+    months of a run of too hot or too cold months.
+    """
+    for month in range(1, len(conditions)):
+        (_, is_hot, is_cold) = conditions[month]
+        (_, was_hot, was_cold) = conditions[month - 1]
+        if (is_hot and was_hot) or (is_cold and was_cold):
+            yield month
+
+
+def get_newborns(count, month, rng=random):
+    # Drawn exactly as `main.get_new_animals_from_breeding` draws them, so
+    # both engines give the same litters.
+    genders = rng.choices(
+        (GENDER_MALE, GENDER_FEMALE),
+        cum_weights=(MALE_BIRTH_RATIO, 1),
+        k=count,
+    )
+    last_feed_month = month - 1
+    newborns = []
+    for gender in genders:
+        newborn = Animal()
+        newborn.birth_month = month
+        newborn.last_feed_month = last_feed_month
+        newborn.gender = gender
+        newborns.append(newborn)
+    return newborns
+
+
+class EventQueue(object):
+    """
+    Priority queue of the months in which an outcome can change.
+
+    The heap holds months and event types only. The females due to give
+    birth in a month are listed apart, under that month, so a month of
+    litters costs one heap entry however many females give birth in it.
+    """
+
+    def __init__(self, species, simulation_months):
+        self.species = species
+        self.simulation_months = simulation_months
+        self.events = []
+        # Mothers due to give birth, by month.
+        self.litters = {}
+        # Ids of the live females. The litters of the dead are left in
+        # `litters` and dropped when their month comes, which keeps the
+        # dead animal, and so its id, alive until then.
+        self.females = set()
+
+    def push(self, month, event, animal=None):
+        if month >= self.simulation_months:
+            return
+        if event == EVENT_LITTER:
+            mothers = self.litters.get(month)
+            if mothers is not None:
+                mothers.append(animal)
+                return
+            self.litters[month] = [animal]
+        heapq.heappush(self.events, (month, event))
+
+    def pop_month(self, month):
+        """
+        Remove the events of `month`. Returns their types and the females
+        alive that are due to give birth in it.
+        """
+        events = set()
+        while self.events and self.events[0][0] == month:
+            events.add(heapq.heappop(self.events)[1])
+        mothers = []
+        if EVENT_LITTER in events:
+            females = self.females
+            mothers = [
+                female
+                for female in self.litters.pop(month)
+                if id(female) in females
+            ]
+        return (events, mothers)
+
+    def get_next_month(self):
+        if self.events:
+            return self.events[0][0]
+        return self.simulation_months
+
+    def add_newborns(self, newborns):
+        lifespan_months = self.species.life_span * MONTHS_IN_YEAR
+        if newborns:
+            # Animals born the same month reach their life span together.
+            self.push(newborns[0].birth_month + lifespan_months, EVENT_OLD_AGE)
+        for newborn in newborns:
+            if newborn.gender == GENDER_FEMALE:
+                self.females.add(id(newborn))
+                self.add_litter(
+                    newborn,
+                    get_first_litter_month(newborn.birth_month, self.species),
+                )
+
+    def add_litter(self, female, month):
+        # A female gives birth only while she is alive, and she dies of old
+        # age in the month she reaches her life span.
+        lifespan_months = self.species.life_span * MONTHS_IN_YEAR
+        if month < female.birth_month + lifespan_months:
+            self.push(month, EVENT_LITTER, female)
+
+    def remove_animals(self, animals):
+        for animal in animals:
+            self.females.discard(id(animal))
+
+    def give_birth(self, mothers, month):
+        """
+        Schedule the next litters of the `mothers` due in `month` that are
+        still alive, and return how many of them give birth.
+        """
+        females = self.females
+        mothers = [female for female in mothers if id(female) in females]
+        for female in mothers:
+            self.add_litter(
+                female,
+                month + self.species.gestation_months + 1,
+            )
+        return len(mothers)
+
+
+def is_short_of_resources(population, species, habitat):
+    """
+    Whether the food or water of `habitat` runs out before every one of
+    `population` animals has had their share.
+    """
+    resources = (
+        (habitat.monthly_food, species.monthly_food_consumption),
+        (habitat.monthly_water, species.monthly_water_consumption),
+    )
+    return any(
+        get_fed_count(resource, consumption, population) < population
+        for (resource, consumption) in resources
+    )
+
+
+def settle_animals(animals, month, conditions):
+    """
+    Write back to `animals` the counters left by a month `month` in which
+    every animal alive was fed and watered and the weather killed nobody.
+    Animals born at the end of that month were not there for it.
+    """
+    (_, is_hot, is_cold) = conditions
+    # Every animal shares one int object for each counter, as the checks'
+    # own updates do, rather than getting a copy of its own.
+    next_month = month + 1
+    hot_months = int(is_hot)
+    cold_months = int(is_cold)
+    for animal in animals[:count_born_before(animals, next_month)]:
+        animal.last_feed_month = next_month
+        animal.last_drink_month = next_month
+        animal.consecutive_hot_months = hot_months
+        animal.consecutive_cold_months = cold_months
+
+
+def simulate_month(
+    animals,
+    month,
+    species,
+    habitat,
+    rng,
+    conditions,
+    profiler=None,
+):
+    """
+    Run every check on every one of `animals` in `month`, as
+    `main.advance()` does. Returns the survivors and a mapping of death type
+    to the animals that died of it.
+    """
+    simulation_step = SimulationStep()
+    simulation_step.month = month
+    (temperature, is_hot, is_cold) = conditions
+    checks = [
+        AgeCheck(simulation_step, species),
+        FoodCheck(simulation_step, habitat, species),
+        DrinkCheck(simulation_step, habitat, species),
+        ColdCheck(temperature, species, is_cold),
+        HeatCheck(temperature, species, is_hot),
+    ]
+    if profiler is not None:
+        checks = [profiler.wrap_check(check) for check in checks]
+
+    dead = {}
+    for check in checks:
+        check.update_all(animals, rng)
+        (animals, dead_animals) = check.separate(animals)
+        if dead_animals:
+            dead[check.death_type] = dead_animals
+    return (animals, dead)
+
+
+def record_quiet_months(series, trace, population, conditions, start, stop):
+    """
+    Record months `start` to `stop` in which nothing happened to the
+    `population` animals, for the engines' per-month outputs.
+    """
+    if series is None and trace is None:
+        return
+    for month in range(start, stop):
+        if series is not None:
+            series.record_step(month + 1, population, conditions[month][0], {})
+        if trace is not None:
+            trace.record_step(
+                month + 1,
+                population,
+                conditions[month][0],
+                0,
+                {},
+                {},
+            )
+
+
+def get_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng=random,
+    profiler=None,
+    steady_state=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    simulation_months = simulation_years * MONTHS_IN_YEAR
+    if climate is None:
+        climate = ClimateSchedule.from_habitat(habitat, simulation_months, rng)
+    conditions = climate.get_conditions(species)
+
+    male = Animal()
+    male.gender = GENDER_MALE
+    female = Animal()
+    female.gender = GENDER_FEMALE
+    animals = [male, female]
+
+    queue = EventQueue(species, simulation_months)
+    for month in get_weather_months(conditions):
+        queue.push(month, EVENT_WEATHER)
+    queue.add_newborns(animals)
+
+    statistics = SimulationStatistics()
+    statistics.add_step(len(animals), {})
+    # Last month skipped or simulated without a full check of the animals
+    # since the last fully simulated one, whose counters are not written
+    # back yet.
+    settled_month = None
+    lifespan_months = species.life_span * MONTHS_IN_YEAR
+    month = 0
+
+    while month < simulation_months:
+        population_count = len(animals)
+        start = time.perf_counter()
+        dead = {}
+        (events, mothers) = queue.pop_month(month)
+        is_deadly = EVENT_WEATHER in events
+        if is_deadly or is_short_of_resources(len(animals), species, habitat):
+            if settled_month is not None:
+                settle_animals(
+                    animals,
+                    settled_month,
+                    conditions[settled_month],
+                )
+                settled_month = None
+            (animals, dead) = simulate_month(
+                animals,
+                month,
+                species,
+                habitat,
+                rng,
+                conditions[month],
+                profiler,
+            )
+        else:
+            old_count = count_born_before(
+                animals,
+                month + 1 - lifespan_months,
+            )
+            if old_count:
+                dead[DEATH_OLD_AGE] = animals[:old_count]
+                del animals[:old_count]
+            settled_month = month
+        for dead_animals in dead.values():
+            queue.remove_animals(dead_animals)
+
+        litter_count = queue.give_birth(mothers, month)
+        newborns = get_newborns(litter_count, month + 1, rng)
+        animals += newborns
+        queue.add_newborns(newborns)
+        next_month = queue.get_next_month()
+        if is_short_of_resources(len(animals), species, habitat):
+            next_month = month + 1
+        if profiler is not None:
+            profiler.record_step(
+                month + 1,
+                population_count,
+                time.perf_counter() - start,
+            )
+
+        deaths = {
+            death_type: len(dead_animals)
+            for (death_type, dead_animals) in dead.items()
+        }
+        if series is not None:
+            series.record_step(
+                month + 1,
+                len(animals),
+                conditions[month][0],
+                deaths,
+            )
+        if trace is not None:
+            trace.record_step(
+                month + 1,
+                len(animals),
+                conditions[month][0],
+                len(newborns),
+                deaths,
+                {
+                    death_type: [animal.birth_month for animal in dead_animals]
+                    for (death_type, dead_animals) in dead.items()
+                },
+            )
+        statistics.add_step(len(animals), deaths)
+        month += 1
+        if steady_state is not None and steady_state.observe(statistics):
+            steady_state.project(statistics, simulation_months - month)
+            break
+
+        # No reason to continue if no more animals exist
+        if not animals:
+            break
+
+        # Nothing can change before the next queued month, so the months in
+        # between are added in stretches of unchanged population.
+        if month < next_month:
+            settled_month = next_month - 1
+        while month < next_month:
+            stretch_end = next_month
+            if steady_state is not None:
+                # Steady states are only checked at the end of a year.
+                stretch_end = min(
+                    stretch_end,
+                    month + MONTHS_IN_YEAR -
+                    statistics.step_count % MONTHS_IN_YEAR,
+                )
+            record_quiet_months(
+                series,
+                trace,
+                len(animals),
+                conditions,
+                month,
+                stretch_end,
+            )
+            statistics.add_steps(len(animals), stretch_end - month)
+            if steady_state is not None and steady_state.observe(
+                statistics,
+                stretch_end - month,
+            ):
+                steady_state.project(
+                    statistics,
+                    simulation_months - stretch_end,
+                )
+                month = simulation_months
+                break
+            month = stretch_end
+
+    if trace is not None:
+        trace.record_survivors([animal.birth_month for animal in animals])
+    return statistics
@@ -0,0 +1,44 @@
+from hashlib import sha256
+import json
+import os
+import re
+import tempfile
+
+
+def write_atomically(path, data):
+    """
+    Write the bytes `data` to `path` atomically: the file is written next to
+    its destination and renamed over it, so readers and interrupted writers
+    never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    (descriptor, temporary_path) = tempfile.mkstemp(
+        dir=directory,
+        suffix='.tmp',
+    )
+    try:
+        with os.fdopen(descriptor, 'wb') as output_file:
+            output_file.write(data)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def get_run_file_name(species, habitat, replicate, suffix):
+    """
+    Name of the file of one replicate of `species` in `habitat`. Names are
+    made safe for the file system, and a short hash of them as given keeps
+    apart the runs whose names would otherwise end up the same.
+    """
+    names = json.dumps([species.name, habitat.name])
+    name = '{species}-{habitat}-{replicate:d}-{digest}{suffix}'.format(
+        species=species.name,
+        habitat=habitat.name,
+        replicate=replicate,
+        digest=sha256(names.encode()).hexdigest()[:8],
+        suffix=suffix,
+    )
+    return re.sub(r'[^\w.-]', '_', name)
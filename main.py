@@ -1,30 +1,91 @@
 from argparse import ArgumentParser
+from contextlib import closing, nullcontext
+from itertools import product
+import json
 import os.path
-import yaml
 import logging
 from models import (
-    DEATH_OLD_AGE,
-    DEATH_STARVATION,
-    DEATH_THIRST,
-    DEATH_TOO_COLD,
-    DEATH_TOO_HOT,
     GENDER_MALE,
     GENDER_FEMALE,
-    MONTHS_IN_YEAR,
+    MALE_BIRTH_RATIO,
+    ALLOCATIONS,
     SimulationStep,
     Animal,
+    AnimalPool,
     AgeCheck,
     FoodCheck,
     DrinkCheck,
     HeatCheck,
     ColdCheck,
+    count_born_before,
+    get_breeding_animals,
 )
 import sys
-from random import random
-from conf_parser import habitat_from_config, species_from_config
-
+import random
+import time
+from climate import (
+    ClimateSchedule,
+    get_expected_deadly_months,
+    get_fluctuation,
+    get_mirrored_schedule,
+)
+from checkpoint import (
+    DEFAULT_INTERVAL,
+    Checkpoint,
+    Checkpointer,
+    get_checkpoint_path,
+)
+from conf_parser import ConfigurationError, load_configuration
+from profiling import Profiler, add_shared_timing
+from replicates import (
+    REDUCTION_ANTITHETIC,
+    REDUCTION_COMMON,
+    REDUCTION_CONTROL,
+    REDUCTIONS,
+    get_climate_seed,
+    get_replicate_seed,
+    write_replicate_report,
+)
+from reporting import (
+    FORMAT_TEXT,
+    FORMATS,
+    RUN_FIELDS,
+    SERIES_FIELDS,
+    SimulationStatistics,
+    TimeSeries,
+    get_record_writer,
+    get_run_record,
+    write_simulation_report,
+)
+from steady_state import (
+    DEFAULT_TOLERANCE,
+    DEFAULT_WINDOW_YEARS,
+    SteadyStateDetector,
+)
+from tracing import TraceWriter, get_trace_path
+from result_cache import (
+    DEFAULT_MAX_BYTES,
+    ResultCache,
+    get_cache_key,
+    get_default_cache_directory,
+    run_cached,
+)
 
-male_ratio = 0.5
+ENGINE_OBJECT = 'object'
+ENGINE_NUMPY = 'numpy'
+ENGINE_COHORT = 'cohort'
+ENGINE_BATCH = 'batch'
+ENGINE_EVENT = 'event'
+ENGINES = (
+    ENGINE_OBJECT,
+    ENGINE_NUMPY,
+    ENGINE_COHORT,
+    ENGINE_BATCH,
+    ENGINE_EVENT,
+)
+# Bump whenever a change alters simulation results, so cached results of
+# earlier versions are no longer used.
+ENGINE_VERSION = 4
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -71,22 +132,426 @@ def get_max_population(simulation_steps):
     return max(generator, default=0)
 
 
-def simulate_species_in_habitat(species, habitat, simulation_years):
-    simulation_step = get_initial_simulation_step()
-    simulation_steps = [simulation_step]
+def simulate_species_in_habitat(
+    species,
+    habitat,
+    simulation_years,
+    rng=random,
+):
+    return list(
+        iterate_simulation_steps(species, habitat, simulation_years, rng),
+    )
 
-    for month in range(simulation_years * 12):
-        simulation_step = advance(simulation_step, species, habitat)
-        simulation_steps.append(simulation_step)
+
+def iterate_simulation_steps(
+    species,
+    habitat,
+    simulation_years,
+    rng=random,
+    pool=None,
+    profiler=None,
+    initial_step=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    """
+    Yield each `SimulationStep` as it is produced. Only the current step is
+    kept alive, so memory does not grow with the number of simulated months.
+    Newborns are taken from `pool` when one is given, every month is timed by
+    `profiler` and recorded in the `TimeSeries` `series` and the
+    `TraceWriter` `trace` when they are given.
+    Temperatures come from the `ClimateSchedule` `climate`, which is drawn
+    from `rng` when omitted.
+
+    A run resumed from `initial_step` does not yield that step again, and
+    continues with the run's original `climate`.
+    """
+    if initial_step is None:
+        simulation_step = get_initial_simulation_step()
+        yield simulation_step
+    else:
+        simulation_step = initial_step
+
+    simulation_months = simulation_years * 12
+    if climate is None:
+        climate = ClimateSchedule.from_habitat(habitat, simulation_months, rng)
+    conditions = climate.get_conditions(species)
+    for month in range(simulation_step.month, simulation_months):
+        population = len(simulation_step.animals)
+        start = time.perf_counter()
+        simulation_step = advance(
+            simulation_step,
+            species,
+            habitat,
+            rng,
+            pool=pool,
+            profiler=profiler,
+            conditions=conditions[month],
+        )
+        if profiler is not None:
+            profiler.record_step(
+                simulation_step.month,
+                population,
+                time.perf_counter() - start,
+            )
+        if series is not None:
+            series.record_step(
+                simulation_step.month,
+                len(simulation_step.animals),
+                conditions[month][0],
+                {
+                    death_type: len(animals)
+                    for (death_type, animals)
+                    in simulation_step.deaths.items()
+                },
+            )
+        if trace is not None:
+            record_traced_step(trace, simulation_step, conditions[month][0])
+        yield simulation_step
 
         # No reason to continue if no more animals exist
         if not simulation_step.animals:
             break
 
-    return simulation_steps
+    if trace is not None:
+        trace.record_survivors(
+            [animal.birth_month for animal in simulation_step.animals],
+        )
+
 
+def record_traced_step(trace, simulation_step, temperature):
+    month = simulation_step.month
+    animals = simulation_step.animals
+    trace.record_step(
+        month,
+        len(animals),
+        temperature,
+        # Newborns are the last animals, born in the step's month.
+        len(animals) - count_born_before(animals, month),
+        {
+            death_type: len(dead)
+            for (death_type, dead) in simulation_step.deaths.items()
+        },
+        {
+            death_type: [animal.birth_month for animal in dead]
+            for (death_type, dead) in simulation_step.deaths.items()
+        },
+    )
 
-def advance(simulation_step, species, habitat):
+
+def get_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng=random,
+    profiler=None,
+    checkpointer=None,
+    steady_state=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    if checkpointer is not None:
+        return get_checkpointed_simulation_statistics(
+            species,
+            habitat,
+            simulation_years,
+            rng,
+            checkpointer,
+            profiler,
+            climate,
+        )
+
+    pool = AnimalPool()
+    simulation_steps = iterate_simulation_steps(
+        species,
+        habitat,
+        simulation_years,
+        rng,
+        pool,
+        profiler,
+        climate=climate,
+        series=series,
+        trace=trace,
+    )
+    if steady_state is None:
+        return get_statistics_from_steps(simulation_steps, pool)
+
+    statistics = SimulationStatistics()
+    simulation_months = simulation_years * 12
+    for simulation_step in simulation_steps:
+        add_step_to_statistics(statistics, simulation_step, pool)
+        if simulation_step.month and steady_state.observe(statistics):
+            steady_state.project(
+                statistics,
+                simulation_months - simulation_step.month,
+            )
+            break
+    return statistics
+
+
+def get_checkpointed_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng,
+    checkpointer,
+    profiler=None,
+    climate=None,
+):
+    """
+    Run a simulation that saves a checkpoint every `checkpointer.interval`
+    months and, when resuming, continues from the last saved checkpoint.
+    """
+    checkpoint = checkpointer.load()
+    initial_step = None
+    if checkpoint is None:
+        statistics = SimulationStatistics()
+        if climate is None:
+            climate = ClimateSchedule.from_habitat(
+                habitat,
+                simulation_years * 12,
+                rng,
+            )
+    elif checkpoint.finished:
+        return checkpoint.statistics
+    else:
+        logger.info(
+            'Resuming %s from month %d',
+            checkpointer.path,
+            checkpoint.month,
+        )
+        initial_step = checkpoint.get_simulation_step()
+        statistics = checkpoint.statistics
+        climate = ClimateSchedule(habitat, checkpoint.fluctuations)
+        rng.setstate(checkpoint.rng_state)
+
+    pool = AnimalPool()
+    simulation_steps = iterate_simulation_steps(
+        species,
+        habitat,
+        simulation_years,
+        rng,
+        pool,
+        profiler,
+        initial_step,
+        climate,
+    )
+    for simulation_step in simulation_steps:
+        add_step_to_statistics(statistics, simulation_step, pool)
+        if checkpointer.is_due(simulation_step.month):
+            checkpointer.save(Checkpoint.from_simulation_step(
+                simulation_step,
+                statistics,
+                rng,
+                climate.fluctuations,
+            ))
+
+    checkpoint = Checkpoint()
+    checkpoint.statistics = statistics
+    checkpoint.finished = True
+    checkpointer.save(checkpoint)
+    return statistics
+
+
+def get_engine(name):
+    """
+    Return the function used to simulate a species in a habitat. Every engine
+    takes `(species, habitat, simulation_years, rng, profiler=None,
+    steady_state=None, climate=None, series=None, trace=None)` and returns
+    `SimulationStatistics`.
+    """
+    if name == ENGINE_NUMPY:
+        # NumPy is only needed for this engine, so import it on demand.
+        import numpy_engine
+        return numpy_engine.get_simulation_statistics
+    if name == ENGINE_COHORT:
+        import cohort_engine
+        return cohort_engine.get_simulation_statistics
+    if name == ENGINE_BATCH:
+        import batch_engine
+        return batch_engine.get_simulation_statistics
+    if name == ENGINE_EVENT:
+        import event_engine
+        return event_engine.get_simulation_statistics
+    return get_simulation_statistics
+
+
+def get_random_generator(engine_name, seed=None):
+    """
+    Return the random number generator an engine draws from, seeded with
+    `seed`. Without a seed the generator is seeded from the operating system.
+    """
+    if engine_name in (ENGINE_NUMPY, ENGINE_BATCH):
+        import numpy
+        return numpy.random.default_rng(seed)
+    return random.Random(seed)
+
+
+def run_simulation(
+    engine_name,
+    species,
+    habitat,
+    simulation_years,
+    seed=None,
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+):
+    simulate = get_engine(engine_name)
+    rng = get_random_generator(engine_name, seed)
+    options = get_engine_options(
+        checkpointer,
+        steady_state,
+        agent_budget,
+        climate,
+    )
+    return simulate(species, habitat, simulation_years, rng, **options)
+
+
+def get_engine_options(
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    # Not every engine takes every option, so options are only passed when
+    # they are used.
+    options = {}
+    if checkpointer is not None:
+        options['checkpointer'] = checkpointer
+    if steady_state is not None:
+        options['steady_state'] = steady_state
+    if agent_budget is not None:
+        options['agent_budget'] = agent_budget
+    if climate is not None:
+        options['climate'] = climate
+    if series is not None:
+        options['series'] = series
+    if trace is not None:
+        options['trace'] = trace
+    return options
+
+
+def run_profiled_simulation(
+    engine_name,
+    species,
+    habitat,
+    simulation_years,
+    seed=None,
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+):
+    """
+    Like `run_simulation`, but also return a profile summary of the run.
+    """
+    simulate = get_engine(engine_name)
+    rng = get_random_generator(engine_name, seed)
+    profiler = Profiler()
+    options = get_engine_options(
+        checkpointer,
+        steady_state,
+        agent_budget,
+        climate,
+    )
+    with profiler.time_logging():
+        statistics = simulate(
+            species,
+            habitat,
+            simulation_years,
+            rng,
+            profiler,
+            **options
+        )
+
+    summary = profiler.get_summary()
+    summary.update(
+        engine=engine_name,
+        species=species.name,
+        habitat=habitat.name,
+        seed=seed,
+    )
+    return (statistics, summary)
+
+
+def run_series_simulation(
+    engine_name,
+    species,
+    habitat,
+    simulation_years,
+    seed=None,
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+):
+    """
+    Like `run_simulation`, but also return the `TimeSeries` of the run.
+    """
+    simulate = get_engine(engine_name)
+    rng = get_random_generator(engine_name, seed)
+    series = TimeSeries()
+    options = get_engine_options(
+        checkpointer,
+        steady_state,
+        agent_budget,
+        climate,
+        series,
+    )
+    statistics = simulate(species, habitat, simulation_years, rng, **options)
+    return (statistics, series)
+
+
+def run_traced_simulation(
+    engine_name,
+    species,
+    habitat,
+    simulation_years,
+    seed=None,
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+    trace_path=None,
+):
+    """
+    Like `run_simulation`, but also write a trace of the run to the
+    directory `trace_path`.
+    """
+    simulate = get_engine(engine_name)
+    rng = get_random_generator(engine_name, seed)
+    with TraceWriter(trace_path) as trace:
+        options = get_engine_options(
+            checkpointer,
+            steady_state,
+            agent_budget,
+            climate,
+            trace=trace,
+        )
+        return simulate(species, habitat, simulation_years, rng, **options)
+
+
+def advance(
+    simulation_step,
+    species,
+    habitat,
+    rng=random,
+    fluctuation=None,
+    pool=None,
+    profiler=None,
+    conditions=None,
+):
+    """
+    Advance `simulation_step` by a month. The month's temperature fluctuation
+    is drawn from `rng` unless `fluctuation`, or the month's precomputed
+    `(temperature, is_hot, is_cold)` `conditions`, are given.
+    """
     next_step = SimulationStep()
 
     next_month = simulation_step.month + 1
@@ -100,46 +565,55 @@ def advance(simulation_step, species, habitat):
     food_check = FoodCheck(simulation_step, habitat, species)
     drink_check = DrinkCheck(simulation_step, habitat, species)
 
-    fluctuation = get_fluctuation()
-
-    season = simulation_step.get_current_season()
-    temperature = habitat.average_temperatures[season] + fluctuation
-    logger.debug(
-        'Current temperature: %d (%d%+d)',
-        temperature,
-        habitat.average_temperatures[season],
-        fluctuation,
-    )
+    if conditions is None:
+        if fluctuation is None:
+            fluctuation = get_fluctuation(rng)
+        season = simulation_step.get_current_season()
+        temperature = habitat.average_temperatures[season] + fluctuation
+        conditions = (temperature, None, None)
+    (temperature, is_hot, is_cold) = conditions
+    logger.debug('Current temperature: %d', temperature)
 
-    heat_check = HeatCheck(temperature, species)
-    cold_check = ColdCheck(temperature, species)
+    heat_check = HeatCheck(temperature, species, is_hot)
+    cold_check = ColdCheck(temperature, species, is_cold)
 
     checks = [age_check, food_check, drink_check, cold_check, heat_check]
+    if profiler is not None:
+        checks = [profiler.wrap_check(check) for check in checks]
 
-    for check in checks:
-        for animal in alive_animals:
-            check.update(animal)
-
-        (alive_animals, dead_animals) = separate_alive_from_dead(
-            alive_animals,
-            lambda animal: check.is_still_alive(animal),
-        )
+    (alive_animals, dead_animals_by_check) = apply_checks(
+        alive_animals,
+        checks,
+        rng,
+    )
 
+    for (check, dead_animals) in zip(checks, dead_animals_by_check):
         if dead_animals:
             logger.debug('Deaths due to %s: %d', check.name, len(dead_animals))
             next_step.deaths[check.death_type] = dead_animals
 
     next_step.animals = alive_animals
 
-    # TODO: Probably should add a test condition, to not spawn if there are
-    # no males
-    females = tuple(
-        animal
-        for animal in next_step.animals
-        if animal.gender == GENDER_FEMALE
-    )
+    breeding_timer = nullcontext()
+    if profiler is not None:
+        breeding_timer = profiler.time('breeding')
+
+    with breeding_timer:
+        # TODO: Probably should add a test condition, to not spawn if there
+        # are no males
+        females = tuple(
+            animal
+            for animal in get_breeding_animals(
+                next_step.animals,
+                species,
+                simulation_step,
+            )
+            if animal.gender == GENDER_FEMALE
+        )
 
-    born_animals = tuple(breed_animals(females, species, simulation_step))
+        born_animals = tuple(
+            breed_animals(females, species, simulation_step, rng, pool),
+        )
     logger.debug('Animals born: %d', len(born_animals))
     next_step.animals += born_animals
 
@@ -148,19 +622,40 @@ def advance(simulation_step, species, habitat):
     return next_step
 
 
-def breed_animals(animals, species, simulation_step):
+def apply_checks(animals, checks, rng=random):
+    """
+    Run `animals` through `checks` in turn. Every check sees all the animals
+    that survived the earlier checks, in list order, so a resource check can
+    hand out its resource in one step following its allocation policy.
+    Returns the surviving animals and, for each check, the animals that died
+    of it.
+    """
+    dead_by_check = []
+    for check in checks:
+        check.update_all(animals, rng)
+        (animals, dead) = check.separate(animals)
+        dead_by_check.append(dead)
+    return (animals, dead_by_check)
+
+
+def breed_animals(animals, species, simulation_step, rng=random, pool=None):
+    """
+    Advance the gestation of the females `animals`, which are in order of
+    birth, that are old enough to breed, and return the newborns.
+    """
     new_animal_count = 0
-    for animal in animals:
-        if can_breed(animal, species, simulation_step):
-            if animal.gestation_months == species.gestation_months:
-                new_animal_count += 1
-                animal.gestation_months = 0
-            else:
-                animal.gestation_months += 1
+    for animal in get_breeding_animals(animals, species, simulation_step):
+        if animal.gestation_months == species.gestation_months:
+            new_animal_count += 1
+            animal.gestation_months = 0
+        else:
+            animal.gestation_months += 1
 
     return get_new_animals_from_breeding(
         new_animal_count,
         simulation_step.month + 1,
+        rng,
+        pool,
     )
 
 
@@ -175,129 +670,515 @@ def separate_alive_from_dead(animals, is_animal_alive):
     return (alive, dead)
 
 
-def get_new_animals_from_breeding(count, month):
-    for female in range(count):
-        gender = get_new_animal_gender()
-
-        born_animal = Animal()
-        born_animal.birth_month = month
-        born_animal.last_feed_month = month - 1
-        born_animal.gender = gender
-
-        yield born_animal
-
-
-def get_fluctuation():
-    scale = 10 if random() < 0.95 else 30
-    return (random() - 0.5) * scale
-
-
-def can_breed(animal, species, simulation_step):
-    month_age = species.minimum_breeding_age * MONTHS_IN_YEAR
-    return simulation_step.month - animal.birth_month >= month_age
+def get_new_animals_from_breeding(count, month, rng=random, pool=None):
+    # Newborns are fed in litter order, so the genders must stay randomly
+    # interleaved rather than split into two blocks. Drawing the whole litter
+    # in one call is still much cheaper than one draw per newborn.
+    genders = rng.choices(
+        (GENDER_MALE, GENDER_FEMALE),
+        cum_weights=(MALE_BIRTH_RATIO, 1),
+        k=count,
+    )
+    return [get_newborn(gender, month, pool) for gender in genders]
 
 
-def get_new_animal_gender():
-    # The % of male(or female) births may change, so we'll generate random
-    # floats between 0 and 1 instead of using choice() to select between two
-    # items.
-    if random() <= male_ratio:
-        return GENDER_MALE
-    return GENDER_FEMALE
+def get_newborn(gender, month, pool=None):
+    if pool is not None:
+        born_animal = pool.acquire()
+    else:
+        born_animal = Animal()
+    born_animal.birth_month = month
+    born_animal.last_feed_month = month - 1
+    born_animal.gender = gender
+    return born_animal
 
 
 def main():
     parser = get_argument_parser()
     arguments = parser.parse_args()
+    if arguments.checkpoint_dir is not None:
+        if arguments.engine != ENGINE_OBJECT:
+            parser.error('checkpoints are only supported by the object engine')
+        os.makedirs(arguments.checkpoint_dir, exist_ok=True)
+        if arguments.steady_state:
+            parser.error('--steady-state cannot be used with checkpoints')
+    elif arguments.resume:
+        parser.error('--resume requires --checkpoint-dir')
+    if arguments.agent_budget is not None:
+        if arguments.engine != ENGINE_COHORT:
+            parser.error('--agent-budget is only supported by the cohort '
+                         'engine')
+        if arguments.agent_budget < 2:
+            parser.error('--agent-budget must be at least 2')
+    if arguments.batch_size is not None and arguments.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    if arguments.engine == ENGINE_BATCH:
+        if arguments.profile is not None or arguments.steady_state:
+            parser.error('the batch engine supports neither --profile nor '
+                         '--steady-state')
+        if arguments.series is not None:
+            parser.error('--series is not supported by the batch engine')
+        if arguments.trace is not None:
+            parser.error('--trace is not supported by the batch engine')
+    if arguments.series is not None:
+        if arguments.profile is not None:
+            parser.error('--series cannot be used with --profile')
+        if arguments.checkpoint_dir is not None:
+            parser.error('--series cannot be used with checkpoints')
+    if arguments.trace is not None:
+        if arguments.profile is not None or arguments.series is not None:
+            parser.error('--trace cannot be used with --profile or --series')
+        if arguments.checkpoint_dir is not None:
+            parser.error('--trace cannot be used with checkpoints')
+        if arguments.steady_state:
+            # Extrapolated months have no life histories to trace.
+            parser.error('--trace cannot be used with --steady-state')
+    if arguments.replicates < 1:
+        parser.error('--replicates must be at least 1')
+    if not 0 < arguments.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+    reductions = set(arguments.variance_reduction or ())
+    if reductions and arguments.replicates < 2:
+        parser.error('--variance-reduction needs at least 2 --replicates')
+    if REDUCTION_ANTITHETIC in reductions and arguments.replicates % 2:
+        parser.error('antithetic replicates come in pairs, so --replicates '
+                     'must be even')
+    if REDUCTION_COMMON in reductions and arguments.seed is None:
+        # Species only share random numbers through a common master seed.
+        arguments.seed = random.SystemRandom().getrandbits(64)
+    cache = None
+    if arguments.clear_cache or not arguments.no_cache:
+        cache = ResultCache(
+            arguments.cache_dir,
+            arguments.cache_size * 1024 * 1024,
+        )
+        if arguments.clear_cache:
+            cache.clear()
+        if arguments.no_cache:
+            cache = None
     config_path = os.path.abspath(arguments.config)
+    # The configuration is checked before anything runs or is written.
+    try:
+        configuration = load_configuration(config_path, cache)
+    except ConfigurationError as error:
+        parser.error('invalid configuration {path}: {error}'.format(
+            path=arguments.config,
+            error=error,
+        ))
+    if arguments.allocation is not None:
+        for habitat in configuration.habitats:
+            habitat.allocation = arguments.allocation
     output_stream = sys.stdout
+    series_stream = None
 
     if arguments.output is not None:
         output_stream = open(arguments.output, 'w')
 
     try:
-        # TODO: Do we need to validate the configuration file?
-        with open(config_path) as config_file:
-            configuration = yaml.safe_load(config_file)
-
-        species_list = tuple(
-            species_from_config(config)
-            for config in configuration['species']
-        )
-        habitats = tuple(
-            habitat_from_config(config)
-            for config in configuration['habitats']
-        )
-
-        simulation_years = configuration['years']
-        print(
-            'Simulation ran for {count:d} years'.format(
-                count=simulation_years,
-            ),
-            file=output_stream,
-        )
-        for species in species_list:
-            print('{name}:'.format(name=species.name), file=output_stream)
-            for habitat in habitats:
-                print(
-                    '\t{name:}:'.format(name=habitat.name),
-                    file=output_stream,
-                )
-                simulation_steps = simulate_species_in_habitat(
+        species_list = configuration.species
+        habitats = configuration.habitats
+        simulation_years = configuration.years
+        record_writer = None
+        if arguments.format == FORMAT_TEXT:
+            print(
+                'Simulation ran for {count:d} years'.format(
+                    count=simulation_years,
+                ),
+                file=output_stream,
+            )
+        else:
+            record_writer = get_record_writer(
+                arguments.format,
+                output_stream,
+                RUN_FIELDS,
+            )
+
+        run = run_simulation
+        profiles = []
+        if arguments.profile is not None:
+            run = run_profiled_simulation
+        series_writer = None
+        if arguments.series is not None:
+            run = run_series_simulation
+            series_stream = open(arguments.series, 'w')
+            series_writer = get_record_writer(
+                arguments.format,
+                series_stream,
+                SERIES_FIELDS,
+            )
+        if arguments.trace is not None:
+            run = run_traced_simulation
+            os.makedirs(arguments.trace, exist_ok=True)
+
+        # Results come back in submission order, so the report is written in
+        # the same order no matter how many jobs run the simulations.
+        replicates = range(arguments.replicates)
+        # The weather of each habitat is drawn once per replicate and shared
+        # by every species, so species are compared under the same weather.
+        antithetic = REDUCTION_ANTITHETIC in reductions
+        climates = {}
+        for (index, habitat) in enumerate(habitats):
+            for replicate in replicates:
+                if antithetic and replicate % 2:
+                    climates[index, replicate] = get_mirrored_schedule(
+                        habitat,
+                        climates[index, replicate - 1],
+                    )
+                else:
+                    climates[index, replicate] = get_climate_schedule(
+                        arguments.engine,
+                        habitat,
+                        simulation_years,
+                        get_replicate_seed(arguments.seed, replicate),
+                    )
+        run_arguments = [
+            get_run_arguments(
+                arguments,
+                species,
+                habitat,
+                simulation_years,
+                replicate,
+                climates[index, replicate],
+            )
+            for species in species_list
+            for (index, habitat) in enumerate(habitats)
+            for replicate in replicates
+        ]
+        keys = [None] * len(run_arguments)
+        if arguments.trace is not None:
+            # Every run writes a trace of its own, so runs in parallel never
+            # share a file.
+            run_arguments = [
+                args + (get_trace_path(
+                    arguments.trace,
                     species,
                     habitat,
-                    simulation_years,
+                    replicate,
+                ),)
+                for (args, (species, habitat, replicate)) in zip(
+                    run_arguments,
+                    product(species_list, habitats, replicates),
                 )
-                generate_simulation_report(simulation_steps, output_stream)
+            ]
+        elif arguments.profile is None and arguments.series is None:
+            # Profiles time the run itself and series are not cached, so
+            # those runs always run.
+            keys = [get_run_key(*args) for args in run_arguments]
+        results = run_simulations(
+            run,
+            run_arguments,
+            keys,
+            arguments.jobs,
+            cache,
+            arguments.seed,
+            arguments.batch_size,
+        )
+        # Replicates of the first species in every habitat, which the other
+        # species are compared with when they share random numbers.
+        baselines = {}
+        with closing(results):
+            for species in species_list:
+                if record_writer is None:
+                    print(
+                        '{name}:'.format(name=species.name),
+                        file=output_stream,
+                    )
+                for (index, habitat) in enumerate(habitats):
+                    if record_writer is None:
+                        print(
+                            '\t{name:}:'.format(name=habitat.name),
+                            file=output_stream,
+                        )
+                    statistics_list = []
+                    pair_profiles = []
+                    for replicate in replicates:
+                        statistics = next(results)
+                        if arguments.profile is not None:
+                            (statistics, profile) = statistics
+                            pair_profiles.append(profile)
+                        fields = dict(
+                            species=species.name,
+                            habitat=habitat.name,
+                            replicate=replicate,
+                        )
+                        if series_writer is not None:
+                            (statistics, series) = statistics
+                            for record in series.get_records(**fields):
+                                series_writer.write(record)
+                            series_writer.flush()
+                        if record_writer is not None:
+                            start = time.perf_counter()
+                            # Records are written as soon as their run is
+                            # done, rather than once a pair is complete.
+                            record_writer.write(get_run_record(
+                                statistics,
+                                seed=get_replicate_seed(
+                                    arguments.seed,
+                                    replicate,
+                                ),
+                                **fields
+                            ))
+                            record_writer.flush()
+                            if arguments.profile is not None:
+                                add_shared_timing(
+                                    [profile],
+                                    'reporting',
+                                    time.perf_counter() - start,
+                                )
+                        statistics_list.append(statistics)
+                    profiles += pair_profiles
+                    if record_writer is not None:
+                        continue
+
+                    controls = None
+                    control_mean = None
+                    if REDUCTION_CONTROL in reductions:
+                        controls = [
+                            climates[index, replicate].count_deadly_months(
+                                species,
+                            )
+                            for replicate in replicates
+                        ]
+                        control_mean = get_expected_deadly_months(
+                            habitat,
+                            species,
+                            simulation_years * 12,
+                        )
+                    baseline = None
+                    if REDUCTION_COMMON in reductions:
+                        baseline = baselines.get(index)
+                        baselines.setdefault(
+                            index,
+                            (species.name, statistics_list),
+                        )
+
+                    start = time.perf_counter()
+                    write_pair_report(
+                        statistics_list,
+                        output_stream,
+                        arguments.confidence,
+                        antithetic,
+                        controls,
+                        control_mean,
+                        baseline,
+                    )
+                    if arguments.profile is not None:
+                        # One report covers every replicate of the pair.
+                        add_shared_timing(
+                            pair_profiles,
+                            'reporting',
+                            time.perf_counter() - start,
+                        )
+
+        if arguments.profile is not None:
+            with open(arguments.profile, 'w') as profile_file:
+                json.dump({'runs': profiles}, profile_file, indent=2)
     finally:
         if arguments.output is not None:
             output_stream.close()
+        if series_stream is not None:
+            series_stream.close()
+
+
+def run_simulations(
+    run,
+    run_arguments,
+    keys,
+    jobs,
+    cache=None,
+    seed=None,
+    batch_size=None,
+):
+    """
+    Yield the result of `run(*args)` for every tuple of `run_arguments`, in
+    order, skipping runs whose result is in `cache` under their key.
+
+    Runs of the batch engine are simulated in lockstep batches of
+    `batch_size` instead, seeded from the master `seed`. Their results depend
+    on the batch they ran in, so they are never cached.
+    """
+    if run_arguments and run_arguments[0][0] == ENGINE_BATCH:
+        import batch_engine
+        runs = [
+            (species, habitat, simulation_years, climate)
+            for (_, species, habitat, simulation_years, *_, climate)
+            in run_arguments
+        ]
+        return batch_engine.run_batched(
+            runs,
+            jobs,
+            seed,
+            batch_size or batch_engine.DEFAULT_BATCH_SIZE,
+        )
+    return run_cached(run, run_arguments, keys, jobs, cache)
+
+
+def get_run_arguments(
+    arguments,
+    species,
+    habitat,
+    simulation_years,
+    replicate,
+    climate=None,
+):
+    """
+    Arguments of `run_simulation` for one replicate of a species/habitat pair,
+    as requested on the command line.
+    """
+    seed = get_replicate_seed(arguments.seed, replicate)
+    checkpointer = None
+    if arguments.checkpoint_dir is not None:
+        checkpointer = Checkpointer(
+            get_checkpoint_path(
+                arguments.checkpoint_dir,
+                species,
+                habitat,
+                replicate,
+            ),
+            get_run_inputs(
+                arguments.engine,
+                species,
+                habitat,
+                simulation_years,
+                seed,
+            ),
+            arguments.checkpoint_interval,
+            arguments.resume,
+        )
+    steady_state = None
+    if arguments.steady_state:
+        # Deaths of old age only begin once the founders reach their life
+        # span, so no run is steady before then.
+        steady_state = SteadyStateDetector(
+            arguments.steady_state_window,
+            arguments.steady_state_tolerance,
+            species.life_span * 12,
+        )
+    return (
+        arguments.engine,
+        species,
+        habitat,
+        simulation_years,
+        seed,
+        checkpointer,
+        steady_state,
+        arguments.agent_budget,
+        climate,
+    )
 
 
-def generate_simulation_report(simulation_steps, output_stream):
-    deaths_by_type = {
-        DEATH_OLD_AGE: [],
-        DEATH_THIRST: [],
-        DEATH_STARVATION: [],
-        DEATH_TOO_HOT: [],
-        DEATH_TOO_COLD: [],
+def get_climate_schedule(engine_name, habitat, simulation_years, seed=None):
+    """
+    Weather of `habitat` for the runs seeded with `seed`.
+    """
+    rng = get_random_generator(
+        engine_name,
+        get_climate_seed(seed, habitat.name),
+    )
+    return ClimateSchedule.from_habitat(habitat, simulation_years * 12, rng)
+
+
+def get_run_inputs(engine_name, species, habitat, simulation_years, seed):
+    """
+    Everything that determines the result of a seeded run.
+    """
+    return {
+        'engine': engine_name,
+        'species': vars(species),
+        'habitat': vars(habitat),
+        'years': simulation_years,
+        'seed': seed,
     }
-    for simulation_step in simulation_steps:
-        for death_reason, animals in simulation_step.deaths.items():
-            deaths_by_type[death_reason] += animals
 
-    average_population = get_average_population(simulation_steps)
-    max_population = get_max_population(simulation_steps)
 
-    logging.info('Average population: %d', average_population)
-    logging.info('Maximum population: %d', max_population)
+def get_run_key(
+    engine_name,
+    species,
+    habitat,
+    simulation_years,
+    seed,
+    checkpointer=None,
+    steady_state=None,
+    agent_budget=None,
+    climate=None,
+):
+    """
+    Key identifying the result of a run, or None when the run is not seeded
+    and its result cannot be reused.
+    """
+    if seed is None:
+        return None
+    inputs = get_run_inputs(
+        engine_name,
+        species,
+        habitat,
+        simulation_years,
+        seed,
+    )
+    inputs['engine_version'] = ENGINE_VERSION
+    if steady_state is not None:
+        inputs['steady_state'] = steady_state.settings
+    if agent_budget is not None:
+        inputs['agent_budget'] = agent_budget
+    if climate is not None and climate.mirrored:
+        # Antithetic runs see other weather than their seed would draw.
+        inputs['mirrored_climate'] = True
+    return get_cache_key(inputs)
+
+
+def write_pair_report(
+    statistics_list,
+    output_stream,
+    confidence,
+    antithetic=False,
+    controls=None,
+    control_mean=None,
+    baseline=None,
+):
+    """
+    Write the report of one species/habitat pair from the statistics of each
+    of its replicates, with the variance reduction options of
+    `write_replicate_report`.
+    """
+    if len(statistics_list) == 1:
+        write_simulation_report(statistics_list[0], output_stream)
+    else:
+        write_replicate_report(
+            statistics_list,
+            output_stream,
+            confidence,
+            antithetic,
+            controls,
+            control_mean,
+            baseline,
+        )
 
-    total_deaths = sum(len(animals) for animals in deaths_by_type.values())
 
-    total_born = total_deaths + len(simulation_step.animals)
-    mortality_rate = total_deaths / total_born
+def generate_simulation_report(simulation_steps, output_stream):
+    statistics = get_statistics_from_steps(simulation_steps)
+    write_simulation_report(statistics, output_stream)
 
-    logging.info('Mortality rate: %.2f%%', mortality_rate * 100)
 
-    lines = [
-        '\t\tAverage Population: {count:.2f}'.format(count=average_population),
-        '\t\tMax Population: {count:d}'.format(count=max_population),
-        '\t\tMortality Rate: {rate:.2f}%'.format(rate=mortality_rate * 100),
-        '\t\tCause of Death:',
-    ]
+def get_statistics_from_steps(simulation_steps, pool=None):
+    # Steps are consumed one at a time, so `simulation_steps` may be a
+    # generator that discards each step once it has been counted. Dead animals
+    # are then no longer referenced and can be recycled through `pool`.
+    statistics = SimulationStatistics()
+    for simulation_step in simulation_steps:
+        add_step_to_statistics(statistics, simulation_step, pool)
+    return statistics
 
-    for death_reason, animals in deaths_by_type.items():
-        logging.info('Deaths due to %s: %d', death_reason, len(animals))
-        if total_deaths > 0:
-            percentage = len(animals) / total_deaths * 100
-        else:
-            percentage = 0
-        lines.append('\t\t\t{percentage: 6.2f}%  {reason}'.format(
-            percentage=percentage,
-            reason=death_reason,
-        ))
 
-    print('\n'.join(lines), file=output_stream)
+def add_step_to_statistics(statistics, simulation_step, pool=None):
+    deaths = {
+        death_reason: len(animals)
+        for death_reason, animals in simulation_step.deaths.items()
+    }
+    statistics.add_step(len(simulation_step.animals), deaths)
+
+    if pool is not None:
+        for animals in simulation_step.deaths.values():
+            pool.release(animals)
 
 
 def get_argument_parser():
@@ -311,6 +1192,149 @@ def get_argument_parser():
         required=False,
         help='Path of output file. If omitted, write to stdout'
     )
+    parser.add_argument(
+        '--format',
+        choices=FORMATS,
+        default=FORMAT_TEXT,
+        help='Format of the output. jsonl and csv write one record per run '
+        'as soon as it finishes',
+    )
+    parser.add_argument(
+        '--series',
+        help='Path of a file to write the population, temperature and '
+        'deaths of every simulated month of every run to, in --format '
+        '(JSON lines for text). Months extrapolated from a steady state are '
+        'not included',
+    )
+    parser.add_argument(
+        '--trace',
+        help='Directory to write a columnar trace of every run to, with the '
+        'monthly series and the life history of every animal. Read traces '
+        'with tracing.TraceReader',
+    )
+    parser.add_argument(
+        '--engine',
+        choices=ENGINES,
+        default=ENGINE_OBJECT,
+        help='Population representation used to run the simulation',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes running simulations in parallel. '
+        '0 uses one process per CPU',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Master seed. Runs with the same seed reproduce exactly',
+    )
+    parser.add_argument(
+        '--replicates',
+        type=int,
+        default=1,
+        help='Number of independent runs of every species/habitat pair',
+    )
+    parser.add_argument(
+        '--variance-reduction',
+        action='append',
+        choices=REDUCTIONS,
+        help='Variance reduction used to estimate the metrics reported for '
+        'replicates, along with their effective sample size. May be given '
+        'more than once. antithetic pairs every replicate with one in '
+        'mirrored weather, common has every species share the random numbers '
+        'of each replicate and reports their differences from the first '
+        'species, and control corrects for the number of months of deadly '
+        'weather',
+    )
+    parser.add_argument(
+        '--confidence',
+        type=float,
+        default=0.95,
+        help='Confidence level of the intervals reported for replicates',
+    )
+    parser.add_argument(
+        '--checkpoint-dir',
+        help='Directory to save checkpoints of every run to. Only supported '
+        'by the object engine',
+    )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=int,
+        default=DEFAULT_INTERVAL,
+        help='Number of simulated months between checkpoints',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue runs from the checkpoints in --checkpoint-dir',
+    )
+    parser.add_argument(
+        '--profile',
+        help='Path of a JSON file to write per-run timings to. The time '
+        'spent on a text report shared by several replicates is split '
+        'evenly between them',
+    )
+    parser.add_argument(
+        '--steady-state',
+        action='store_true',
+        help='Stop simulating runs that reach a steady state, and '
+        'extrapolate their remaining months',
+    )
+    parser.add_argument(
+        '--steady-state-window',
+        type=int,
+        default=DEFAULT_WINDOW_YEARS,
+        help='Number of years compared with the years before them to detect '
+        'a steady state',
+    )
+    parser.add_argument(
+        '--steady-state-tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help='Largest relative change between windows of a steady state',
+    )
+    parser.add_argument(
+        '--allocation',
+        choices=ALLOCATIONS,
+        help='Which animals get food and water first when there is not '
+        'enough for all of them, in every habitat. If omitted, use the '
+        'configuration, where it defaults to first-come',
+    )
+    parser.add_argument(
+        '--agent-budget',
+        type=int,
+        help='Maximum number of cohorts of the cohort engine. Similar '
+        'cohorts are merged beyond it, which bounds the cost of every month '
+        'at the price of approximate results',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        help='Number of runs the batch engine simulates in lockstep',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=get_default_cache_directory(),
+        help='Directory of the cache of finished seeded runs',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help='Maximum size of the result cache, in megabytes',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Neither read nor write cached results',
+    )
+    parser.add_argument(
+        '--clear-cache',
+        action='store_true',
+        help='Delete every cached result before running',
+    )
     return parser
 
 
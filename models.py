@@ -1,4 +1,6 @@
 from math import floor
+from operator import attrgetter
+import random
 
 MONTHS_IN_YEAR = 12
 
@@ -17,9 +19,97 @@ SEASON_SUMMER = 'summer'
 SEASON_FALL = 'fall'
 SEASON_WINTER = 'winter'
 
+SEASONS = (
+    SEASON_SPRING,
+    SEASON_SUMMER,
+    SEASON_FALL,
+    SEASON_WINTER,
+)
+
+# Share of births that are male.
+MALE_BIRTH_RATIO = 0.5
+
+# Policies deciding which animals get food and water when there is not
+# enough for all of them. Populations are kept in order of birth, so animals
+# that come first are the oldest, and among animals born the same month, the
+# ones that have been around the population's list longest.
+ALLOCATION_FIRST_COME = 'first-come'
+ALLOCATION_OLDEST_FIRST = 'oldest-first'
+ALLOCATION_YOUNGEST_FIRST = 'youngest-first'
+ALLOCATION_RANDOM = 'random'
+ALLOCATIONS = (
+    ALLOCATION_FIRST_COME,
+    ALLOCATION_OLDEST_FIRST,
+    ALLOCATION_YOUNGEST_FIRST,
+    ALLOCATION_RANDOM,
+)
+# Policies that serve animals in list order.
+IN_ORDER_ALLOCATIONS = (ALLOCATION_FIRST_COME, ALLOCATION_OLDEST_FIRST)
+
+
+def get_season(month):
+    month = month % 12
+    return SEASONS[floor(month / 3)]
+
+
+def can_breed(animal, species, simulation_step):
+    month_age = species.minimum_breeding_age * MONTHS_IN_YEAR
+    return simulation_step.month - animal.birth_month >= month_age
+
+
+def count_born_before(animals, month):
+    """
+    Number of `animals`, which are in order of birth, born before `month`.
+    Animals born the same month form a contiguous run, so the count is found
+    by bisection, at a cost that barely grows with the population.
+    """
+    (low, high) = (0, len(animals))
+    while low < high:
+        middle = (low + high) // 2
+        if animals[middle].birth_month < month:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def get_breeding_animals(animals, species, simulation_step):
+    """
+    Return the `animals`, which are in order of birth, old enough to breed
+    according to `can_breed`. They are the oldest, so they come first.
+    """
+    month_age = species.minimum_breeding_age * MONTHS_IN_YEAR
+    last_birth_month = simulation_step.month - month_age
+    return animals[:count_born_before(animals, last_birth_month + 1)]
+
+
+def get_fed_count(resource, consumption, count):
+    """
+    Number of animals, out of `count` candidates, that `ResourceCheck.update`
+    feeds before `resource` runs out.
+    """
+    if resource < consumption:
+        return 0
+    if consumption <= 0:
+        return count
+    return min(count, resource // consumption)
+
 
 class Animal(object):
+    __slots__ = (
+        'gender',
+        'birth_month',
+        'last_feed_month',
+        'last_drink_month',
+        'consecutive_hot_months',
+        'consecutive_cold_months',
+        'gestation_months',
+    )
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.gender = GENDER_UNKNOWN
 
         # Month number when an animal was born.
@@ -32,21 +122,41 @@ class Animal(object):
         self.gestation_months = 0
 
 
+class AnimalPool(object):
+    """
+    Free list of `Animal` objects. Dead animals are released into the pool
+    and handed out again for newborns, instead of being garbage collected and
+    reallocated.
+    """
+
+    def __init__(self):
+        self.free_animals = []
+
+    def acquire(self):
+        if self.free_animals:
+            animal = self.free_animals.pop()
+            animal.reset()
+            return animal
+        return Animal()
+
+    def release(self, animals):
+        """
+        Return `animals` to the pool. They must no longer be referenced
+        anywhere else.
+        """
+        self.free_animals.extend(animals)
+
+
 class SimulationStep(object):
     def __init__(self):
+        # Animals are in order of birth: survivors keep their order and
+        # newborns are added at the end.
         self.animals = []
         self.deaths = {}
         self.month = 0
 
     def get_current_season(self):
-        seasons_by_index = [
-            SEASON_SPRING,
-            SEASON_SUMMER,
-            SEASON_FALL,
-            SEASON_WINTER,
-        ]
-        month = self.month % 12
-        return seasons_by_index[floor(month / 3)]
+        return get_season(self.month)
 
 
 class StepCheck(object):
@@ -56,6 +166,35 @@ class StepCheck(object):
     def update(self, animal):
         pass
 
+    def update_all(self, animals, rng=random):
+        """
+        Apply `update` to every animal of the list `animals`, in order.
+        """
+        for animal in animals:
+            self.update(animal)
+
+    def separate(self, animals):
+        """
+        Split `animals` into the ones that survive the check and the ones
+        that do not, both in their original order.
+        """
+        alive = []
+        dead = []
+        for animal in animals:
+            if self.is_still_alive(animal):
+                alive.append(animal)
+            else:
+                dead.append(animal)
+        return (alive, dead)
+
+    def update_cohort(self, cohort, count):
+        """
+        Apply `update` to `count` animals sharing the immutable state
+        `cohort`. Returns a list of `(cohort, count)` pairs, split only where
+        the animals end up in different states.
+        """
+        return [(cohort, count)]
+
     def is_still_alive(self, animal):
         return True
 
@@ -69,6 +208,16 @@ class AgeCheck(StepCheck):
         lifespan_months = species.life_span * MONTHS_IN_YEAR
         self.minimum_birth_month = next_month - lifespan_months
 
+    def update_all(self, animals, rng=random):
+        # Ages need no update.
+        pass
+
+    def separate(self, animals):
+        # Animals are in order of birth, so the ones too old to live on are
+        # all at the front.
+        index = count_born_before(animals, self.minimum_birth_month)
+        return (animals[index:], animals[:index])
+
     def is_still_alive(self, animal):
         return animal.birth_month >= self.minimum_birth_month
 
@@ -76,17 +225,59 @@ class AgeCheck(StepCheck):
 class ResourceCheck(StepCheck):
     resource_field = ''
 
-    def __init__(self, simulation_step):
+    def __init__(self, simulation_step, allocation=ALLOCATION_FIRST_COME):
         self.resource = 0
         self.consumption = 0
         self.simulation_month = simulation_step.month + 1
         self.minimum_month = 0
+        self.allocation = allocation
 
     def update(self, animal):
         if self.resource >= self.consumption:
             setattr(animal, self.resource_field, self.simulation_month)
             self.resource -= self.consumption
 
+    def update_all(self, animals, rng=random):
+        """
+        Hand the resource out to `animals` following the `allocation` policy.
+        The number of animals fed is known up front, so only they are
+        visited.
+        """
+        fed_count = get_fed_count(
+            self.resource,
+            self.consumption,
+            len(animals),
+        )
+        self.resource -= fed_count * self.consumption
+        if self.allocation == ALLOCATION_RANDOM:
+            fed = rng.sample(animals, fed_count)
+        elif self.allocation == ALLOCATION_YOUNGEST_FIRST:
+            # A reversed sort is stable, so animals born the same month keep
+            # their order.
+            fed = sorted(
+                animals,
+                key=attrgetter('birth_month'),
+                reverse=True,
+            )[:fed_count]
+        else:
+            fed = animals[:fed_count]
+
+        for animal in fed:
+            setattr(animal, self.resource_field, self.simulation_month)
+
+    def update_cohort(self, cohort, count):
+        fed_count = get_fed_count(self.resource, self.consumption, count)
+        if not fed_count:
+            return [(cohort, count)]
+
+        self.resource -= fed_count * self.consumption
+        fed_cohort = cohort._replace(
+            **{self.resource_field: self.simulation_month}
+        )
+        if fed_count == count:
+            return [(fed_cohort, count)]
+        return [(fed_cohort, fed_count), (cohort, count - fed_count)]
+
     def is_still_alive(self, animal):
         return getattr(animal, self.resource_field) >= self.minimum_month
 
@@ -97,12 +288,20 @@ class FoodCheck(ResourceCheck):
     resource_field = 'last_feed_month'
 
     def __init__(self, simulation_step, habitat, species):
-        super().__init__(simulation_step)
+        super().__init__(simulation_step, habitat.allocation)
 
         self.resource = habitat.monthly_food
         self.consumption = species.monthly_food_consumption
         self.minimum_month = self.simulation_month - 3
 
+    def update(self, animal):
+        if self.resource >= self.consumption:
+            animal.last_feed_month = self.simulation_month
+            self.resource -= self.consumption
+
+    def is_still_alive(self, animal):
+        return animal.last_feed_month >= self.minimum_month
+
 
 class DrinkCheck(ResourceCheck):
     name = 'Drink'
@@ -110,12 +309,20 @@ class DrinkCheck(ResourceCheck):
     resource_field = 'last_drink_month'
 
     def __init__(self, simulation_step, habitat, species):
-        super().__init__(simulation_step)
+        super().__init__(simulation_step, habitat.allocation)
 
         self.resource = habitat.monthly_water
         self.consumption = species.monthly_water_consumption
         self.minimum_month = self.simulation_month - 1
 
+    def update(self, animal):
+        if self.resource >= self.consumption:
+            animal.last_drink_month = self.simulation_month
+            self.resource -= self.consumption
+
+    def is_still_alive(self, animal):
+        return animal.last_drink_month >= self.minimum_month
+
 
 class CounterCheck(StepCheck):
     resource_field = ''
@@ -144,6 +351,13 @@ class ConsecutiveConditionCheck(StepCheck):
         else:
             setattr(animal, self.counter_field, 0)
 
+    def update_cohort(self, cohort, count):
+        if self.should_increment():
+            value = getattr(cohort, self.counter_field) + 1
+        else:
+            value = 0
+        return [(cohort._replace(**{self.counter_field: value}), count)]
+
     def should_increment(self):
         return True
 
@@ -153,12 +367,22 @@ class HeatCheck(ConsecutiveConditionCheck):
     death_type = DEATH_TOO_HOT
     counter_field = 'consecutive_hot_months'
 
-    def __init__(self, temperature, species):
+    def __init__(self, temperature, species, is_hot=None):
         self.temperature = temperature
         self.maximum_temperature = species.maximum_temperature
+        # `is_hot` may be precomputed for a whole climate schedule.
+        if is_hot is None:
+            is_hot = temperature > self.maximum_temperature
+        self.is_hot = is_hot
+
+    def update(self, animal):
+        if self.is_hot:
+            animal.consecutive_hot_months += 1
+        else:
+            animal.consecutive_hot_months = 0
 
     def should_increment(self):
-        return self.temperature > self.maximum_temperature
+        return self.is_hot
 
     def is_still_alive(self, animal):
         return animal.consecutive_hot_months <= 1
@@ -169,12 +393,21 @@ class ColdCheck(ConsecutiveConditionCheck):
     death_type = DEATH_TOO_COLD
     counter_field = 'consecutive_cold_months'
 
-    def __init__(self, temperature, species):
+    def __init__(self, temperature, species, is_cold=None):
         self.temperature = temperature
         self.minimum_temperature = species.minimum_temperature
+        if is_cold is None:
+            is_cold = temperature < self.minimum_temperature
+        self.is_cold = is_cold
+
+    def update(self, animal):
+        if self.is_cold:
+            animal.consecutive_cold_months += 1
+        else:
+            animal.consecutive_cold_months = 0
 
     def should_increment(self):
-        return self.temperature < self.minimum_temperature
+        return self.is_cold
 
     def is_still_alive(self, animal):
         return animal.consecutive_cold_months <= 1
@@ -204,3 +437,6 @@ class Habitat(object):
             SEASON_FALL: 0,
             SEASON_WINTER: 0,
         }
+        # Who is fed first when food or water runs short, one of
+        # `ALLOCATIONS`.
+        self.allocation = ALLOCATION_FIRST_COME
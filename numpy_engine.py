@@ -0,0 +1,315 @@
+"""
+Structure-of-arrays simulation engine.
+
+The population is stored as parallel NumPy arrays, one per `Animal` field, and
+every check is applied to the whole population as a vectorised mask. The
+semantics follow `main.advance()`: checks run in the same order, resources are
+handed out to animals that survived the earlier checks following the
+habitat's allocation policy, and deaths are attributed to the first fatal
+check.
+"""
+import logging
+import time
+
+import numpy
+
+from climate import ClimateSchedule, get_fluctuation
+from models import (
+    ALLOCATION_RANDOM,
+    ALLOCATION_YOUNGEST_FIRST,
+    DEATH_OLD_AGE,
+    DEATH_STARVATION,
+    DEATH_THIRST,
+    DEATH_TOO_COLD,
+    DEATH_TOO_HOT,
+    GENDER_FEMALE,
+    GENDER_MALE,
+    GENDER_UNKNOWN,
+    MALE_BIRTH_RATIO,
+    MONTHS_IN_YEAR,
+    get_fed_count,
+    get_season,
+)
+from reporting import SimulationStatistics
+
+logger = logging.getLogger(__name__)
+
+GENDER_CODES = {
+    GENDER_UNKNOWN: 0,
+    GENDER_MALE: 1,
+    GENDER_FEMALE: 2,
+}
+MONTH_DTYPE = numpy.int32
+
+
+class PopulationArrays(object):
+    fields = (
+        'gender',
+        'birth_month',
+        'last_feed_month',
+        'last_drink_month',
+        'consecutive_hot_months',
+        'consecutive_cold_months',
+        'gestation_months',
+    )
+
+    def __init__(self, size=0):
+        # Defaults mirror a freshly constructed `Animal`.
+        self.gender = numpy.zeros(size, dtype=numpy.int8)
+        self.birth_month = numpy.zeros(size, dtype=MONTH_DTYPE)
+        self.last_feed_month = numpy.full(size, -1, dtype=MONTH_DTYPE)
+        self.last_drink_month = numpy.full(size, -1, dtype=MONTH_DTYPE)
+        self.consecutive_hot_months = numpy.zeros(size, dtype=MONTH_DTYPE)
+        self.consecutive_cold_months = numpy.zeros(size, dtype=MONTH_DTYPE)
+        self.gestation_months = numpy.zeros(size, dtype=MONTH_DTYPE)
+
+    def __len__(self):
+        return len(self.birth_month)
+
+    @classmethod
+    def from_animals(cls, animals):
+        population = cls(len(animals))
+        for field in cls.fields:
+            values = [getattr(animal, field) for animal in animals]
+            if field == 'gender':
+                values = [GENDER_CODES[gender] for gender in values]
+            getattr(population, field)[:] = values
+        return population
+
+    def select(self, mask):
+        population = type(self)()
+        for field in self.fields:
+            setattr(population, field, getattr(self, field)[mask])
+        return population
+
+    def extend(self, other):
+        for field in self.fields:
+            values = (getattr(self, field), getattr(other, field))
+            setattr(self, field, numpy.concatenate(values))
+
+
+def get_initial_population():
+    population = PopulationArrays(2)
+    population.gender[:] = (
+        GENDER_CODES[GENDER_MALE],
+        GENDER_CODES[GENDER_FEMALE],
+    )
+    return population
+
+
+def advance_population(
+    population,
+    month,
+    species,
+    habitat,
+    rng,
+    fluctuation=None,
+    conditions=None,
+    dead=None,
+):
+    """
+    Advance `population` from `month` to the next month. `fluctuation` is the
+    month's temperature fluctuation, drawn from `rng` when omitted, unless the
+    month's `(temperature, is_hot, is_cold)` `conditions` are given.
+
+    Returns the surviving population (newborns included) and a mapping of
+    death type to the number of animals that died of it. When a mapping
+    `dead` is given, the birth months of those animals are added to it by
+    death type.
+    """
+    next_month = month + 1
+    alive = numpy.ones(len(population), dtype=bool)
+    deaths = {}
+
+    def apply_check(death_type, still_alive):
+        nonlocal alive
+        dying = alive & ~still_alive
+        dead_count = numpy.count_nonzero(dying)
+        alive = alive & still_alive
+        if dead_count:
+            deaths[death_type] = int(dead_count)
+            if dead is not None:
+                dead[death_type] = population.birth_month[dying]
+
+    def feed(field, resource, consumption):
+        candidates = get_allocation_order(
+            population,
+            numpy.flatnonzero(alive),
+            habitat.allocation,
+            rng,
+        )
+        fed_count = get_fed_count(resource, consumption, len(candidates))
+        field[candidates[:fed_count]] = next_month
+
+    lifespan_months = species.life_span * MONTHS_IN_YEAR
+    apply_check(
+        DEATH_OLD_AGE,
+        population.birth_month >= next_month - lifespan_months,
+    )
+
+    feed(
+        population.last_feed_month,
+        habitat.monthly_food,
+        species.monthly_food_consumption,
+    )
+    apply_check(
+        DEATH_STARVATION,
+        population.last_feed_month >= next_month - 3,
+    )
+
+    feed(
+        population.last_drink_month,
+        habitat.monthly_water,
+        species.monthly_water_consumption,
+    )
+    apply_check(
+        DEATH_THIRST,
+        population.last_drink_month >= next_month - 1,
+    )
+
+    if conditions is None:
+        if fluctuation is None:
+            fluctuation = get_fluctuation(rng)
+        season = get_season(month)
+        temperature = habitat.average_temperatures[season] + fluctuation
+        conditions = (
+            temperature,
+            temperature > species.maximum_temperature,
+            temperature < species.minimum_temperature,
+        )
+    (temperature, is_hot, is_cold) = conditions
+
+    if is_cold:
+        population.consecutive_cold_months += 1
+    else:
+        population.consecutive_cold_months[:] = 0
+    apply_check(DEATH_TOO_COLD, population.consecutive_cold_months <= 1)
+
+    if is_hot:
+        population.consecutive_hot_months += 1
+    else:
+        population.consecutive_hot_months[:] = 0
+    apply_check(DEATH_TOO_HOT, population.consecutive_hot_months <= 1)
+
+    population = population.select(alive)
+
+    breeding_months = species.minimum_breeding_age * MONTHS_IN_YEAR
+    breeding = (
+        (population.gender == GENDER_CODES[GENDER_FEMALE]) &
+        (month - population.birth_month >= breeding_months)
+    )
+    due = breeding & (population.gestation_months == species.gestation_months)
+    population.gestation_months[breeding & ~due] += 1
+    population.gestation_months[due] = 0
+
+    born_count = int(numpy.count_nonzero(due))
+    if born_count:
+        population.extend(get_newborns(born_count, next_month, rng))
+
+    logger.debug(
+        'Month %d: temperature %d, born %d, population %d',
+        next_month,
+        temperature,
+        born_count,
+        len(population),
+    )
+
+    return (population, deaths)
+
+
+def get_allocation_order(population, candidates, allocation, rng):
+    """
+    Return the indexes `candidates` of `population` in the order the
+    `allocation` policy serves them.
+    """
+    if allocation == ALLOCATION_RANDOM:
+        return rng.permutation(candidates)
+    if allocation == ALLOCATION_YOUNGEST_FIRST:
+        # The population is in order of birth, so a stable sort keeps animals
+        # born the same month in population order.
+        birth_months = population.birth_month[candidates]
+        return candidates[numpy.argsort(-birth_months, kind='stable')]
+    return candidates
+
+
+def get_newborns(count, month, rng):
+    newborns = PopulationArrays(count)
+    newborns.birth_month[:] = month
+    newborns.last_feed_month[:] = month - 1
+    newborns.gender[:] = numpy.where(
+        rng.random(count) <= MALE_BIRTH_RATIO,
+        GENDER_CODES[GENDER_MALE],
+        GENDER_CODES[GENDER_FEMALE],
+    )
+    return newborns
+
+
+def get_simulation_statistics(
+    species,
+    habitat,
+    simulation_years,
+    rng=None,
+    profiler=None,
+    steady_state=None,
+    climate=None,
+    series=None,
+    trace=None,
+):
+    if rng is None:
+        rng = numpy.random.default_rng()
+
+    population = get_initial_population()
+    simulation_months = simulation_years * MONTHS_IN_YEAR
+    if climate is None:
+        climate = ClimateSchedule.from_habitat(habitat, simulation_months, rng)
+    conditions = climate.get_conditions(species)
+    statistics = SimulationStatistics()
+    statistics.add_step(len(population), {})
+
+    for month in range(simulation_months):
+        population_count = len(population)
+        start = time.perf_counter()
+        dead = {} if trace is not None else None
+        (population, deaths) = advance_population(
+            population,
+            month,
+            species,
+            habitat,
+            rng,
+            conditions=conditions[month],
+            dead=dead,
+        )
+        if profiler is not None:
+            profiler.record_step(
+                month + 1,
+                population_count,
+                time.perf_counter() - start,
+            )
+        if series is not None:
+            series.record_step(
+                month + 1,
+                len(population),
+                conditions[month][0],
+                deaths,
+            )
+        if trace is not None:
+            trace.record_step(
+                month + 1,
+                len(population),
+                conditions[month][0],
+                numpy.count_nonzero(population.birth_month == month + 1),
+                deaths,
+                dead,
+            )
+        statistics.add_step(len(population), deaths)
+        if steady_state is not None and steady_state.observe(statistics):
+            steady_state.project(statistics, simulation_months - month - 1)
+            break
+
+        # No reason to continue if no more animals exist
+        if not len(population):
+            break
+
+    if trace is not None:
+        trace.record_survivors(population.birth_month)
+    return statistics
@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+import os
+
+
+def get_job_count(jobs):
+    """
+    Number of worker processes to use; `0` means one per CPU.
+    """
+    if jobs == 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def configure_worker_logging(log_queue):
+    # Workers must not write to the log file themselves, or lines from
+    # different processes would interleave. Every record is sent back to the
+    # parent process instead, which writes it with its own handlers.
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+
+def run_in_pool(function, arguments, jobs):
+    """
+    Call `function(*args)` for every tuple in `arguments` and yield the results
+    in the same order. With more than one job the calls are spread over a pool
+    of worker processes, so `function` and its arguments must be picklable.
+
+    Close the returned generator when stopping early so the pool shuts down.
+    """
+    jobs = get_job_count(jobs)
+    if jobs <= 1:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    with get_worker_pool(jobs) as executor:
+        futures = [executor.submit(function, *args) for args in arguments]
+        for future in futures:
+            yield future.result()
+
+
+@contextmanager
+def get_worker_pool(jobs):
+    """
+    Pool of `jobs` worker processes, as a `ProcessPoolExecutor` whose workers
+    log through the parent process. Calls that have not started when the
+    pool is left are dropped.
+    """
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(
+        log_queue,
+        *logging.getLogger().handlers,
+        respect_handler_level=True
+    )
+    listener.start()
+    executor = ProcessPoolExecutor(
+        max_workers=get_job_count(jobs),
+        initializer=configure_worker_logging,
+        initargs=(log_queue,),
+    )
+    try:
+        yield executor
+    finally:
+        executor.shutdown(cancel_futures=True)
+        listener.stop()
@@ -0,0 +1,150 @@
+"""
+Wall-time profiling of simulation runs.
+
+A `Profiler` is passed down to the engines only when profiling is requested.
+Engines check for `None` once per month, so an unprofiled run pays for little
+more than that comparison.
+"""
+from contextlib import contextmanager
+import logging
+import time
+
+
+class Timing(object):
+    __slots__ = ('calls', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+
+class TimedCheck(object):
+    """
+    Wrap a `StepCheck` so every `update` and `is_still_alive` call is counted
+    and timed.
+    """
+
+    def __init__(self, check, timing):
+        self.check = check
+        self.timing = timing
+        self.name = check.name
+        self.death_type = check.death_type
+
+    def update(self, animal):
+        start = time.perf_counter()
+        self.check.update(animal)
+        self.timing.seconds += time.perf_counter() - start
+        self.timing.calls += 1
+
+    def update_all(self, animals, rng):
+        start = time.perf_counter()
+        self.check.update_all(animals, rng)
+        self.timing.seconds += time.perf_counter() - start
+        self.timing.calls += len(animals)
+
+    def separate(self, animals):
+        start = time.perf_counter()
+        separated = self.check.separate(animals)
+        self.timing.seconds += time.perf_counter() - start
+        return separated
+
+    def is_still_alive(self, animal):
+        start = time.perf_counter()
+        is_alive = self.check.is_still_alive(animal)
+        self.timing.seconds += time.perf_counter() - start
+        return is_alive
+
+
+class Profiler(object):
+    def __init__(self):
+        self.timings = {}
+        self.steps = []
+
+    def get_timing(self, name):
+        if name not in self.timings:
+            self.timings[name] = Timing()
+        return self.timings[name]
+
+    def add_timing(self, name, seconds, calls=1):
+        timing = self.get_timing(name)
+        timing.calls += calls
+        timing.seconds += seconds
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start)
+
+    def wrap_check(self, check):
+        return TimedCheck(check, self.get_timing(type(check).__name__))
+
+    def record_step(self, month, population, seconds):
+        """
+        Record that advancing `population` animals into `month` took
+        `seconds`.
+        """
+        self.steps.append((month, population, seconds))
+        self.add_timing('advance', seconds)
+
+    @contextmanager
+    def time_logging(self, logger=None):
+        """
+        Time every record handled by the handlers of `logger`, which defaults
+        to the root logger, while the context is active.
+        """
+        logger = logger or logging.getLogger()
+        timing = self.get_timing('logging')
+        handlers = list(logger.handlers)
+
+        def get_timed_handle(handle):
+            def timed_handle(record):
+                start = time.perf_counter()
+                try:
+                    return handle(record)
+                finally:
+                    timing.seconds += time.perf_counter() - start
+                    timing.calls += 1
+            return timed_handle
+
+        for handler in handlers:
+            handler.handle = get_timed_handle(handler.handle)
+        try:
+            yield
+        finally:
+            for handler in handlers:
+                del handler.handle
+
+    def get_summary(self):
+        seconds = sum(step_seconds for (_, _, step_seconds) in self.steps)
+        animal_months = sum(population for (_, population, _) in self.steps)
+        return {
+            'months': len(self.steps),
+            'seconds': seconds,
+            'animal_months': animal_months,
+            'animals_per_second': animal_months / seconds if seconds else 0,
+            'timings': {
+                name: {'calls': timing.calls, 'seconds': timing.seconds}
+                for (name, timing) in self.timings.items()
+            },
+            'steps': [
+                {'month': month, 'population': population, 'seconds': seconds}
+                for (month, population, seconds) in self.steps
+            ],
+        }
+
+
+def add_shared_timing(summaries, name, seconds):
+    """
+    Add to the run profiles `summaries` a `name` timing of `seconds` spent
+    on all of them together. The time is split evenly between the runs, and
+    every timing records in `shared_by` how many runs it was split between.
+    """
+    for summary in summaries:
+        summary['timings'][name] = {
+            'calls': 1,
+            'seconds': seconds / len(summaries),
+            'shared_by': len(summaries),
+        }
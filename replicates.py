@@ -0,0 +1,338 @@
+"""
+Replicated simulation runs.
+
+Every replicate draws from its own random stream, seeded from the master seed
+and the replicate number. Replicates can therefore run in any process or order
+and still reproduce exactly.
+
+Estimates over replicates can be sharpened with variance-reduction methods,
+which reach a given confidence with fewer runs:
+
+- antithetic: replicates come in pairs, the second of which sees the weather
+  of the first mirrored about the seasonal averages. A pair that errs one way
+  in one run tends to err the other way in the other, so pair means vary
+  less than single runs.
+- common: every species compared in a habitat shares the random numbers of
+  each replicate, weather included, so differences between species are
+  estimated from paired runs rather than from two noisy means.
+- control: the number of months in which the weather can kill, whose
+  expected value is known, is used as a control variate. Runs that saw more
+  deadly weather than expected are corrected for it.
+
+The gain of every estimate is reported as its effective sample size, the
+number of independent runs that would give the same confidence.
+"""
+from hashlib import sha256
+from math import sqrt
+from statistics import NormalDist, mean, variance
+
+REDUCTION_ANTITHETIC = 'antithetic'
+REDUCTION_COMMON = 'common'
+REDUCTION_CONTROL = 'control'
+REDUCTIONS = (REDUCTION_ANTITHETIC, REDUCTION_COMMON, REDUCTION_CONTROL)
+
+
+def get_replicate_seed(master_seed, replicate):
+    """
+    Seed of the random stream for `replicate`, or None when no master seed is
+    given and every run should be seeded from the operating system.
+    """
+    if master_seed is None:
+        return None
+    key = '{seed}:{replicate}'.format(seed=master_seed, replicate=replicate)
+    return get_seed_from_key(key)
+
+
+def get_climate_seed(seed, habitat_name):
+    """
+    Seed of the weather of a habitat in the run seeded with `seed`. It does
+    not depend on the species, so every species in the habitat sees the same
+    weather.
+    """
+    if seed is None:
+        return None
+    key = '{seed}:climate:{habitat}'.format(seed=seed, habitat=habitat_name)
+    return get_seed_from_key(key)
+
+
+def get_seed_from_key(key):
+    return int.from_bytes(sha256(key.encode()).digest()[:8], 'big')
+
+
+def get_pair_means(values):
+    """
+    Return the means of consecutive pairs of `values`.
+    """
+    return [
+        (first + second) / 2
+        for (first, second) in zip(values[::2], values[1::2])
+    ]
+
+
+def get_controlled_values(values, controls, control_mean):
+    """
+    Return `values` corrected by the control variate `controls`, whose
+    expected value is `control_mean`, with the coefficient that minimises
+    their variance.
+    """
+    values_mean = mean(values)
+    controls_mean = mean(controls)
+    spread = sum((control - controls_mean) ** 2 for control in controls)
+    if not spread:
+        return list(values)
+    coefficient = sum(
+        (value - values_mean) * (control - controls_mean)
+        for (value, control) in zip(values, controls)
+    ) / spread
+    return [
+        value - coefficient * (control - control_mean)
+        for (value, control) in zip(values, controls)
+    ]
+
+
+class MetricSummary(object):
+    """
+    Mean of a metric over replicates and the half-width of its confidence
+    interval, using a normal approximation.
+
+    With `antithetic`, consecutive replicates are antithetic pairs. With
+    `controls`, the value of a control variate in every replicate, the mean
+    is corrected for how far they stray from their expected `control_mean`.
+    The effective sample size compares the variance of the mean with that of
+    a plain mean of independent runs whose variance is `reference_variance`,
+    which defaults to that of `values`.
+    """
+
+    def __init__(
+        self,
+        values,
+        confidence,
+        antithetic=False,
+        controls=None,
+        control_mean=None,
+        reference_variance=None,
+    ):
+        self.mean = mean(values)
+        self.margin = 0.0
+        self.effective_sample_size = float(len(values))
+        if len(values) < 2:
+            return
+
+        units = list(values)
+        if antithetic:
+            units = get_pair_means(units)
+            if controls is not None:
+                controls = get_pair_means(controls)
+        # The correction costs a degree of freedom, so it needs a third unit.
+        degrees = len(units) - 1
+        if controls is not None and len(units) > 2:
+            units = get_controlled_values(units, controls, control_mean)
+            self.mean = mean(units)
+            degrees -= 1
+        if not degrees:
+            return
+
+        units_mean = mean(units)
+        mean_variance = sum(
+            (unit - units_mean) ** 2 for unit in units
+        ) / degrees / len(units)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.margin = z * sqrt(mean_variance)
+        if reference_variance is None:
+            reference_variance = variance(values)
+        if mean_variance:
+            self.effective_sample_size = reference_variance / mean_variance
+        elif reference_variance:
+            self.effective_sample_size = float('inf')
+
+    @property
+    def low(self):
+        return self.mean - self.margin
+
+    @property
+    def high(self):
+        return self.mean + self.margin
+
+
+def get_difference_summary(
+    values,
+    baseline_values,
+    confidence,
+    antithetic=False,
+    controls=None,
+    control_mean=None,
+):
+    """
+    Summary of the difference between `values` and `baseline_values`, which
+    come from runs sharing their random numbers replicate by replicate. Its
+    effective sample size is the number of pairs of independent runs that
+    would give the same confidence.
+    """
+    return MetricSummary(
+        [
+            value - baseline
+            for (value, baseline) in zip(values, baseline_values)
+        ],
+        confidence,
+        antithetic,
+        controls,
+        control_mean,
+        variance(values) + variance(baseline_values),
+    )
+
+
+class ReplicateSummary(object):
+    """
+    Summary of the metrics of replicates. `antithetic`, `controls` and
+    `control_mean` are as taken by `MetricSummary`.
+    """
+
+    def __init__(
+        self,
+        statistics_list,
+        confidence=0.95,
+        antithetic=False,
+        controls=None,
+        control_mean=None,
+    ):
+        def summarize(values):
+            return MetricSummary(
+                list(values),
+                confidence,
+                antithetic,
+                controls,
+                control_mean,
+            )
+
+        self.replicate_count = len(statistics_list)
+        self.confidence = confidence
+        self.average_population = summarize(
+            statistics.average_population
+            for statistics in statistics_list
+        )
+        self.max_population = summarize(
+            statistics.max_population
+            for statistics in statistics_list
+        )
+        self.mortality_rate = summarize(
+            statistics.mortality_rate * 100
+            for statistics in statistics_list
+        )
+        self.extrapolated_months = summarize(
+            statistics.extrapolated_months
+            for statistics in statistics_list
+        )
+        death_types = statistics_list[0].deaths_by_type
+        self.death_percentages = {
+            death_type: summarize(
+                statistics.get_death_percentage(death_type)
+                for statistics in statistics_list
+            )
+            for death_type in death_types
+        }
+
+
+def write_replicate_report(
+    statistics_list,
+    output_stream,
+    confidence=0.95,
+    antithetic=False,
+    controls=None,
+    control_mean=None,
+    baseline=None,
+):
+    """
+    Write the report of replicates of one species/habitat pair. When
+    variance reduction is used, the effective sample sizes are reported too,
+    along with the difference from the `(name, statistics_list)` of the
+    `baseline` species when one is given.
+    """
+    summary = ReplicateSummary(
+        statistics_list,
+        confidence,
+        antithetic,
+        controls,
+        control_mean,
+    )
+
+    lines = [
+        '\t\tReplicates: {count:d} ({confidence:.0f}% confidence)'.format(
+            count=summary.replicate_count,
+            confidence=confidence * 100,
+        ),
+        '\t\tAverage Population: {mean:.2f} ± {margin:.2f}'.format(
+            mean=summary.average_population.mean,
+            margin=summary.average_population.margin,
+        ),
+        '\t\tMax Population: {mean:.2f} ± {margin:.2f}'.format(
+            mean=summary.max_population.mean,
+            margin=summary.max_population.margin,
+        ),
+        '\t\tMortality Rate: {mean:.2f}% ± {margin:.2f}%'.format(
+            mean=summary.mortality_rate.mean,
+            margin=summary.mortality_rate.margin,
+        ),
+        '\t\tCause of Death:',
+    ]
+
+    for death_reason, percentage in summary.death_percentages.items():
+        lines.append(
+            '\t\t\t{mean: 6.2f}% ± {margin:.2f}%  {reason}'.format(
+                mean=percentage.mean,
+                margin=percentage.margin,
+                reason=death_reason,
+            ),
+        )
+
+    if summary.extrapolated_months.mean:
+        lines.append(
+            '\t\tExtrapolated Months: {mean:.2f} ± {margin:.2f}'.format(
+                mean=summary.extrapolated_months.mean,
+                margin=summary.extrapolated_months.margin,
+            ),
+        )
+
+    if antithetic or controls is not None or baseline is not None:
+        lines.append(
+            '\t\tEffective Sample Size: {population:.1f} (average '
+            'population), {mortality:.1f} (mortality rate)'.format(
+                population=summary.average_population.effective_sample_size,
+                mortality=summary.mortality_rate.effective_sample_size,
+            ),
+        )
+
+    if baseline is not None:
+        (baseline_name, baseline_list) = baseline
+        for (name, get_value, unit) in (
+            (
+                'Average Population',
+                lambda statistics: statistics.average_population,
+                '',
+            ),
+            (
+                'Mortality Rate',
+                lambda statistics: statistics.mortality_rate * 100,
+                '%',
+            ),
+        ):
+            difference = get_difference_summary(
+                [get_value(statistics) for statistics in statistics_list],
+                [get_value(statistics) for statistics in baseline_list],
+                confidence,
+                antithetic,
+                controls,
+                control_mean,
+            )
+            lines.append(
+                '\t\t{name} vs {baseline}: {mean:+.2f}{unit} ± '
+                '{margin:.2f}{unit} (effective sample size {size:.1f})'.format(
+                    name=name,
+                    baseline=baseline_name,
+                    mean=difference.mean,
+                    margin=difference.margin,
+                    unit=unit,
+                    size=difference.effective_sample_size,
+                ),
+            )
+
+    print('\n'.join(lines), file=output_stream)
@@ -0,0 +1,256 @@
+"""
+Statistics of simulation runs, and the reports written from them.
+
+Besides the text report, results can be written as machine-readable records,
+one JSON object per line or one CSV row each. Records are buffered, and
+flushed once the records of a run are written, so a consumer can read the
+results of finished runs while later runs are still going.
+"""
+import csv
+import json
+import logging
+
+from models import (
+    DEATH_OLD_AGE,
+    DEATH_STARVATION,
+    DEATH_THIRST,
+    DEATH_TOO_COLD,
+    DEATH_TOO_HOT,
+)
+
+FORMAT_TEXT = 'text'
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMATS = (FORMAT_TEXT, FORMAT_JSONL, FORMAT_CSV)
+
+DEATH_TYPES = (
+    DEATH_OLD_AGE,
+    DEATH_THIRST,
+    DEATH_STARVATION,
+    DEATH_TOO_HOT,
+    DEATH_TOO_COLD,
+)
+
+
+def get_death_field(death_type):
+    return 'deaths_{name}'.format(name=death_type.replace(' ', '_'))
+
+
+DEATH_FIELDS = tuple(get_death_field(death_type) for death_type in DEATH_TYPES)
+RUN_FIELDS = (
+    'species',
+    'habitat',
+    'replicate',
+    'seed',
+    'months',
+    'average_population',
+    'max_population',
+    'final_population',
+    'mortality_rate',
+) + DEATH_FIELDS + ('extrapolated_months',)
+SERIES_FIELDS = (
+    'species',
+    'habitat',
+    'replicate',
+    'month',
+    'population',
+    'temperature',
+) + DEATH_FIELDS
+
+
+class SimulationStatistics(object):
+    """
+    Running totals for a single species/habitat simulation.
+
+    Every engine feeds one population count and one set of death counts per
+    simulated month, so the report does not depend on how the population is
+    stored.
+    """
+
+    def __init__(self):
+        self.step_count = 0
+        self.total_population = 0
+        self.max_population = 0
+        self.final_population = 0
+        # Months projected from a steady state rather than simulated.
+        self.extrapolated_months = 0
+        self.deaths_by_type = {death_type: 0 for death_type in DEATH_TYPES}
+
+    def add_step(self, population, deaths):
+        """
+        Record a month with `population` live animals, where `deaths` maps a
+        death type to the number of animals that died of it.
+        """
+        self.step_count += 1
+        self.total_population += population
+        self.max_population = max(self.max_population, population)
+        self.final_population = population
+
+        for death_type, count in deaths.items():
+            self.deaths_by_type[death_type] += count
+
+    def add_steps(self, population, months):
+        """
+        Record `months` months with `population` live animals in which no
+        animal died.
+        """
+        self.step_count += months
+        self.total_population += population * months
+        self.max_population = max(self.max_population, population)
+        self.final_population = population
+
+    @property
+    def average_population(self):
+        return self.total_population / self.step_count
+
+    @property
+    def total_deaths(self):
+        return sum(self.deaths_by_type.values())
+
+    @property
+    def mortality_rate(self):
+        total_born = self.total_deaths + self.final_population
+        return self.total_deaths / total_born
+
+    def get_death_percentage(self, death_type):
+        total_deaths = self.total_deaths
+        if total_deaths > 0:
+            return self.deaths_by_type[death_type] / total_deaths * 100
+        return 0
+
+
+def write_simulation_report(statistics, output_stream):
+    average_population = statistics.average_population
+    max_population = statistics.max_population
+
+    logging.info('Average population: %d', average_population)
+    logging.info('Maximum population: %d', max_population)
+
+    mortality_rate = statistics.mortality_rate
+
+    logging.info('Mortality rate: %.2f%%', mortality_rate * 100)
+
+    lines = [
+        '\t\tAverage Population: {count:.2f}'.format(count=average_population),
+        '\t\tMax Population: {count:d}'.format(count=max_population),
+        '\t\tMortality Rate: {rate:.2f}%'.format(rate=mortality_rate * 100),
+        '\t\tCause of Death:',
+    ]
+
+    for death_reason, count in statistics.deaths_by_type.items():
+        logging.info('Deaths due to %s: %d', death_reason, count)
+        percentage = statistics.get_death_percentage(death_reason)
+        lines.append('\t\t\t{percentage: 6.2f}%  {reason}'.format(
+            percentage=percentage,
+            reason=death_reason,
+        ))
+
+    if statistics.extrapolated_months:
+        lines.append('\t\tExtrapolated Months: {count:d}'.format(
+            count=statistics.extrapolated_months,
+        ))
+
+    print('\n'.join(lines), file=output_stream)
+
+
+class TimeSeries(object):
+    """
+    Population, temperature and deaths of every simulated month of a run.
+
+    Engines record each month as it is simulated. Only these few numbers are
+    kept, never the animals of a month, so a series costs the same whatever
+    the size of the population.
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def record_step(self, month, population, temperature, deaths):
+        """
+        Record that `month` ended with `population` live animals at
+        `temperature`, where `deaths` maps a death type to the number of
+        animals that died of it.
+        """
+        self.steps.append((
+            month,
+            int(population),
+            float(temperature),
+            tuple(
+                int(deaths.get(death_type, 0))
+                for death_type in DEATH_TYPES
+            ),
+        ))
+
+    def get_records(self, **fields):
+        """
+        Yield a record of every month, to which `fields` are added.
+        """
+        for (month, population, temperature, deaths) in self.steps:
+            record = dict(
+                fields,
+                month=month,
+                population=population,
+                temperature=temperature,
+            )
+            record.update(zip(DEATH_FIELDS, deaths))
+            yield record
+
+
+def get_run_record(statistics, **fields):
+    """
+    Return the record of a run, to which `fields` are added.
+    """
+    record = dict(
+        fields,
+        months=statistics.step_count - 1,
+        average_population=statistics.average_population,
+        max_population=statistics.max_population,
+        final_population=statistics.final_population,
+        mortality_rate=statistics.mortality_rate,
+        extrapolated_months=statistics.extrapolated_months,
+    )
+    for (field, death_type) in zip(DEATH_FIELDS, DEATH_TYPES):
+        record[field] = statistics.deaths_by_type[death_type]
+    return record
+
+
+class JsonLinesWriter(object):
+    def __init__(self, output_stream, fields):
+        self.output_stream = output_stream
+        self.fields = fields
+
+    def write(self, record):
+        line = json.dumps({field: record[field] for field in self.fields})
+        self.output_stream.write(line + '\n')
+
+    def flush(self):
+        self.output_stream.flush()
+
+
+class CsvWriter(object):
+    def __init__(self, output_stream, fields):
+        self.output_stream = output_stream
+        self.writer = csv.DictWriter(
+            output_stream,
+            fields,
+            extrasaction='ignore',
+            lineterminator='\n',
+        )
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def flush(self):
+        self.output_stream.flush()
+
+
+def get_record_writer(output_format, output_stream, fields):
+    """
+    Return a writer of records made of `fields` in `output_format`, whose
+    `write(record)` writes one record to `output_stream`, and whose `flush()`
+    flushes the records written so far.
+    """
+    if output_format == FORMAT_CSV:
+        return CsvWriter(output_stream, fields)
+    return JsonLinesWriter(output_stream, fields)
@@ -0,0 +1,152 @@
+"""
+Persistent cache of finished simulation results.
+
+Results are keyed by a hash of everything that determines a seeded run: the
+species and habitat attributes, the number of years, the seed and the engine
+version. The cache is bounded in size, evicting the least recently used
+results first.
+"""
+from contextlib import closing
+from hashlib import sha256
+import json
+import logging
+import os
+import pickle
+
+from fileutils import write_atomically
+from parallel import run_in_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+RESULT_SUFFIX = '.result'
+
+
+def get_default_cache_directory():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'),
+        '.cache',
+    )
+    return os.path.join(cache_home, 'species-sim')
+
+
+def get_cache_key(inputs):
+    """
+    Content hash of `inputs`, a JSON-serializable description of a run.
+    """
+    encoded = json.dumps(inputs, sort_keys=True).encode()
+    return sha256(encoded).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+    def get(self, key):
+        """
+        Return the result stored under `key`, or None on a cache miss.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as result_file:
+                result = pickle.load(result_file)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError, AttributeError):
+            logger.warning('Discarding unreadable cached result %s', path)
+            os.unlink(path)
+            return None
+
+        # The modification time records when a result was last used.
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        write_atomically(self.get_path(key), data)
+        self.evict()
+
+    def get_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(RESULT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Delete the least recently used results until the cache fits in
+        `max_bytes`.
+        """
+        entries = sorted(self.get_entries())
+        total_bytes = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for (_, _, path) in self.get_entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def run_cached(function, arguments, keys, jobs, cache=None):
+    """
+    Like `parallel.run_in_pool`, but calls sharing a key are only run once,
+    and results already in `cache` are not run at all. A key of None marks a
+    call that must always run.
+    """
+    # Each call is either answered from the cache or mapped to the index of
+    # the call that computes its result.
+    plan = []
+    pending_arguments = []
+    pending_keys = []
+    pending_indexes = {}
+    for (args, key) in zip(arguments, keys):
+        if key is not None:
+            if cache is not None:
+                result = cache.get(key)
+                if result is not None:
+                    plan.append((result, None))
+                    continue
+            if key in pending_indexes:
+                plan.append((None, pending_indexes[key]))
+                continue
+            pending_indexes[key] = len(pending_arguments)
+        plan.append((None, len(pending_arguments)))
+        pending_arguments.append(args)
+        pending_keys.append(key)
+
+    results = run_in_pool(function, pending_arguments, jobs)
+    computed = []
+    with closing(results):
+        for (cached_result, index) in plan:
+            if index is None:
+                yield cached_result
+                continue
+
+            while len(computed) <= index:
+                result = next(results)
+                key = pending_keys[len(computed)]
+                if cache is not None and key is not None:
+                    cache.put(key, result)
+                computed.append(result)
+            yield computed[index]
@@ -0,0 +1,58 @@
+"""
+Random draws that replace one draw per animal with a single draw per batch.
+
+Functions accept either a `random.Random`-like generator or a NumPy
+`Generator`, and use the faster native routine when one is available.
+"""
+import random
+
+
+def is_numpy_generator(rng):
+    return hasattr(rng, 'bit_generator')
+
+
+def get_binomial(count, probability, rng=random):
+    """
+    Number of successes in `count` independent trials that each succeed with
+    `probability`.
+    """
+    if is_numpy_generator(rng):
+        return int(rng.binomial(count, probability))
+    if hasattr(rng, 'binomialvariate'):
+        # Python 3.12 and later
+        return rng.binomialvariate(count, probability)
+    return sum(1 for trial in range(count) if rng.random() <= probability)
+
+
+def get_hypergeometric(total, successes, draws, rng=random):
+    """
+    Number of successes among `draws` items picked without replacement from
+    `total` items, `successes` of which are successes.
+    """
+    if is_numpy_generator(rng):
+        return int(rng.hypergeometric(successes, total - successes, draws))
+    if draws > total // 2:
+        return successes - get_hypergeometric(
+            total,
+            successes,
+            total - draws,
+            rng,
+        )
+    return sum(
+        1
+        for index in rng.sample(range(total), draws)
+        if index < successes
+    )
+
+
+def get_rounded_share(count, fraction, rng=random):
+    """
+    `count * fraction`, rounded up or down at random so that its expected
+    value is exact. A cheap stand-in for a binomial or hypergeometric draw
+    where only the expected value matters.
+    """
+    share = count * fraction
+    whole = int(share)
+    if rng.random() < share - whole:
+        whole += 1
+    return whole
@@ -0,0 +1,450 @@
+"""
+Long-running local simulation service.
+
+    python service.py example_config.yml --socket /tmp/species-sim.sock
+
+The configuration is loaded and the worker processes are started once, so a
+job costs only its simulation. Clients connect to the Unix socket, or to
+`--port` on the loopback interface, and exchange JSON objects, one per line:
+
+    {"op": "submit", "species": "kangaroo", "habitat": "plains", "seed": 1}
+    {"op": "cancel", "job": 3}
+    {"op": "status"}
+
+`species` and `habitat` name an entry of the configuration, or are given in
+full in the layout of the configuration file. `years` defaults to the
+configuration's, and `engine` to the object engine. A submitted job is
+acknowledged with its id, and its result record is sent back on the same
+connection as soon as it finishes, so results stream in completion order.
+A seeded job gives the same result as `main.py` run with that seed.
+
+Submissions wait while the job queue is full, which stops the service from
+reading more from that connection until a job has started. Only queued jobs
+can be cancelled, and are dropped from the queue; a job that has already
+started runs to the end and its result is sent as usual. Jobs of a client
+that disconnects are cancelled, and the results of those already running
+are discarded.
+"""
+from argparse import ArgumentParser
+import asyncio
+from itertools import count
+import json
+import logging
+import os
+
+from conf_parser import (
+    ConfigurationError,
+    habitat_from_config,
+    load_configuration,
+    species_from_config,
+)
+from main import (
+    ENGINE_BATCH,
+    ENGINE_OBJECT,
+    ENGINES,
+    get_climate_schedule,
+    get_run_key,
+    run_simulation,
+)
+from parallel import get_job_count, get_worker_pool
+from replicates import get_replicate_seed
+from reporting import get_run_record
+from result_cache import ResultCache, get_default_cache_directory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_CANCELLED = 'cancelled'
+STATE_FAILED = 'failed'
+STATES = (
+    STATE_QUEUED,
+    STATE_RUNNING,
+    STATE_DONE,
+    STATE_CANCELLED,
+    STATE_FAILED,
+)
+
+
+class RequestError(ValueError):
+    """
+    Raised for a request the service cannot act on. Its message is sent back
+    to the client.
+    """
+
+
+class Connection(object):
+    """
+    Client connection, through which the messages of its jobs are sent.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.jobs = set()
+        self.closed = False
+
+    async def send(self, message):
+        if self.closed:
+            return
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        try:
+            # Waiting for the client to read keeps a slow client from
+            # piling up results in memory.
+            await self.writer.drain()
+        except ConnectionError:
+            self.closed = True
+
+
+class Job(object):
+    def __init__(self, job_id, connection, run_arguments):
+        self.id = job_id
+        self.connection = connection
+        self.run_arguments = run_arguments
+        self.state = STATE_QUEUED
+
+    @property
+    def species(self):
+        return self.run_arguments[1]
+
+    @property
+    def habitat(self):
+        return self.run_arguments[2]
+
+    @property
+    def seed(self):
+        return self.run_arguments[4]
+
+
+class SimulationService(object):
+    """
+    Queue of simulation jobs, run on a pool of `jobs` worker processes.
+
+    At most `queue_size` jobs wait for a worker. Results of seeded runs are
+    kept in `cache` when one is given.
+    """
+
+    def __init__(
+        self,
+        configuration,
+        executor,
+        jobs=1,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        cache=None,
+    ):
+        self.configuration = configuration
+        self.executor = executor
+        self.worker_count = get_job_count(jobs)
+        self.cache = cache
+        self.queue = asyncio.Queue(queue_size)
+        self.jobs = {}
+        self.job_ids = count(1)
+        self.counts = {state: 0 for state in STATES}
+        self.workers = []
+
+    def start(self):
+        # One dispatcher per worker process, so no more jobs are handed to
+        # the pool than it can run, and the rest can still be cancelled.
+        self.workers = [
+            asyncio.ensure_future(self.dispatch())
+            for _ in range(self.worker_count)
+        ]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def set_state(self, job, state):
+        self.counts[job.state] -= 1
+        self.counts[state] += 1
+        job.state = state
+        if state in (STATE_DONE, STATE_CANCELLED, STATE_FAILED):
+            del self.jobs[job.id]
+            job.connection.jobs.discard(job.id)
+
+    def get_named(self, value, entries, from_config, field):
+        if isinstance(value, str):
+            for entry in entries:
+                if entry.name == value:
+                    return entry
+            raise RequestError('unknown {field} {name!r}'.format(
+                field=field,
+                name=value,
+            ))
+        if isinstance(value, dict):
+            try:
+                return from_config(value, field)
+            except ConfigurationError as error:
+                raise RequestError(str(error))
+        raise RequestError('{field} must be a name or a mapping'.format(
+            field=field,
+        ))
+
+    def get_run_arguments(self, request):
+        """
+        Arguments of `main.run_simulation` for a submit `request`.
+        """
+        species = self.get_named(
+            request.get('species'),
+            self.configuration.species,
+            species_from_config,
+            'species',
+        )
+        habitat = self.get_named(
+            request.get('habitat'),
+            self.configuration.habitats,
+            habitat_from_config,
+            'habitat',
+        )
+        years = request.get('years', self.configuration.years)
+        if isinstance(years, bool) or not isinstance(years, int) or years < 0:
+            raise RequestError('years must be a non-negative integer')
+        seed = request.get('seed')
+        if seed is not None and (
+            isinstance(seed, bool) or not isinstance(seed, int)
+        ):
+            raise RequestError('seed must be an integer')
+        engine = request.get('engine', ENGINE_OBJECT)
+        if engine not in ENGINES or engine == ENGINE_BATCH:
+            raise RequestError('unsupported engine {engine!r}'.format(
+                engine=engine,
+            ))
+
+        # Seeds are master seeds, so results match those of main.py.
+        seed = get_replicate_seed(seed, 0)
+        climate = get_climate_schedule(engine, habitat, years, seed)
+        return (
+            engine,
+            species,
+            habitat,
+            years,
+            seed,
+            None,
+            None,
+            None,
+            climate,
+        )
+
+    async def submit(self, connection, request):
+        run_arguments = self.get_run_arguments(request)
+        job = Job(next(self.job_ids), connection, run_arguments)
+        self.jobs[job.id] = job
+        connection.jobs.add(job.id)
+        self.counts[STATE_QUEUED] += 1
+        # Waits while the queue is full, and with it the connection.
+        await self.queue.put(job)
+        await connection.send({'job': job.id, 'state': STATE_QUEUED})
+
+    async def cancel(self, job_id):
+        """
+        Cancel the job `job_id` if it is still queued, and return whether it
+        was. Running and finished jobs are left alone.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.state != STATE_QUEUED:
+            return False
+        self.set_state(job, STATE_CANCELLED)
+        await job.connection.send({'job': job.id, 'state': STATE_CANCELLED})
+        return True
+
+    def get_status(self):
+        return {
+            'workers': self.worker_count,
+            'queue_size': self.queue.maxsize,
+            'jobs': dict(self.counts),
+        }
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.state != STATE_QUEUED:
+                continue
+            self.set_state(job, STATE_RUNNING)
+
+            key = get_run_key(*job.run_arguments)
+            statistics = None
+            if self.cache is not None and key is not None:
+                statistics = self.cache.get(key)
+            try:
+                if statistics is None:
+                    statistics = await loop.run_in_executor(
+                        self.executor,
+                        run_simulation,
+                        *job.run_arguments
+                    )
+                    if self.cache is not None and key is not None:
+                        self.cache.put(key, statistics)
+            except Exception as error:
+                logger.exception('Job %d failed', job.id)
+                if job.state == STATE_RUNNING:
+                    self.set_state(job, STATE_FAILED)
+                    await job.connection.send({
+                        'job': job.id,
+                        'state': STATE_FAILED,
+                        'error': str(error),
+                    })
+                continue
+
+            if job.state != STATE_RUNNING:
+                # Its client disconnected while it ran.
+                continue
+            self.set_state(job, STATE_DONE)
+            await job.connection.send({
+                'job': job.id,
+                'state': STATE_DONE,
+                'result': get_run_record(
+                    statistics,
+                    species=job.species.name,
+                    habitat=job.habitat.name,
+                    seed=job.seed,
+                ),
+            })
+
+    async def handle_request(self, connection, request):
+        if not isinstance(request, dict):
+            raise RequestError('a request must be a JSON object')
+        operation = request.get('op')
+        if operation == 'submit':
+            await self.submit(connection, request)
+        elif operation == 'cancel':
+            job_id = request.get('job')
+            await connection.send({
+                'job': job_id,
+                'cancelled': await self.cancel(job_id),
+            })
+        elif operation == 'status':
+            await connection.send(self.get_status())
+        else:
+            raise RequestError('unknown op {operation!r}'.format(
+                operation=operation,
+            ))
+
+    async def handle_connection(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            while not connection.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    await self.handle_request(connection, request)
+                except (ValueError, RequestError) as error:
+                    await connection.send({'error': str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            connection.closed = True
+            for job_id in list(connection.jobs):
+                job = self.jobs[job_id]
+                self.set_state(job, STATE_CANCELLED)
+            writer.close()
+
+
+async def serve(service, socket_path=None, port=None):
+    """
+    Accept connections on the Unix socket `socket_path`, or on `port` of the
+    loopback interface, until cancelled.
+    """
+    service.start()
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(
+            service.handle_connection,
+            socket_path,
+        )
+    else:
+        server = await asyncio.start_server(
+            service.handle_connection,
+            '127.0.0.1',
+            port,
+        )
+    logger.info('Serving on %s', socket_path or port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def get_argument_parser():
+    parser = ArgumentParser(
+        description='Serve simulation jobs from a pool of worker processes',
+    )
+    parser.add_argument(
+        'config',
+        help='Path to a YAML environment configuration file',
+    )
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument(
+        '--socket',
+        help='Path of the Unix socket to listen on',
+    )
+    address.add_argument(
+        '--port',
+        type=int,
+        help='Port to listen on, on the loopback interface only',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of worker processes. 0 uses one process per CPU',
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help='Number of jobs that can wait for a worker before submissions '
+        'are held back',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=get_default_cache_directory(),
+        help='Directory of the cache of finished seeded runs',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Neither read nor write cached results',
+    )
+    return parser
+
+
+def main():
+    parser = get_argument_parser()
+    arguments = parser.parse_args()
+    if arguments.queue_size < 1:
+        parser.error('--queue-size must be at least 1')
+    cache = None
+    if not arguments.no_cache:
+        cache = ResultCache(arguments.cache_dir)
+    try:
+        configuration = load_configuration(arguments.config, cache)
+    except ConfigurationError as error:
+        parser.error('invalid configuration {path}: {error}'.format(
+            path=arguments.config,
+            error=error,
+        ))
+
+    with get_worker_pool(arguments.jobs) as executor:
+        service = SimulationService(
+            configuration,
+            executor,
+            arguments.jobs,
+            arguments.queue_size,
+            cache,
+        )
+        try:
+            asyncio.run(serve(service, arguments.socket, arguments.port))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Detection of simulations that have settled into a steady state.
+
+Once a population is pinned at the habitat's carrying capacity, every further
+year looks like the last one. A `SteadyStateDetector` compares the two most
+recent windows of whole years and, when they agree, the rest of the run is
+projected by repeating the latest window instead of being simulated.
+"""
+from collections import deque
+import logging
+
+from models import MONTHS_IN_YEAR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_YEARS = 5
+DEFAULT_TOLERANCE = 0.02
+
+
+def is_close(first, second, scale, tolerance):
+    return abs(first - second) <= tolerance * scale
+
+
+class SteadyStateDetector(object):
+    """
+    Watches the monthly statistics of one run.
+
+    The run is steady when animals die in both of the last two windows of
+    `window_years`, and the total population and the deaths of every type
+    differ between them by no more than `tolerance`, relative to the larger
+    of the two. Windows span whole years, so both see every season equally
+    often. Nothing is compared during the first `warmup_months`.
+    """
+
+    def __init__(
+        self,
+        window_years=DEFAULT_WINDOW_YEARS,
+        tolerance=DEFAULT_TOLERANCE,
+        warmup_months=0,
+    ):
+        self.window_years = window_years
+        self.tolerance = tolerance
+        self.warmup_months = warmup_months
+        self.window = window_years * MONTHS_IN_YEAR
+        self.steps = deque(maxlen=2 * self.window)
+        self.death_types = ()
+        self.deaths = None
+
+    @property
+    def settings(self):
+        return {
+            'window_years': self.window_years,
+            'tolerance': self.tolerance,
+            'warmup_months': self.warmup_months,
+        }
+
+    def observe(self, statistics, months=1):
+        """
+        Record the `months` months just added to `statistics`, and return
+        whether the run has reached a steady state. When `months` is more
+        than one, the population was the same in all of them and any deaths
+        are counted in the last one.
+        """
+        deaths = tuple(statistics.deaths_by_type.values())
+        if self.deaths is None:
+            self.death_types = tuple(statistics.deaths_by_type)
+            step_deaths = deaths
+        else:
+            step_deaths = tuple(
+                total - previous
+                for (total, previous) in zip(deaths, self.deaths)
+            )
+        self.deaths = deaths
+        quiet_step = (
+            statistics.final_population,
+            (0,) * len(self.death_types),
+        )
+        self.steps.extend([quiet_step] * min(months - 1, self.steps.maxlen))
+        self.steps.append((statistics.final_population, step_deaths))
+
+        # Comparing the windows once a year is plenty, and keeps the cost of
+        # detection negligible.
+        if len(self.steps) < self.steps.maxlen:
+            return False
+        if statistics.step_count % MONTHS_IN_YEAR:
+            return False
+        if statistics.step_count <= self.warmup_months:
+            return False
+        return self.is_steady()
+
+    def is_steady(self):
+        steps = list(self.steps)
+        (earlier, later) = (steps[:self.window], steps[self.window:])
+        earlier_population = sum(population for (population, _) in earlier)
+        later_population = sum(population for (population, _) in later)
+        if not later_population:
+            return False
+        if not is_close(
+            earlier_population,
+            later_population,
+            max(earlier_population, later_population),
+            self.tolerance,
+        ):
+            return False
+
+        earlier_deaths = [sum(column) for column in zip(*(
+            deaths for (_, deaths) in earlier
+        ))]
+        later_deaths = [sum(column) for column in zip(*(
+            deaths for (_, deaths) in later
+        ))]
+        # A population that neither dies nor breeds, like one waiting to
+        # reach breeding age, is not steady yet.
+        if not sum(earlier_deaths) or not sum(later_deaths):
+            return False
+        scale = max(sum(earlier_deaths), sum(later_deaths))
+        return all(
+            is_close(earlier_count, later_count, scale, self.tolerance)
+            for (earlier_count, later_count) in zip(
+                earlier_deaths,
+                later_deaths,
+            )
+        )
+
+    def project(self, statistics, months):
+        """
+        Add `months` more months to `statistics` by repeating the latest
+        window, which keeps every month in its season.
+        """
+        logger.info('Steady state reached, extrapolating %d months', months)
+        window = list(self.steps)[-self.window:]
+        for month in range(months):
+            (population, deaths) = window[month % self.window]
+            statistics.add_step(population, dict(zip(
+                self.death_types,
+                deaths,
+            )))
+        statistics.extrapolated_months += months
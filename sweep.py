@@ -0,0 +1,437 @@
+"""
+Parameter sweeps over species and habitat fields.
+
+    python sweep.py example_config.yml --seed 1 \
+        --vary life_span=10:30:10 --vary habitat.monthly_food=50,100,200
+
+Every combination of the varied values is run for every species/habitat pair
+of the configuration, and a table row is printed as soon as each run
+finishes. Runs stop early once their population is extinct or has reached a
+steady state, whose remaining months are then extrapolated.
+"""
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import closing
+import copy
+from itertools import product
+import sys
+
+from conf_parser import (
+    HABITAT_FIELDS,
+    INTEGER,
+    SPECIES_FIELDS,
+    ConfigurationError,
+    check_range,
+    load_configuration,
+)
+from main import (
+    ENGINE_BATCH,
+    ENGINE_OBJECT,
+    ENGINES,
+    get_climate_schedule,
+    get_run_key,
+    run_simulation,
+    run_simulations,
+)
+from models import MONTHS_IN_YEAR, Habitat, Species
+from replicates import get_replicate_seed
+from result_cache import ResultCache, get_default_cache_directory
+from steady_state import (
+    DEFAULT_TOLERANCE,
+    DEFAULT_WINDOW_YEARS,
+    SteadyStateDetector,
+)
+
+TARGETS = {
+    'species': Species,
+    'habitat': Habitat,
+}
+# Expected type and allowed range of every field that can be varied, as the
+# configuration checks them.
+FIELD_RULES = {
+    (target, attribute): (expected, allowed)
+    for (target, fields) in (
+        ('species', SPECIES_FIELDS),
+        ('habitat', HABITAT_FIELDS),
+    )
+    for (_, attribute, expected, allowed) in fields
+}
+
+OUTCOME_EXTINCT = 'extinct'
+OUTCOME_STEADY = 'steady'
+OUTCOME_COMPLETE = 'complete'
+
+
+class SweepError(ValueError):
+    """
+    Raised for a sweep that selects nothing to run.
+    """
+
+
+class Variation(object):
+    """
+    Values taken by one numeric field of `Species` or `Habitat`.
+    """
+
+    def __init__(self, target, field, values):
+        self.target = target
+        self.field = field
+        self.values = values
+
+    @property
+    def name(self):
+        return '{target}.{field}'.format(target=self.target, field=self.field)
+
+
+def parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        raise ArgumentTypeError('{text!r} is not a number'.format(text=text))
+
+
+def parse_values(text):
+    """
+    Parse either a comma-separated list of values or an inclusive range
+    `start:stop[:step]`, whose step defaults to 1.
+    """
+    if ':' not in text:
+        return [parse_number(value) for value in text.split(',')]
+
+    bounds = [parse_number(value) for value in text.split(':')]
+    if len(bounds) not in (2, 3):
+        raise ArgumentTypeError(
+            'a range is start:stop[:step], not {text!r}'.format(text=text),
+        )
+    (start, stop, step) = (bounds + [1])[:3]
+    if step <= 0:
+        raise ArgumentTypeError('the step of a range must be positive')
+
+    values = []
+    # Values are computed from the start rather than accumulated, so float
+    # steps do not drift.
+    while start + len(values) * step <= stop + step * 1e-9:
+        values.append(start + len(values) * step)
+    return values
+
+
+def parse_variation(text):
+    """
+    Parse `FIELD=VALUES`, where FIELD is a `Species` or `Habitat` field,
+    optionally prefixed by `species.` or `habitat.`.
+    """
+    (name, separator, values) = text.partition('=')
+    if not separator:
+        raise ArgumentTypeError('expected FIELD=VALUES, not {text!r}'.format(
+            text=text,
+        ))
+
+    (target, _, field) = name.rpartition('.')
+    targets = [target] if target else list(TARGETS)
+    for target in targets:
+        if target not in TARGETS:
+            raise ArgumentTypeError('unknown target {target!r}'.format(
+                target=target,
+            ))
+        if (target, field) in FIELD_RULES:
+            return Variation(target, field, [
+                get_field_value(target, field, value)
+                for value in parse_values(values)
+            ])
+
+    raise ArgumentTypeError('{name!r} is not a numeric field'.format(
+        name=name,
+    ))
+
+
+def get_field_value(target, field, value):
+    """
+    Return `value` as a value of `field` of `target`, rejecting the values a
+    configuration file could not give it.
+    """
+    name = '{target}.{field}'.format(target=target, field=field)
+    (expected, allowed) = FIELD_RULES[target, field]
+    if expected == INTEGER:
+        if value != int(value):
+            raise ArgumentTypeError('{name} takes integers, not '
+                                    '{value!r}'.format(
+                                        name=name,
+                                        value=value,
+                                    ))
+        value = int(value)
+    try:
+        return check_range(value, allowed, name)
+    except ConfigurationError as error:
+        raise ArgumentTypeError(str(error))
+
+
+def get_sweep_points(variations):
+    """
+    Yield every combination of `variations`, as its values and the species
+    and habitat field assignments they make.
+    """
+    for values in product(*(variation.values for variation in variations)):
+        assignments = {target: {} for target in TARGETS}
+        for (variation, value) in zip(variations, values):
+            assignments[variation.target][variation.field] = value
+        yield (values, assignments['species'], assignments['habitat'])
+
+
+def get_varied(base, values):
+    varied = copy.copy(base)
+    for (field, value) in values.items():
+        setattr(varied, field, value)
+    return varied
+
+
+def get_outcome(statistics):
+    if not statistics.final_population:
+        return OUTCOME_EXTINCT
+    if statistics.extrapolated_months:
+        return OUTCOME_STEADY
+    return OUTCOME_COMPLETE
+
+
+def get_table_format(variations):
+    columns = ['{species:<12}', '{habitat:<12}']
+    columns += [
+        '{{values[{index:d}]:>{width:d}}}'.format(
+            index=index,
+            width=max(len(variation.name), 8),
+        )
+        for (index, variation) in enumerate(variations)
+    ]
+    columns += [
+        '{average:>12}',
+        '{max:>10}',
+        '{final:>10}',
+        '{mortality:>10}',
+        '{outcome}',
+    ]
+    return ' '.join(columns)
+
+
+def write_table_header(variations, output_stream):
+    print(
+        get_table_format(variations).format(
+            species='species',
+            habitat='habitat',
+            values=[variation.name for variation in variations],
+            average='average',
+            max='max',
+            final='final',
+            mortality='mortality',
+            outcome='outcome',
+        ),
+        file=output_stream,
+        flush=True,
+    )
+
+
+def write_table_row(variations, point, statistics, output_stream):
+    (species, habitat, values) = point
+    print(
+        get_table_format(variations).format(
+            species=species.name,
+            habitat=habitat.name,
+            values=values,
+            average='{:.2f}'.format(statistics.average_population),
+            max=statistics.max_population,
+            final=statistics.final_population,
+            mortality='{:.2f}%'.format(statistics.mortality_rate * 100),
+            outcome=get_outcome(statistics),
+        ),
+        file=output_stream,
+        flush=True,
+    )
+
+
+def get_selected(items, names, kind):
+    """
+    Return the species or habitats of `items` named in `names`, or all of
+    them when no names are given. Raises `SweepError` for a name that is not
+    in `items`.
+    """
+    if not names:
+        return list(items)
+    unknown = sorted(set(names) - {item.name for item in items})
+    if unknown:
+        raise SweepError('no {kind} named {names} in the '
+                         'configuration'.format(
+                             kind=kind,
+                             names=', '.join(unknown),
+                         ))
+    return [item for item in items if item.name in names]
+
+
+def run_sweep(arguments, output_stream=sys.stdout):
+    cache = None
+    if not arguments.no_cache:
+        cache = ResultCache(arguments.cache_dir)
+    configuration = load_configuration(arguments.config, cache)
+    years = arguments.years
+    if years is None:
+        years = configuration.years
+    variations = arguments.vary
+    seed = get_replicate_seed(arguments.seed, 0)
+
+    species_list = get_selected(
+        configuration.species,
+        arguments.species,
+        'species',
+    )
+    habitats = get_selected(
+        configuration.habitats,
+        arguments.habitat,
+        'habitat',
+    )
+
+    # No sweepable field changes temperatures, so the weather of a habitat is
+    # drawn once and shared by every run in it.
+    climates = [
+        get_climate_schedule(arguments.engine, habitat, years, seed)
+        for habitat in habitats
+    ]
+
+    points = []
+    run_arguments = []
+    for (base_species, (base_habitat, climate)) in product(
+        species_list,
+        zip(habitats, climates),
+    ):
+        for (values, species_values, habitat_values) in get_sweep_points(
+            variations,
+        ):
+            species = get_varied(base_species, species_values)
+            habitat = get_varied(base_habitat, habitat_values)
+            steady_state = None
+            if not arguments.no_early_stop:
+                steady_state = SteadyStateDetector(
+                    arguments.steady_state_window,
+                    arguments.steady_state_tolerance,
+                    species.life_span * MONTHS_IN_YEAR,
+                )
+            points.append((species, habitat, values))
+            run_arguments.append((
+                arguments.engine,
+                species,
+                habitat,
+                years,
+                seed,
+                None,
+                steady_state,
+                None,
+                climate,
+            ))
+
+    results = run_simulations(
+        run_simulation,
+        run_arguments,
+        [get_run_key(*args) for args in run_arguments],
+        arguments.jobs,
+        cache,
+        arguments.seed,
+    )
+
+    write_table_header(variations, output_stream)
+    with closing(results):
+        for (point, statistics) in zip(points, results):
+            write_table_row(variations, point, statistics, output_stream)
+
+
+def get_argument_parser():
+    parser = ArgumentParser(
+        description='Run every combination of species and habitat field '
+        'values',
+    )
+    parser.add_argument(
+        'config',
+        help='Path to a YAML environment configuration file',
+    )
+    parser.add_argument(
+        '--vary',
+        type=parse_variation,
+        action='append',
+        default=[],
+        metavar='FIELD=VALUES',
+        help='Values of a species or habitat field, such as life_span=10,20 '
+        'or habitat.monthly_food=50:200:50. Ranges include their end',
+    )
+    parser.add_argument(
+        '--species',
+        action='append',
+        help='Only sweep this species of the configuration',
+    )
+    parser.add_argument(
+        '--habitat',
+        action='append',
+        help='Only sweep this habitat of the configuration',
+    )
+    parser.add_argument(
+        '--years',
+        type=int,
+        help='Number of simulated years. If omitted, use the configuration',
+    )
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_OBJECT)
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes running simulations in parallel. '
+        '0 uses one process per CPU',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Master seed. Sweeps with the same seed reproduce exactly',
+    )
+    parser.add_argument(
+        '--no-early-stop',
+        action='store_true',
+        help='Simulate every month of runs that reach a steady state',
+    )
+    parser.add_argument(
+        '--steady-state-window',
+        type=int,
+        default=DEFAULT_WINDOW_YEARS,
+    )
+    parser.add_argument(
+        '--steady-state-tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=get_default_cache_directory(),
+        help='Directory of the cache of finished seeded runs',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Neither read nor write cached results',
+    )
+    return parser
+
+
+def main():
+    parser = get_argument_parser()
+    arguments = parser.parse_args()
+    if arguments.engine == ENGINE_BATCH and not arguments.no_early_stop:
+        # Batched runs always simulate every month.
+        parser.error('the batch engine requires --no-early-stop')
+    try:
+        run_sweep(arguments)
+    except SweepError as error:
+        parser.error(str(error))
+    except ConfigurationError as error:
+        parser.error('invalid configuration {path}: {error}'.format(
+            path=arguments.config,
+            error=error,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,117 @@
 from models import (
+    ALLOCATION_FIRST_COME,
+    ALLOCATION_OLDEST_FIRST,
+    ALLOCATION_RANDOM,
+    ALLOCATION_YOUNGEST_FIRST,
     DEATH_OLD_AGE,
     DEATH_STARVATION,
     DEATH_THIRST,
     DEATH_TOO_HOT,
     DEATH_TOO_COLD,
     GENDER_FEMALE,
+    GENDER_MALE,
     MONTHS_IN_YEAR,
+    AgeCheck,
     Animal,
+    AnimalPool,
+    FoodCheck,
     Habitat,
+    HeatCheck,
     SimulationStep,
     Species,
     SEASON_SPRING,
     SEASON_SUMMER,
     SEASON_FALL,
     SEASON_WINTER,
+    can_breed,
+    count_born_before,
+    get_breeding_animals,
+    get_fed_count,
 )
-from unittest import TestCase
+from argparse import ArgumentTypeError
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import json
+import os
+from tempfile import TemporaryDirectory
+from random import Random
+from statistics import mean
+from unittest import TestCase, skipIf
 from main import (
+    generate_simulation_report,
+    get_climate_schedule,
+    get_statistics_from_steps,
+    iterate_simulation_steps,
+    run_profiled_simulation,
+    run_series_simulation,
+    run_simulation,
+    run_traced_simulation,
     get_new_animals_from_breeding,
     advance,
+    apply_checks,
+    get_run_key,
     separate_alive_from_dead,
     breed_animals,
-    can_breed,
+)
+import cohort_engine
+import event_engine
+from parallel import run_in_pool
+from profiling import Profiler, add_shared_timing
+import benchmarks
+import service
+import sweep
+from checkpoint import (
+    Checkpoint,
+    Checkpointer,
+    get_checkpoint_path,
+    load_checkpoint,
+    save_checkpoint,
+)
+from climate import (
+    ClimateSchedule,
+    get_expected_deadly_months,
+    get_fluctuations,
+    get_mirrored_schedule,
+)
+from conf_parser import ConfigurationError, load_configuration
+from sampling import get_binomial, get_hypergeometric, get_rounded_share
+from replicates import (
+    MetricSummary,
+    ReplicateSummary,
+    get_climate_seed,
+    get_difference_summary,
+    get_replicate_seed,
+    write_replicate_report,
+)
+from reporting import (
+    FORMAT_CSV,
+    FORMAT_JSONL,
+    RUN_FIELDS,
+    SimulationStatistics,
+    get_death_field,
+    get_record_writer,
+    get_run_record,
+    write_simulation_report,
+)
+from result_cache import ResultCache, get_cache_key, run_cached
+from steady_state import SteadyStateDetector
+from tracing import (
+    CAUSE_ALIVE,
+    CAUSE_CODES,
+    TraceError,
+    TraceReader,
+    TraceWriter,
+    get_trace_path,
 )
 
+try:
+    import numpy
+    import batch_engine
+    import numpy_engine
+except ImportError:
+    numpy = None
+
 
 class GetNewAnimalsFromBreedingTest(TestCase):
     def test(self):
@@ -34,10 +122,49 @@ class GetNewAnimalsFromBreedingTest(TestCase):
         animal = animals[0]
         self.assertEqual(month, animal.birth_month)
 
+    def test_litter(self):
+        animals = get_new_animals_from_breeding(100, 3, Random(0))
+        self.assertEqual(100, len(animals))
+        genders = {animal.gender for animal in animals}
+        self.assertEqual({GENDER_MALE, GENDER_FEMALE}, genders)
+        self.assertTrue(all(animal.last_feed_month == 2 for animal in animals))
+
     # TODO: Test that animals are placed in the right list, depending on
     # generated gender
 
 
+class AnimalPoolTest(TestCase):
+    def test_recycle(self):
+        pool = AnimalPool()
+        animal = Animal()
+        animal.gender = GENDER_FEMALE
+        animal.birth_month = 10
+        animal.gestation_months = 3
+
+        pool.release([animal])
+        recycled = pool.acquire()
+
+        self.assertIs(animal, recycled)
+        self.assertIsNone(recycled.gender)
+        self.assertEqual(0, recycled.birth_month)
+        self.assertEqual(0, recycled.gestation_months)
+        self.assertIsNot(animal, pool.acquire())
+
+    def test_newborns_from_pool(self):
+        pool = AnimalPool()
+        dead = [Animal(), Animal()]
+        pool.release(dead)
+
+        animals = get_new_animals_from_breeding(3, 5, Random(0), pool)
+        self.assertEqual(3, len(animals))
+        self.assertEqual(2, sum(animal in dead for animal in animals))
+        self.assertTrue(all(animal.birth_month == 5 for animal in animals))
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            Animal().name = 'kangaroo'
+
+
 class CanBreedTest(TestCase):
     def test_too_young(self):
         animal = Animal()
@@ -62,6 +189,51 @@ class CanBreedTest(TestCase):
         self.assertTrue(can_breed(animal, species, simulation_step))
 
 
+class BirthOrderTest(TestCase):
+    def get_animals(self, birth_months):
+        animals = [Animal() for _ in birth_months]
+        for (animal, birth_month) in zip(animals, birth_months):
+            animal.birth_month = birth_month
+        return animals
+
+    def test_count_born_before(self):
+        animals = self.get_animals([0, 0, 2, 5, 5, 5])
+        for (month, expected) in ((0, 0), (1, 2), (2, 2), (5, 3), (6, 6)):
+            with self.subTest(month=month):
+                self.assertEqual(expected, count_born_before(animals, month))
+        self.assertEqual(0, count_born_before([], 3))
+
+    def test_age_check(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = 12
+        species = Species()
+        species.life_span = 1
+        animals = self.get_animals([0, 0, 1, 7])
+        check = AgeCheck(simulation_step, species)
+        (alive, dead) = check.separate(animals)
+        self.assertEqual(animals[:2], dead)
+        self.assertEqual(animals[2:], alive)
+        self.assertEqual(
+            [check.is_still_alive(animal) for animal in animals],
+            [animal in alive for animal in animals],
+        )
+
+    def test_breeding_animals(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = 12
+        species = Species()
+        species.minimum_breeding_age = 1
+        animals = self.get_animals([-3, 0, 0, 1, 12])
+        self.assertEqual(
+            [
+                animal
+                for animal in animals
+                if can_breed(animal, species, simulation_step)
+            ],
+            get_breeding_animals(animals, species, simulation_step),
+        )
+
+
 class BreedAnimalsTest(TestCase):
     def test_start_breeding(self):
         simulation_step = SimulationStep()
@@ -254,6 +426,86 @@ class AdvanceTest(TestCase):
         self.assertIn(DEATH_TOO_COLD, next_step.deaths)
 
 
+class ApplyChecksTest(TestCase):
+    def test_checks_in_turn(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = 4
+
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 1
+
+        old = Animal()
+        old.birth_month = -100
+        animals = [old, Animal(), Animal()]
+
+        checks = [
+            AgeCheck(simulation_step, species),
+            FoodCheck(simulation_step, habitat, species),
+        ]
+        (alive, dead_by_check) = apply_checks(animals, checks)
+
+        # The food check only sees the animals that survived the age check,
+        # so the only food goes to the next animal in line rather than to the
+        # old one.
+        self.assertEqual([animals[1]], alive)
+        self.assertEqual([[old], [animals[2]]], dead_by_check)
+        self.assertEqual(5, animals[1].last_feed_month)
+        self.assertEqual(-1, old.last_feed_month)
+
+    def test_allocation(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = 4
+
+        species = Species()
+        species.monthly_food_consumption = 2
+
+        habitat = Habitat()
+        habitat.monthly_food = 5
+
+        cases = (
+            (ALLOCATION_FIRST_COME, [0, 1]),
+            (ALLOCATION_OLDEST_FIRST, [0, 1]),
+            (ALLOCATION_YOUNGEST_FIRST, [2, 3]),
+        )
+        for (allocation, expected) in cases:
+            with self.subTest(allocation=allocation):
+                habitat.allocation = allocation
+                animals = [Animal() for birth_month in (0, 0, 1, 1)]
+                animals[2].birth_month = animals[3].birth_month = 1
+                check = FoodCheck(simulation_step, habitat, species)
+                check.update_all(animals)
+                self.assertEqual(
+                    expected,
+                    [
+                        index
+                        for (index, animal) in enumerate(animals)
+                        if animal.last_feed_month == 5
+                    ],
+                )
+                self.assertEqual(1, check.resource)
+
+        habitat.allocation = ALLOCATION_RANDOM
+        fed_indexes = set()
+        for seed in range(20):
+            animals = [Animal() for _ in range(4)]
+            FoodCheck(simulation_step, habitat, species).update_all(
+                animals,
+                Random(seed),
+            )
+            fed = [animal.last_feed_month == 5 for animal in animals]
+            self.assertEqual(2, sum(fed))
+            fed_indexes.update(
+                index
+                for (index, is_fed) in enumerate(fed)
+                if is_fed
+            )
+        self.assertEqual({0, 1, 2, 3}, fed_indexes)
+
+
 class SeparateAliveFromDeadTest(TestCase):
     def test_dead(self):
         animals = [Animal()]
@@ -287,3 +539,1665 @@ class SimulationStepTest(TestCase):
                         season,
                         simulation_step.get_current_season(),
                     )
+
+
+class SimulationStatisticsTest(TestCase):
+    def test_add_step(self):
+        statistics = SimulationStatistics()
+        statistics.add_step(2, {})
+        statistics.add_step(4, {DEATH_OLD_AGE: 1, DEATH_THIRST: 1})
+        statistics.add_step(1, {DEATH_THIRST: 3})
+
+        self.assertEqual(3, statistics.step_count)
+        self.assertAlmostEqual(7 / 3, statistics.average_population)
+        self.assertEqual(4, statistics.max_population)
+        self.assertEqual(5, statistics.total_deaths)
+        self.assertEqual(4, statistics.deaths_by_type[DEATH_THIRST])
+        self.assertAlmostEqual(5 / 6, statistics.mortality_rate)
+
+    def test_report_matches_steps(self):
+        first_step = SimulationStep()
+        first_step.animals = [Animal(), Animal()]
+
+        second_step = SimulationStep()
+        second_step.animals = [Animal()]
+        second_step.deaths = {DEATH_STARVATION: [Animal()]}
+
+        steps_output = StringIO()
+        generate_simulation_report([first_step, second_step], steps_output)
+
+        statistics_output = StringIO()
+        write_simulation_report(
+            get_statistics_from_steps([first_step, second_step]),
+            statistics_output,
+        )
+
+        self.assertEqual(steps_output.getvalue(), statistics_output.getvalue())
+        self.assertIn('Max Population: 2', steps_output.getvalue())
+
+    def test_streamed_steps(self):
+        species = Species()
+        species.life_span = 1
+        species.monthly_water_consumption = 1
+
+        simulation_steps = iterate_simulation_steps(species, Habitat(), 1)
+        statistics = get_statistics_from_steps(simulation_steps)
+
+        # Nothing to drink, so both founders die in the first month.
+        self.assertEqual(2, statistics.step_count)
+        self.assertEqual(0, statistics.final_population)
+        self.assertEqual(2, statistics.total_deaths)
+        self.assertEqual(1, statistics.mortality_rate)
+
+    def test_record_writers(self):
+        statistics = SimulationStatistics()
+        statistics.add_step(2, {})
+        statistics.add_step(1, {DEATH_THIRST: 1})
+        record = get_run_record(
+            statistics,
+            species='kangaroo',
+            habitat='plains',
+            replicate=0,
+            seed=None,
+        )
+        self.assertEqual(1, record['months'])
+        self.assertEqual(1, record['deaths_thirst'])
+
+        output_stream = StringIO()
+        get_record_writer(FORMAT_JSONL, output_stream, RUN_FIELDS).write(
+            record,
+        )
+        self.assertEqual(record, json.loads(output_stream.getvalue()))
+
+        output_stream = StringIO()
+        writer = get_record_writer(FORMAT_CSV, output_stream, RUN_FIELDS)
+        writer.write(record)
+        writer.write(record)
+        lines = output_stream.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(','.join(RUN_FIELDS), lines[0])
+        self.assertTrue(lines[1].startswith('kangaroo,plains,0,,1,1.5,'))
+
+    def test_series_matches_statistics(self):
+        species = Species()
+        species.life_span = 2
+        species.monthly_water_consumption = 1
+        habitat = Habitat()
+        habitat.monthly_water = 1
+        for engine in ('object', 'cohort'):
+            with self.subTest(engine=engine):
+                (statistics, series) = run_series_simulation(
+                    engine,
+                    species,
+                    habitat,
+                    3,
+                    1,
+                )
+                self.assertEqual(
+                    run_simulation(engine, species, habitat, 3, 1)
+                    .deaths_by_type,
+                    statistics.deaths_by_type,
+                )
+                records = list(series.get_records(replicate=0))
+                self.assertEqual(statistics.step_count - 1, len(records))
+                self.assertEqual((1, 0), (
+                    records[0]['month'],
+                    records[0]['replicate'],
+                ))
+                self.assertEqual(
+                    statistics.deaths_by_type[DEATH_THIRST],
+                    sum(record['deaths_thirst'] for record in records),
+                )
+                self.assertEqual(
+                    statistics.final_population,
+                    records[-1]['population'],
+                )
+
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class NumpyEngineTest(TestCase):
+    def test_feed(self):
+        population = numpy_engine.PopulationArrays(2)
+        population.birth_month[:] = 4
+
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 1
+
+        (next_population, deaths) = numpy_engine.advance_population(
+            population,
+            4,
+            species,
+            habitat,
+            numpy.random.default_rng(0),
+        )
+        # Animals are fed in order, so the second one starves.
+        self.assertEqual(1, len(next_population))
+        self.assertEqual(5, next_population.last_feed_month[0])
+        self.assertEqual({DEATH_STARVATION: 1}, deaths)
+
+    def test_allocation_order(self):
+        population = numpy_engine.PopulationArrays(4)
+        population.birth_month[:] = (0, 0, 1, 1)
+        candidates = numpy.array([0, 1, 3])
+        rng = numpy.random.default_rng(0)
+        for (allocation, expected) in (
+            (ALLOCATION_FIRST_COME, [0, 1, 3]),
+            (ALLOCATION_YOUNGEST_FIRST, [3, 0, 1]),
+        ):
+            with self.subTest(allocation=allocation):
+                self.assertEqual(
+                    expected,
+                    list(numpy_engine.get_allocation_order(
+                        population,
+                        candidates,
+                        allocation,
+                        rng,
+                    )),
+                )
+        order = numpy_engine.get_allocation_order(
+            population,
+            candidates,
+            ALLOCATION_RANDOM,
+            rng,
+        )
+        self.assertEqual([0, 1, 3], sorted(order))
+
+    def test_old_age(self):
+        population = numpy_engine.PopulationArrays.from_animals([Animal()])
+
+        species = Species()
+        species.life_span = 1
+
+        (next_population, deaths) = numpy_engine.advance_population(
+            population,
+            13,
+            species,
+            Habitat(),
+            numpy.random.default_rng(0),
+        )
+        self.assertEqual(0, len(next_population))
+        self.assertEqual({DEATH_OLD_AGE: 1}, deaths)
+
+    def test_breeding(self):
+        animal = Animal()
+        animal.gender = GENDER_FEMALE
+        animal.gestation_months = 1
+        population = numpy_engine.PopulationArrays.from_animals([animal])
+
+        species = Species()
+        species.life_span = 100
+        species.gestation_months = 1
+        species.minimum_temperature = -1000
+        species.maximum_temperature = 1000
+
+        habitat = Habitat()
+        habitat.monthly_food = 10
+        habitat.monthly_water = 10
+
+        (next_population, deaths) = numpy_engine.advance_population(
+            population,
+            0,
+            species,
+            habitat,
+            numpy.random.default_rng(0),
+        )
+        self.assertEqual({}, deaths)
+        self.assertEqual(2, len(next_population))
+        self.assertEqual(0, next_population.gestation_months[0])
+        self.assertEqual(1, next_population.birth_month[1])
+        self.assertEqual(0, next_population.last_feed_month[1])
+
+
+class CohortCheckTest(TestCase):
+    def test_resource_split(self):
+        habitat = Habitat()
+        habitat.monthly_food = 5
+
+        species = Species()
+        species.monthly_food_consumption = 2
+
+        cohort = cohort_engine.get_newborn_cohort(GENDER_MALE, 0)
+        check = FoodCheck(SimulationStep(), habitat, species)
+
+        pieces = check.update_cohort(cohort, 3)
+        self.assertEqual(
+            [(cohort._replace(last_feed_month=1), 2), (cohort, 1)],
+            pieces,
+        )
+        self.assertEqual(1, check.resource)
+
+    def test_counter(self):
+        species = Species()
+        species.maximum_temperature = 0
+
+        cohort = cohort_engine.get_newborn_cohort(GENDER_MALE, 0)
+        check = HeatCheck(10, species)
+
+        ((hot_cohort, count),) = check.update_cohort(cohort, 4)
+        self.assertEqual(1, hot_cohort.consecutive_hot_months)
+        self.assertEqual(4, count)
+
+
+class CohortEngineTest(TestCase):
+    def test_feed(self):
+        cohort = cohort_engine.get_newborn_cohort(GENDER_MALE, 0)
+
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 1
+
+        (cohorts, deaths) = cohort_engine.advance_cohorts(
+            {cohort: 2},
+            4,
+            species,
+            habitat,
+        )
+        self.assertEqual({DEATH_STARVATION: 1}, deaths)
+        ((survivor, count),) = cohorts.items()
+        self.assertEqual(1, count)
+        self.assertEqual(5, survivor.last_feed_month)
+
+    def test_founders(self):
+        # As in the per-animal engine, the male founder is fed first.
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 1
+
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                (cohorts, deaths) = cohort_engine.advance_cohorts(
+                    cohort_engine.get_initial_cohorts(),
+                    4,
+                    species,
+                    habitat,
+                    Random(seed),
+                )
+                self.assertEqual({DEATH_STARVATION: 1}, deaths)
+                ((survivor, _),) = cohorts.items()
+                self.assertEqual(GENDER_MALE, survivor.gender)
+
+    def test_allocation(self):
+        old = cohort_engine.get_newborn_cohort(GENDER_MALE, 0)
+        young = cohort_engine.get_newborn_cohort(GENDER_MALE, 3)._replace(
+            last_feed_month=-1,
+        )
+
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 2
+
+        for (allocation, survivor) in (
+            (ALLOCATION_FIRST_COME, old),
+            (ALLOCATION_YOUNGEST_FIRST, young),
+        ):
+            with self.subTest(allocation=allocation):
+                habitat.allocation = allocation
+                (cohorts, deaths) = cohort_engine.advance_cohorts(
+                    {old: 2, young: 2},
+                    4,
+                    species,
+                    habitat,
+                )
+                self.assertEqual({DEATH_STARVATION: 2}, deaths)
+                ((cohort, count),) = cohorts.items()
+                self.assertEqual((survivor.birth_month, 2), (
+                    cohort.birth_month,
+                    count,
+                ))
+
+        habitat.allocation = ALLOCATION_RANDOM
+        groups = cohort_engine.get_position_groups(
+            {old: 2, young: 2},
+            ALLOCATION_RANDOM,
+        )
+        self.assertEqual(1, len(groups))
+        (cohorts, deaths) = cohort_engine.advance_cohorts(
+            {old: 200, young: 200},
+            4,
+            species,
+            habitat,
+            Random(0),
+        )
+        self.assertEqual({DEATH_STARVATION: 398}, deaths)
+
+    def test_breeding(self):
+        female = cohort_engine.get_newborn_cohort(GENDER_FEMALE, 0)._replace(
+            gestation_months=1,
+        )
+
+        species = Species()
+        species.life_span = 100
+        species.gestation_months = 1
+        species.minimum_temperature = -1000
+        species.maximum_temperature = 1000
+
+        habitat = Habitat()
+        habitat.monthly_food = 100
+        habitat.monthly_water = 100
+
+        (cohorts, deaths) = cohort_engine.advance_cohorts(
+            {female: 3},
+            0,
+            species,
+            habitat,
+        )
+        self.assertEqual({}, deaths)
+        newborns = sum(
+            count
+            for (cohort, count) in cohorts.items()
+            if cohort.birth_month == 1
+        )
+        self.assertEqual(3, newborns)
+        self.assertEqual(6, sum(cohorts.values()))
+
+    def test_merge_cohorts(self):
+        cohorts = {
+            cohort_engine.get_newborn_cohort(gender, month): month + 1
+            for gender in (GENDER_MALE, GENDER_FEMALE)
+            for month in range(10)
+        }
+        merged = cohort_engine.merge_cohorts(cohorts, 7, Random(0))
+        self.assertEqual(7, len(merged))
+        self.assertEqual(sum(cohorts.values()), sum(merged.values()))
+        self.assertEqual(set(), set(merged) - set(cohorts))
+        for gender in (GENDER_MALE, GENDER_FEMALE):
+            with self.subTest(gender=gender):
+                self.assertIn(gender, {cohort.gender for cohort in merged})
+
+    def test_agent_budget(self):
+        species = Species()
+        species.life_span = 5
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.maximum_temperature = 1000
+        species.minimum_temperature = -1000
+        species.gestation_months = 1
+
+        habitat = Habitat()
+        habitat.monthly_food = 10 ** 5
+        habitat.monthly_water = 10 ** 5
+
+        statistics = cohort_engine.get_simulation_statistics(
+            species,
+            habitat,
+            10,
+            Random(0),
+            agent_budget=10,
+        )
+        self.assertEqual(121, statistics.step_count)
+        self.assertGreater(statistics.max_population, 10 ** 4)
+
+
+
+class EventEngineTest(TestCase):
+    def get_species(self):
+        species = Species()
+        species.life_span = 3
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 40
+        species.maximum_temperature = 90
+        species.gestation_months = 2
+        species.minimum_breeding_age = 1
+        return species
+
+    def test_litter_months(self):
+        species = self.get_species()
+        female = Animal()
+        female.gender = GENDER_FEMALE
+        female.birth_month = 5
+        litter_months = []
+        for month in range(5, 60):
+            simulation_step = SimulationStep()
+            simulation_step.month = month
+            if breed_animals([female], species, simulation_step):
+                litter_months.append(month)
+
+        self.assertEqual(
+            litter_months[0],
+            event_engine.get_first_litter_month(5, species),
+        )
+        self.assertEqual(
+            litter_months,
+            sorted({
+                event_engine.get_next_litter_month(5, month, species)
+                for month in range(5, 57)
+            }),
+        )
+
+    def test_matches_object_engine(self):
+        species = self.get_species()
+        habitat = Habitat()
+        habitat.average_temperatures[SEASON_SPRING] = 60
+        habitat.average_temperatures[SEASON_SUMMER] = 85
+        habitat.average_temperatures[SEASON_FALL] = 60
+        habitat.average_temperatures[SEASON_WINTER] = 45
+        for (food, allocation) in (
+            (1000, ALLOCATION_FIRST_COME),
+            (40, ALLOCATION_FIRST_COME),
+            (40, ALLOCATION_YOUNGEST_FIRST),
+        ):
+            habitat.monthly_food = food
+            habitat.monthly_water = 1000
+            habitat.allocation = allocation
+            for seed in range(3):
+                with self.subTest(food=food, allocation=allocation, seed=seed):
+                    self.assertEqual(
+                        vars(run_simulation(
+                            'object',
+                            species,
+                            habitat,
+                            10,
+                            seed,
+                        )),
+                        vars(run_simulation(
+                            'event',
+                            species,
+                            habitat,
+                            10,
+                            seed,
+                        )),
+                    )
+
+    def test_skips_quiet_months(self):
+        species = self.get_species()
+        species.life_span = 50
+        species.gestation_months = 12
+        species.minimum_breeding_age = 10
+        habitat = Habitat()
+        habitat.monthly_food = 1000
+        habitat.monthly_water = 1000
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 65
+
+        profiler = Profiler()
+        statistics = event_engine.get_simulation_statistics(
+            species,
+            habitat,
+            30,
+            Random(1),
+            profiler,
+        )
+        self.assertEqual(
+            vars(run_simulation('object', species, habitat, 30, 1)),
+            vars(statistics),
+        )
+        # Only the months in which litters are due are simulated.
+        self.assertLess(len(profiler.steps), 30)
+
+    def test_resource_limited(self):
+        # Food runs short almost every month once the population has grown,
+        # and the litters of the females that starve must be dropped.
+        species = self.get_species()
+        species.life_span = 10
+        habitat = Habitat()
+        habitat.monthly_food = 200
+        habitat.monthly_water = 1000
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 65
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    vars(run_simulation('object', species, habitat, 40, seed)),
+                    vars(run_simulation('event', species, habitat, 40, seed)),
+                )
+
+    def test_steady_state_in_quiet_months(self):
+        species = self.get_species()
+        species.life_span = 4
+        species.gestation_months = 11
+        habitat = Habitat()
+        habitat.monthly_food = 30
+        habitat.monthly_water = 1000
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 65
+        results = [
+            vars(run_simulation(
+                engine,
+                species,
+                habitat,
+                100,
+                1,
+                steady_state=SteadyStateDetector(1, 0.5),
+            ))
+            for engine in ('object', 'event')
+        ]
+        self.assertGreater(results[0]['extrapolated_months'], 0)
+        self.assertEqual(results[0], results[1])
+
+
+class RunInPoolTest(TestCase):
+    def test_order(self):
+        arguments = [(base, 2) for base in range(10)]
+        for jobs in (1, 3):
+            with self.subTest(jobs=jobs):
+                results = list(run_in_pool(pow, arguments, jobs))
+                self.assertEqual([base ** 2 for base in range(10)], results)
+
+
+class ReplicatesTest(TestCase):
+    def get_species(self):
+        species = Species()
+        species.life_span = 2
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 40
+        species.maximum_temperature = 100
+        species.gestation_months = 1
+        return species
+
+    def get_habitat(self):
+        habitat = Habitat()
+        habitat.monthly_food = 20
+        habitat.monthly_water = 20
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 50
+        return habitat
+
+    def test_replicate_seed(self):
+        self.assertIsNone(get_replicate_seed(None, 0))
+        self.assertEqual(get_replicate_seed(1, 0), get_replicate_seed(1, 0))
+        self.assertNotEqual(get_replicate_seed(1, 0), get_replicate_seed(1, 1))
+        self.assertNotEqual(get_replicate_seed(1, 0), get_replicate_seed(2, 0))
+
+    def test_reproducible(self):
+        def run(seed):
+            statistics = run_simulation(
+                'object',
+                self.get_species(),
+                self.get_habitat(),
+                3,
+                seed,
+            )
+            return (statistics.total_population, statistics.deaths_by_type)
+
+        self.assertEqual(run(7), run(7))
+
+    def test_summary(self):
+        statistics_list = []
+        for population in (10, 20, 30):
+            statistics = SimulationStatistics()
+            statistics.add_step(population, {DEATH_OLD_AGE: 1})
+            statistics_list.append(statistics)
+
+        summary = ReplicateSummary(statistics_list)
+        self.assertEqual(3, summary.replicate_count)
+        self.assertEqual(20, summary.average_population.mean)
+        self.assertAlmostEqual(11.32, summary.average_population.margin, 2)
+        self.assertEqual(100, summary.death_percentages[DEATH_OLD_AGE].mean)
+        self.assertEqual(0, summary.death_percentages[DEATH_OLD_AGE].margin)
+
+        output = StringIO()
+        write_replicate_report(statistics_list, output)
+        self.assertIn('Average Population: 20.00 ± 11.32', output.getvalue())
+        self.assertNotIn('Effective Sample Size', output.getvalue())
+
+    def test_antithetic_summary(self):
+        summary = MetricSummary([1, 3, 2, 2, 0, 4], 0.95, antithetic=True)
+        self.assertEqual(2, summary.mean)
+        self.assertEqual(0, summary.margin)
+        self.assertEqual(float('inf'), summary.effective_sample_size)
+
+        plain = MetricSummary([1, 3, 2, 2, 0, 4], 0.95)
+        self.assertEqual(6, plain.effective_sample_size)
+
+    def test_control_summary(self):
+        controls = [1, 2, 3, 4, 5, 6]
+        values = [
+            2 * control + noise
+            for (control, noise) in zip(controls, (1, -1, 1, -1, 1, -1))
+        ]
+        summary = MetricSummary(
+            values,
+            0.95,
+            controls=controls,
+            control_mean=3,
+        )
+        # The runs saw more of the control than expected, and are corrected
+        # for it.
+        self.assertLess(summary.mean, mean(values))
+        self.assertAlmostEqual(6, summary.mean, 0)
+        self.assertGreater(summary.effective_sample_size, 6)
+
+    def test_difference_summary(self):
+        summary = get_difference_summary([2, 6, 4], [1, 5, 3], 0.95)
+        self.assertEqual(1, summary.mean)
+        self.assertEqual(0, summary.margin)
+
+        statistics_lists = []
+        for populations in ((10, 20, 30, 40), (12, 21, 33, 41)):
+            statistics_list = []
+            for population in populations:
+                statistics = SimulationStatistics()
+                statistics.add_step(population, {DEATH_OLD_AGE: 1})
+                statistics_list.append(statistics)
+            statistics_lists.append(statistics_list)
+        output = StringIO()
+        write_replicate_report(
+            statistics_lists[1],
+            output,
+            antithetic=True,
+            baseline=('kangaroo', statistics_lists[0]),
+        )
+        self.assertIn('Effective Sample Size', output.getvalue())
+        self.assertIn(
+            'Average Population vs kangaroo: +1.75 ±',
+            output.getvalue(),
+        )
+
+
+class VarianceReductionClimateTest(TestCase):
+    def get_habitat(self):
+        habitat = Habitat()
+        habitat.name = 'plains'
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 50
+        return habitat
+
+    def test_mirrored_schedule(self):
+        habitat = self.get_habitat()
+        climate = ClimateSchedule(habitat, [1.5, -20.0, 3.0])
+        mirrored = get_mirrored_schedule(habitat, climate)
+        self.assertTrue(mirrored.mirrored)
+        self.assertEqual([-1.5, 20.0, -3.0], mirrored.fluctuations)
+        self.assertEqual([48.5, 70.0, 47.0], mirrored.temperatures)
+        self.assertFalse(
+            get_mirrored_schedule(habitat, mirrored).mirrored,
+        )
+
+        species = Species()
+        self.assertNotEqual(
+            get_run_key('object', species, habitat, 1, 7, climate=climate),
+            get_run_key('object', species, habitat, 1, 7, climate=mirrored),
+        )
+
+    def test_deadly_months(self):
+        habitat = self.get_habitat()
+        species = Species()
+        species.minimum_temperature = 45
+        species.maximum_temperature = 55
+        climate = ClimateSchedule(habitat, [6, 7, 0, -6, -7, -8, 6])
+        self.assertEqual(3, climate.count_deadly_months(species))
+
+        # Half of the months are too hot and half too cold, so each month
+        # after the first can kill with a chance of a half.
+        species.minimum_temperature = 50
+        species.maximum_temperature = 50
+        self.assertAlmostEqual(
+            5.5,
+            get_expected_deadly_months(habitat, species, 12),
+        )
+
+
+class SamplingTest(TestCase):
+    def test_binomial(self):
+        self.assertEqual(0, get_binomial(0, 0.5))
+        self.assertEqual(10, get_binomial(10, 1))
+        self.assertLessEqual(get_binomial(10, 0.5), 10)
+
+    def test_hypergeometric(self):
+        self.assertEqual(3, get_hypergeometric(10, 3, 10))
+        self.assertEqual(0, get_hypergeometric(10, 0, 5))
+        for draws in range(11):
+            with self.subTest(draws=draws):
+                successes = get_hypergeometric(10, 4, draws)
+                self.assertLessEqual(successes, min(4, draws))
+                self.assertGreaterEqual(successes, max(0, draws - 6))
+
+    def test_rounded_share(self):
+        self.assertEqual(5, get_rounded_share(10, 0.5))
+        self.assertIn(get_rounded_share(3, 0.5), (1, 2))
+        rng = Random(0)
+        shares = [get_rounded_share(3, 0.5, rng) for trial in range(1000)]
+        self.assertAlmostEqual(1.5, sum(shares) / len(shares), delta=0.1)
+
+    @skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_fluctuations(self):
+        fluctuations = get_fluctuations(1000, numpy.random.default_rng(0))
+        self.assertEqual(1000, len(fluctuations))
+        self.assertLessEqual(max(abs(fluctuations)), 15)
+
+
+class BenchmarksTest(TestCase):
+    def test_run(self):
+        names = ['advance', 'FoodCheck', 'FoodCheck:random']
+        results = benchmarks.run_benchmarks(names, [10], 1, 0)
+        self.assertEqual(benchmarks.FORMAT_VERSION, results['version'])
+        self.assertEqual(
+            [('advance', 10), ('FoodCheck', 10), ('FoodCheck:random', 10)],
+            [
+                (result['name'], result['size'])
+                for result in results['results']
+            ],
+        )
+
+    def test_find_regressions(self):
+        def get_results(timing):
+            return {
+                'results': [
+                    {'name': 'advance', 'size': 100, 'min': timing},
+                    {'name': 'AgeCheck', 'size': 100, 'min': 1.0},
+                ],
+            }
+
+        regressions = benchmarks.find_regressions(
+            get_results(1.0),
+            get_results(1.5),
+            0.1,
+        )
+        self.assertEqual([('advance', 100, 1.5)], regressions)
+        self.assertEqual(
+            [],
+            benchmarks.find_regressions(get_results(1.0), get_results(1.05)),
+        )
+
+
+class ProfilerTest(TestCase):
+    def test_wrap_check(self):
+        profiler = Profiler()
+        species = Species()
+        species.life_span = 1
+        check = profiler.wrap_check(AgeCheck(SimulationStep(), species))
+
+        for animal in [Animal(), Animal()]:
+            check.update(animal)
+            self.assertTrue(check.is_still_alive(animal))
+
+        self.assertEqual('Age', check.name)
+        self.assertEqual(DEATH_OLD_AGE, check.death_type)
+        self.assertEqual(2, profiler.timings['AgeCheck'].calls)
+
+    def test_summary(self):
+        profiler = Profiler()
+        profiler.record_step(1, 10, 0.5)
+        profiler.record_step(2, 30, 1.5)
+
+        summary = profiler.get_summary()
+        self.assertEqual(2, summary['months'])
+        self.assertEqual(40, summary['animal_months'])
+        self.assertEqual(20, summary['animals_per_second'])
+        self.assertEqual(2, summary['timings']['advance']['calls'])
+
+    def test_shared_timing(self):
+        summaries = [Profiler().get_summary() for replicate in range(4)]
+        add_shared_timing(summaries, 'reporting', 2.0)
+        for summary in summaries:
+            self.assertEqual(
+                {'calls': 1, 'seconds': 0.5, 'shared_by': 4},
+                summary['timings']['reporting'],
+            )
+
+    def test_run_profiled_simulation(self):
+        species = Species()
+        species.name = 'kangaroo'
+        species.life_span = 1
+        species.monthly_water_consumption = 1
+
+        habitat = Habitat()
+        habitat.name = 'desert'
+
+        (statistics, summary) = run_profiled_simulation(
+            'object',
+            species,
+            habitat,
+            1,
+            0,
+        )
+        self.assertEqual(0, statistics.final_population)
+        self.assertEqual('kangaroo', summary['species'])
+        self.assertEqual([1], [step['month'] for step in summary['steps']])
+        self.assertEqual(2, summary['timings']['DrinkCheck']['calls'])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptingCheckpointer(Checkpointer):
+    """
+    Stops the run right after its first checkpoint, as if it was killed.
+    """
+
+    def save(self, checkpoint):
+        super().save(checkpoint)
+        raise Interrupted()
+
+
+class CheckpointTest(TestCase):
+    def get_species(self):
+        species = Species()
+        species.life_span = 3
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 40
+        species.maximum_temperature = 100
+        species.gestation_months = 1
+        return species
+
+    def get_habitat(self):
+        habitat = Habitat()
+        habitat.monthly_food = 30
+        habitat.monthly_water = 30
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 70
+        return habitat
+
+    def test_paths(self):
+        habitat = self.get_habitat()
+        paths = set()
+        for name in ('red fox', 'red_fox', 'red/fox'):
+            species = self.get_species()
+            species.name = name
+            paths.add(get_checkpoint_path('checkpoints', species, habitat, 0))
+        self.assertEqual(3, len(paths))
+        for path in paths:
+            self.assertEqual('checkpoints', os.path.dirname(path))
+
+    def test_round_trip(self):
+        simulation_step = SimulationStep()
+        simulation_step.month = 7
+        animal = Animal()
+        animal.gender = GENDER_FEMALE
+        animal.birth_month = 3
+        animal.gestation_months = 2
+        simulation_step.animals = [animal, Animal()]
+
+        checkpoint = Checkpoint.from_simulation_step(
+            simulation_step,
+            SimulationStatistics(),
+            Random(0),
+            [1.5, -2.5],
+        )
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.checkpoint')
+            save_checkpoint(path, checkpoint)
+            self.assertEqual(['run.checkpoint'], os.listdir(directory))
+            loaded = load_checkpoint(path)
+
+        restored = loaded.get_simulation_step()
+        self.assertEqual(7, restored.month)
+        self.assertEqual(
+            [GENDER_FEMALE, None],
+            [animal.gender for animal in restored.animals],
+        )
+        self.assertEqual(2, restored.animals[0].gestation_months)
+        self.assertEqual([1.5, -2.5], list(loaded.fluctuations))
+
+    def test_resume(self):
+        def run(checkpointer=None):
+            statistics = run_simulation(
+                'object',
+                self.get_species(),
+                self.get_habitat(),
+                3,
+                5,
+                checkpointer,
+            )
+            return (statistics.total_population, statistics.deaths_by_type)
+
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.checkpoint')
+            with self.assertRaises(Interrupted):
+                run(InterruptingCheckpointer(path, 'inputs', 12))
+            self.assertEqual(12, load_checkpoint(path).month)
+
+            resumed = run(Checkpointer(path, 'inputs', 12, resume=True))
+            self.assertTrue(load_checkpoint(path).finished)
+
+            # A finished run is read back from its checkpoint.
+            finished = run(Checkpointer(path, 'inputs', 12, resume=True))
+
+        self.assertEqual(run(), resumed)
+        self.assertEqual(resumed, finished)
+
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class TraceTest(TestCase):
+    def test_paths(self):
+        paths = set()
+        for (species_name, habitat_name) in (('a-b', 'c'), ('a', 'b-c')):
+            species = Species()
+            species.name = species_name
+            habitat = Habitat()
+            habitat.name = habitat_name
+            paths.add(get_trace_path('traces', species, habitat, 0))
+        self.assertEqual(2, len(paths))
+
+    def test_round_trip(self):
+        with TemporaryDirectory() as directory:
+            # A tiny buffer makes every table go through several writes.
+            with TraceWriter(directory, buffer_rows=2) as trace:
+                for month in range(1, 6):
+                    trace.record_step(
+                        month,
+                        month * 10,
+                        month + 0.5,
+                        month,
+                        {DEATH_THIRST: 3},
+                        {DEATH_THIRST: [month - 1, 0, 0]},
+                    )
+                trace.record_survivors({4: 2, 5: 0})
+
+            reader = TraceReader(directory)
+            self.assertEqual(5, reader.get_row_count('months'))
+            months = reader.get_table('months')
+            self.assertEqual([1, 2, 3, 4, 5], months['month'].tolist())
+            self.assertEqual([30, 40], months['population'][2:4].tolist())
+            self.assertEqual(5.5, months['temperature'][-1])
+            self.assertEqual([3] * 5, months['deaths_thirst'].tolist())
+            self.assertEqual(
+                [2, 3],
+                reader.get_column('months', 'births', 1, 3).tolist(),
+            )
+            self.assertEqual(
+                0,
+                len(reader.get_column('months', 'births', 5)),
+            )
+
+            lives = reader.get_table('lives')
+            rows = list(zip(*(
+                lives[column].tolist()
+                for column in ('birth_month', 'death_month', 'cause', 'count')
+            )))
+            thirst = CAUSE_CODES[DEATH_THIRST]
+            self.assertEqual((0, 1, thirst, 3), rows[0])
+            self.assertEqual((1, 2, thirst, 1), rows[1])
+            self.assertEqual((4, 5, CAUSE_ALIVE, 2), rows[-1])
+            self.assertEqual(10, len(rows))
+
+    def test_not_a_trace(self):
+        with TemporaryDirectory() as directory:
+            with self.assertRaises(TraceError):
+                TraceReader(directory)
+
+    def test_trace_matches_statistics(self):
+        species = Species()
+        species.life_span = 2
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 40
+        species.maximum_temperature = 100
+        species.gestation_months = 1
+        habitat = Habitat()
+        habitat.monthly_food = 20
+        habitat.monthly_water = 30
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 70
+        for engine in ('object', 'numpy', 'cohort', 'event'):
+            with self.subTest(engine=engine), \
+                    TemporaryDirectory() as directory:
+                statistics = run_traced_simulation(
+                    engine,
+                    species,
+                    habitat,
+                    5,
+                    1,
+                    trace_path=directory,
+                )
+                self.assertEqual(
+                    vars(run_simulation(engine, species, habitat, 5, 1)),
+                    vars(statistics),
+                )
+
+                reader = TraceReader(directory)
+                months = reader.get_table('months')
+                lives = reader.get_table('lives')
+                self.assertEqual(
+                    statistics.step_count - 1,
+                    len(months['month']),
+                )
+                self.assertEqual(
+                    statistics.final_population,
+                    months['population'][-1],
+                )
+                for (death_type, count) in (
+                    statistics.deaths_by_type.items()
+                ):
+                    self.assertEqual(
+                        count,
+                        months[get_death_field(death_type)].sum(),
+                    )
+                    cause = lives['cause'] == CAUSE_CODES[death_type]
+                    self.assertEqual(count, lives['count'][cause].sum())
+                alive = lives['cause'] == CAUSE_ALIVE
+                self.assertEqual(
+                    statistics.final_population,
+                    lives['count'][alive].sum(),
+                )
+                # Every animal, founders included, has one life history.
+                self.assertEqual(
+                    months['births'].sum() + 2,
+                    lives['count'].sum(),
+                )
+                self.assertTrue(numpy.all(
+                    lives['birth_month'] <= lives['death_month'],
+                ))
+
+
+class ResultCacheTest(TestCase):
+    def test_get_and_put(self):
+        with TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            self.assertIsNone(cache.get('key'))
+            cache.put('key', [1, 2])
+            self.assertEqual([1, 2], cache.get('key'))
+            cache.clear()
+            self.assertIsNone(cache.get('key'))
+
+    def test_evicts_least_recently_used(self):
+        with TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            for (mtime, key) in enumerate(('a', 'b', 'c')):
+                cache.put(key, key * 100)
+                os.utime(cache.get_path(key), (mtime, mtime))
+            size = os.path.getsize(cache.get_path('a'))
+            cache.get('a')
+
+            cache.max_bytes = 2 * size
+            cache.evict()
+            self.assertEqual('a' * 100, cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual('c' * 100, cache.get('c'))
+
+    def test_cache_key(self):
+        self.assertEqual(
+            get_cache_key({'seed': 1, 'years': 2}),
+            get_cache_key({'years': 2, 'seed': 1}),
+        )
+        self.assertNotEqual(
+            get_cache_key({'seed': 1, 'years': 2}),
+            get_cache_key({'seed': 2, 'years': 2}),
+        )
+
+    def test_run_key(self):
+        species = Species()
+        habitat = Habitat()
+        self.assertIsNone(get_run_key('object', species, habitat, 1, None))
+        self.assertEqual(
+            get_run_key('object', species, habitat, 1, 5),
+            get_run_key('object', species, habitat, 1, 5),
+        )
+        self.assertNotEqual(
+            get_run_key('object', species, habitat, 1, 5),
+            get_run_key('cohort', species, habitat, 1, 5),
+        )
+
+    def test_run_cached(self):
+        arguments = [(2, 1), (2, 2), (2, 1), (2, 3)]
+        keys = ['a', 'b', 'a', None]
+        with TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            cache.put('b', 'cached')
+            results = list(run_cached(pow, arguments, keys, 1, cache))
+            self.assertEqual(2, cache.get('a'))
+
+        self.assertEqual([2, 'cached', 2, 8], results)
+
+
+class SteadyStateDetectorTest(TestCase):
+    def observe_months(self, detector, statistics, months, deaths):
+        steady_months = []
+        for month in range(months):
+            statistics.add_step(10 + month % 12, {DEATH_STARVATION: deaths})
+            if detector.observe(statistics):
+                steady_months.append(statistics.step_count)
+        return steady_months
+
+    def test_steady(self):
+        detector = SteadyStateDetector(window_years=1, tolerance=0.01)
+        statistics = SimulationStatistics()
+        self.assertEqual([24, 36], self.observe_months(
+            detector,
+            statistics,
+            36,
+            deaths=1,
+        ))
+
+        detector.project(statistics, 18)
+        self.assertEqual(54, statistics.step_count)
+        self.assertEqual(18, statistics.extrapolated_months)
+        self.assertEqual(54, statistics.deaths_by_type[DEATH_STARVATION])
+        self.assertEqual(15, statistics.final_population)
+
+    def test_needs_deaths(self):
+        detector = SteadyStateDetector(window_years=1)
+        self.assertEqual([], self.observe_months(
+            detector,
+            SimulationStatistics(),
+            36,
+            deaths=0,
+        ))
+
+    def test_warmup(self):
+        detector = SteadyStateDetector(window_years=1, warmup_months=30)
+        self.assertEqual([36], self.observe_months(
+            detector,
+            SimulationStatistics(),
+            36,
+            deaths=1,
+        ))
+
+    def test_engines(self):
+        species = Species()
+        species.life_span = 1
+        species.monthly_food_consumption = 1
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 0
+        species.maximum_temperature = 200
+        species.gestation_months = 1
+        habitat = Habitat()
+        habitat.monthly_food = 20
+        habitat.monthly_water = 20
+        for season in habitat.average_temperatures:
+            habitat.average_temperatures[season] = 70
+
+        for engine in ('object', 'cohort'):
+            with self.subTest(engine=engine):
+                statistics = run_simulation(
+                    engine,
+                    species,
+                    habitat,
+                    50,
+                    1,
+                    steady_state=SteadyStateDetector(window_years=2),
+                )
+                self.assertEqual(601, statistics.step_count)
+                self.assertGreater(statistics.extrapolated_months, 0)
+                output_stream = StringIO()
+                write_simulation_report(statistics, output_stream)
+                self.assertIn(
+                    'Extrapolated Months: {count:d}'.format(
+                        count=statistics.extrapolated_months,
+                    ),
+                    output_stream.getvalue(),
+                )
+
+
+class ClimateScheduleTest(TestCase):
+    def get_habitat(self):
+        habitat = Habitat()
+        habitat.average_temperatures[SEASON_SPRING] = 50
+        habitat.average_temperatures[SEASON_SUMMER] = 90
+        habitat.average_temperatures[SEASON_FALL] = 50
+        habitat.average_temperatures[SEASON_WINTER] = 10
+        return habitat
+
+    def test_temperatures(self):
+        climate = ClimateSchedule(self.get_habitat(), [1.0] * 24)
+        self.assertEqual(
+            [51.0, 91.0, 51.0, 11.0],
+            climate.temperatures[::3][:4],
+        )
+        self.assertEqual(24, len(climate.temperatures))
+
+        species = Species()
+        species.minimum_temperature = 20
+        species.maximum_temperature = 80
+        (hot, cold) = climate.get_extreme_months(species)
+        self.assertEqual([False, True, False, False], hot[::3][:4])
+        self.assertEqual([False, False, False, True], cold[::3][:4])
+
+    @skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_temperatures(self):
+        climate = ClimateSchedule.from_habitat(
+            self.get_habitat(),
+            24,
+            numpy.random.default_rng(0),
+        )
+        expected = ClimateSchedule(
+            self.get_habitat(),
+            list(climate.fluctuations),
+        )
+        self.assertEqual(
+            expected.temperatures,
+            list(climate.temperatures),
+        )
+
+    def test_climate_seed(self):
+        self.assertIsNone(get_climate_seed(None, 'plains'))
+        self.assertEqual(
+            get_climate_seed(1, 'plains'),
+            get_climate_seed(1, 'plains'),
+        )
+        self.assertNotEqual(
+            get_climate_seed(1, 'plains'),
+            get_climate_seed(1, 'forest'),
+        )
+
+    def test_shared_climate(self):
+        species = Species()
+        species.life_span = 5
+        species.minimum_temperature = 20
+        species.maximum_temperature = 80
+        species.minimum_breeding_age = 100
+        habitat = self.get_habitat()
+        climate = ClimateSchedule.from_habitat(habitat, 60, Random(0))
+
+        # The founders never breed, so only the weather decides when they
+        # die, and it no longer depends on the engine's own random stream.
+        for engine in ('object', 'cohort'):
+            with self.subTest(engine=engine):
+                runs = [
+                    run_simulation(
+                        engine,
+                        species,
+                        habitat,
+                        5,
+                        seed,
+                        climate=climate,
+                    )
+                    for seed in (1, 2)
+                ]
+                self.assertEqual(
+                    *[(run.step_count, run.deaths_by_type) for run in runs]
+                )
+
+
+class LoadConfigurationTest(TestCase):
+    config_path = os.path.join(os.path.dirname(__file__), 'example_config.yml')
+
+    def test_example(self):
+        configuration = load_configuration(self.config_path)
+        self.assertEqual(100, configuration.years)
+        self.assertEqual(
+            ['kangaroo', 'bear'],
+            [species.name for species in configuration.species],
+        )
+        self.assertEqual(9, configuration.species[0].gestation_months)
+        self.assertEqual(
+            30,
+            configuration.habitats[0].average_temperatures[SEASON_WINTER],
+        )
+
+    def test_errors(self):
+        species = (
+            'years: 1\nhabitats: []\nspecies:\n'
+            '  - name: kangaroo\n    attributes: {attributes}\n'
+        )
+        cases = (
+            (
+                species.format(attributes='{life_span: ten}'),
+                'configuration.species[0].attributes.life_span: expected an '
+                'integer',
+            ),
+            (
+                species.format(attributes='{lifespan: 10}'),
+                'configuration.species[0].attributes: unknown key lifespan',
+            ),
+            ('years: 1\nspecies: []\n', 'configuration.habitats: missing'),
+            (
+                'years: 1\nspecies: []\nhabitats:\n'
+                '  - {name: a, monthly_food: 1, monthly_water: 1, '
+                'allocation: last, average_temperature: '
+                '{spring: 1, summer: 1, fall: 1, winter: 1}}\n',
+                'configuration.habitats[0].allocation: expected one of',
+            ),
+            ('years: [1\n', 'expected'),
+            ('years: -1\nspecies: []\nhabitats: []\n', 'must be at least 0'),
+        )
+        attributes = {
+            'life_span': 10,
+            'monthly_food_consumption': 1,
+            'monthly_water_consumption': 1,
+            'minimum_temperature': 0,
+            'maximum_temperature': 100,
+            'gestation_period': 9,
+            'minimum_breeding_age': 1,
+        }
+        for (key, value, allowed) in (
+            ('life_span', 0, 'positive'),
+            ('monthly_food_consumption', -1, 'positive'),
+            ('monthly_water_consumption', 0, 'positive'),
+            ('gestation_period', 0, 'positive'),
+            ('minimum_breeding_age', -1, 'at least 0'),
+        ):
+            cases += ((
+                species.format(attributes=json.dumps(
+                    dict(attributes, **{key: value}),
+                )),
+                'configuration.species[0].attributes.{key}: must be '
+                '{allowed}, got {value!r}'.format(
+                    key=key,
+                    allowed=allowed,
+                    value=value,
+                ),
+            ),)
+        cases += ((
+            'years: 1\nspecies: []\nhabitats:\n'
+            '  - {name: a, monthly_food: -5, monthly_water: 1, '
+            'average_temperature: '
+            '{spring: 1, summer: 1, fall: 1, winter: 1}}\n',
+            'configuration.habitats[0].monthly_food: must be at least 0',
+        ),)
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.yml')
+            for (text, message) in cases:
+                with self.subTest(text=text):
+                    with open(path, 'w') as config_file:
+                        config_file.write(text)
+                    with self.assertRaises(ConfigurationError) as context:
+                        load_configuration(path)
+                    self.assertIn(message, str(context.exception))
+
+    def test_cache(self):
+        with TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            path = os.path.join(directory, 'config.yml')
+            with open(path, 'w') as config_file:
+                config_file.write('years: 1\nspecies: []\nhabitats: []\n')
+            self.assertEqual((1, (), ()), load_configuration(path, cache))
+            self.assertEqual(1, len(cache.get_entries()))
+            self.assertEqual((1, (), ()), load_configuration(path, cache))
+            self.assertEqual(1, len(cache.get_entries()))
+
+            with open(path, 'w') as config_file:
+                config_file.write('years: 2\nspecies: []\nhabitats: []\n')
+            self.assertEqual((2, (), ()), load_configuration(path, cache))
+            self.assertEqual(2, len(cache.get_entries()))
+
+
+class SweepTest(TestCase):
+    def test_parse_values(self):
+        self.assertEqual([1, 2, 5], sweep.parse_values('1,2,5'))
+        self.assertEqual([10, 15, 20], sweep.parse_values('10:20:5'))
+        self.assertEqual([1, 2, 3], sweep.parse_values('1:3'))
+        self.assertEqual([0.5, 0.75, 1.0], sweep.parse_values('0.5:1:0.25'))
+        with self.assertRaises(ArgumentTypeError):
+            sweep.parse_values('1:5:0')
+
+    def test_parse_variation(self):
+        variation = sweep.parse_variation('life_span=1,2')
+        self.assertEqual('species.life_span', variation.name)
+        self.assertEqual([1, 2], variation.values)
+        variation = sweep.parse_variation('habitat.monthly_food=5')
+        self.assertEqual('habitat.monthly_food', variation.name)
+        self.assertEqual(
+            [2, 3],
+            sweep.parse_variation('gestation_months=2.0,3').values,
+        )
+        self.assertEqual(
+            [1.5],
+            sweep.parse_variation('monthly_food_consumption=1.5').values,
+        )
+        for text in (
+            'life_span',
+            'name=1',
+            'habitat.life_span=1',
+            'gestation_months=2.5',
+            'life_span=0:2',
+            'monthly_water=-1',
+        ):
+            with self.subTest(text=text):
+                with self.assertRaises(ArgumentTypeError):
+                    sweep.parse_variation(text)
+
+    def test_sweep_points(self):
+        variations = [
+            sweep.parse_variation('life_span=1,2'),
+            sweep.parse_variation('monthly_food=3,4'),
+        ]
+        points = list(sweep.get_sweep_points(variations))
+        self.assertEqual(4, len(points))
+        self.assertEqual(
+            ((2, 3), {'life_span': 2}, {'monthly_food': 3}),
+            points[2],
+        )
+
+    def test_run_sweep(self):
+        config_path = os.path.join(
+            os.path.dirname(__file__),
+            'example_config.yml',
+        )
+        arguments = sweep.get_argument_parser().parse_args([
+            config_path,
+            '--species', 'kangaroo',
+            '--habitat', 'desert',
+            '--years', '2',
+            '--seed', '1',
+            '--vary', 'life_span=1,2',
+            '--no-cache',
+        ])
+        output_stream = StringIO()
+        sweep.run_sweep(arguments, output_stream)
+        lines = output_stream.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('species'))
+        self.assertTrue(lines[1].startswith('kangaroo     desert'))
+
+    def test_unknown_selection(self):
+        config_path = os.path.join(
+            os.path.dirname(__file__),
+            'example_config.yml',
+        )
+        arguments = sweep.get_argument_parser().parse_args([
+            config_path,
+            '--species', 'kangaroo',
+            '--species', 'wombat',
+            '--no-cache',
+        ])
+        with self.assertRaises(sweep.SweepError) as context:
+            sweep.run_sweep(arguments, StringIO())
+        self.assertIn('wombat', str(context.exception))
+
+
+class ServiceTest(TestCase):
+    config_path = os.path.join(os.path.dirname(__file__), 'example_config.yml')
+
+    class Writer(object):
+        def __init__(self):
+            self.messages = []
+
+        def write(self, data):
+            self.messages.append(json.loads(data))
+
+        async def drain(self):
+            pass
+
+    def test_cancel_queued_job(self):
+        async def run():
+            simulation_service = service.SimulationService(
+                load_configuration(self.config_path),
+                None,
+            )
+            writer = self.Writer()
+            connection = service.Connection(writer)
+            request = {'op': 'submit', 'species': 'bear', 'habitat': 'desert'}
+            await simulation_service.handle_request(connection, request)
+            await simulation_service.handle_request(
+                connection,
+                {'op': 'cancel', 'job': 1},
+            )
+            await simulation_service.handle_request(
+                connection,
+                {'op': 'status'},
+            )
+            return writer.messages
+
+        messages = asyncio.run(run())
+        self.assertEqual(
+            [
+                {'job': 1, 'state': 'queued'},
+                {'job': 1, 'state': 'cancelled'},
+                {'job': 1, 'cancelled': True},
+            ],
+            messages[:3],
+        )
+        self.assertEqual(1, messages[3]['jobs']['cancelled'])
+        self.assertEqual(0, messages[3]['jobs']['queued'])
+
+    def test_cancel_running_job(self):
+        async def run():
+            simulation_service = service.SimulationService(
+                load_configuration(self.config_path),
+                None,
+            )
+            writer = self.Writer()
+            connection = service.Connection(writer)
+            request = {'op': 'submit', 'species': 'bear', 'habitat': 'desert'}
+            await simulation_service.handle_request(connection, request)
+            job = await simulation_service.queue.get()
+            simulation_service.set_state(job, service.STATE_RUNNING)
+            await simulation_service.handle_request(
+                connection,
+                {'op': 'cancel', 'job': 1},
+            )
+            await simulation_service.handle_request(
+                connection,
+                {'op': 'cancel', 'job': 2},
+            )
+            return (job, writer.messages)
+
+        (job, messages) = asyncio.run(run())
+        self.assertEqual(
+            [
+                {'job': 1, 'state': 'queued'},
+                {'job': 1, 'cancelled': False},
+                {'job': 2, 'cancelled': False},
+            ],
+            messages,
+        )
+        self.assertEqual(service.STATE_RUNNING, job.state)
+
+    def test_serve(self):
+        configuration = load_configuration(self.config_path)
+        expected = run_simulation(
+            'cohort',
+            configuration.species[0],
+            configuration.habitats[2],
+            5,
+            get_replicate_seed(1, 0),
+            climate=get_climate_schedule(
+                'cohort',
+                configuration.habitats[2],
+                5,
+                get_replicate_seed(1, 0),
+            ),
+        )
+
+        async def run(socket_path, executor):
+            simulation_service = service.SimulationService(
+                configuration,
+                executor,
+            )
+            server = asyncio.ensure_future(
+                service.serve(simulation_service, socket_path),
+            )
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            (reader, writer) = await asyncio.open_unix_connection(socket_path)
+            requests = [
+                {'op': 'submit', 'species': 'bear', 'habitat': 'nowhere'},
+                {
+                    'op': 'submit',
+                    'species': 'kangaroo',
+                    'habitat': 'desert',
+                    'years': 5,
+                    'seed': 1,
+                    'engine': 'cohort',
+                },
+            ]
+            for request in requests:
+                writer.write(json.dumps(request).encode() + b'\n')
+            messages = [
+                json.loads(await reader.readline())
+                for _ in range(3)
+            ]
+            writer.close()
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            return messages
+
+        with TemporaryDirectory() as directory:
+            with ThreadPoolExecutor(1) as executor:
+                messages = asyncio.run(run(
+                    os.path.join(directory, 'socket'),
+                    executor,
+                ))
+        self.assertEqual({'error': "unknown habitat 'nowhere'"}, messages[0])
+        self.assertEqual({'job': 1, 'state': 'queued'}, messages[1])
+        self.assertEqual('done', messages[2]['state'])
+        self.assertEqual(
+            expected.average_population,
+            messages[2]['result']['average_population'],
+        )
+
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class BatchEngineTest(TestCase):
+    def get_runs(self):
+        # The founders never breed, so every run is deterministic, and the
+        # habitats only feed some of them.
+        species = Species()
+        species.life_span = 2
+        species.monthly_food_consumption = 2
+        species.monthly_water_consumption = 1
+        species.minimum_temperature = 40
+        species.maximum_temperature = 100
+        species.minimum_breeding_age = 100
+
+        runs = []
+        for (monthly_food, years) in ((0, 1), (2, 2), (4, 3), (1, 3)):
+            habitat = Habitat()
+            habitat.monthly_food = monthly_food
+            habitat.monthly_water = 10
+            for season in habitat.average_temperatures:
+                habitat.average_temperatures[season] = 70
+            climate = ClimateSchedule.from_habitat(habitat, years * 12)
+            runs.append((species, habitat, years, climate))
+        return runs
+
+    def test_capacity(self):
+        resources = numpy.array([0, 5, 5, 3])
+        consumptions = numpy.array([1, 2, 0, 4])
+        self.assertEqual(
+            [get_fed_count(resource, consumption, 100)
+             for (resource, consumption) in zip(resources, consumptions)],
+            list(numpy.minimum(
+                batch_engine.get_capacity(resources, consumptions),
+                100,
+            )),
+        )
+
+    def test_matches_numpy_engine(self):
+        runs = self.get_runs()
+        batched = batch_engine.get_batch_statistics(runs)
+        for (run, statistics) in zip(runs, batched):
+            (species, habitat, years, climate) = run
+            expected = numpy_engine.get_simulation_statistics(
+                species,
+                habitat,
+                years,
+                climate=climate,
+            )
+            with self.subTest(monthly_food=habitat.monthly_food):
+                self.assertEqual(expected.step_count, statistics.step_count)
+                self.assertEqual(
+                    expected.total_population,
+                    statistics.total_population,
+                )
+                self.assertEqual(
+                    expected.deaths_by_type,
+                    statistics.deaths_by_type,
+                )
+
+    def test_run_batched(self):
+        runs = self.get_runs() * 3
+        results = list(batch_engine.run_batched(runs, 1, 0, batch_size=5))
+        self.assertEqual(len(runs), len(results))
+        self.assertEqual(
+            [statistics.step_count for statistics in results[:4]],
+            [statistics.step_count for statistics in results[4:8]],
+        )
@@ -0,0 +1,298 @@
+"""
+Columnar traces of simulation runs.
+
+A trace keeps what a run's `SimulationStep`s would otherwise have to be kept
+in memory for: the population, temperature, births and deaths by cause of
+every simulated month, and the life history of every animal. It is a
+directory holding one file per column, each a flat array of fixed-width
+little-endian values, and a JSON header describing them:
+
+    months   month, population, temperature, births, deaths_<cause>...
+    lives    birth_month, death_month, cause, count
+
+A row of `lives` stands for the `count` animals born in `birth_month` that
+died of `cause` in `death_month`. Causes are indexes into the header's
+`death_types`, and `CAUSE_ALIVE` marks the animals still alive at the end
+of the run, whose `death_month` is the last simulated month.
+
+Values are appended to in-memory buffers and written out in blocks, so
+tracing costs little more than the bookkeeping of the run. Since columns are
+raw arrays, `TraceReader` memory-maps them, and loading a slice of a long
+trace reads only that slice.
+"""
+from array import array
+from collections import Counter
+import json
+import os
+import sys
+
+from fileutils import get_run_file_name, write_atomically
+from reporting import DEATH_FIELDS, DEATH_TYPES
+
+FORMAT_NAME = 'species-sim-trace'
+FORMAT_VERSION = 1
+HEADER_NAME = 'header.json'
+DEFAULT_BUFFER_ROWS = 8192
+
+TABLE_MONTHS = 'months'
+TABLE_LIVES = 'lives'
+
+CAUSE_ALIVE = -1
+CAUSE_CODES = {
+    death_type: code
+    for (code, death_type) in enumerate(DEATH_TYPES)
+}
+
+# NumPy type string and `array` type code of every column type.
+TYPECODES = {
+    '<i1': 'b',
+    '<i4': 'i',
+    '<i8': 'q',
+    '<f8': 'd',
+}
+
+# Name and type of the columns of every table.
+TABLES = {
+    TABLE_MONTHS: (
+        ('month', '<i4'),
+        ('population', '<i8'),
+        ('temperature', '<f8'),
+        ('births', '<i8'),
+    ) + tuple((field, '<i8') for field in DEATH_FIELDS),
+    TABLE_LIVES: (
+        ('birth_month', '<i4'),
+        ('death_month', '<i4'),
+        ('cause', '<i1'),
+        ('count', '<i8'),
+    ),
+}
+
+
+class TraceError(Exception):
+    pass
+
+
+def get_column_path(directory, table, column):
+    return os.path.join(directory, '{table}.{column}'.format(
+        table=table,
+        column=column,
+    ))
+
+
+def get_trace_path(directory, species, habitat, replicate):
+    return os.path.join(
+        directory,
+        get_run_file_name(species, habitat, replicate, '.trace'),
+    )
+
+
+def get_birth_month_counts(birth_months):
+    """
+    Return `(birth_month, count)` pairs of animals given either as their
+    birth months, in a sequence or a NumPy array, or as a mapping of birth
+    month to count.
+    """
+    if isinstance(birth_months, dict):
+        return birth_months.items()
+    if hasattr(birth_months, 'dtype'):
+        import numpy
+        (values, counts) = numpy.unique(birth_months, return_counts=True)
+        return zip(values.tolist(), counts.tolist())
+    return Counter(birth_months).items()
+
+
+class Column(object):
+    def __init__(self, path, dtype):
+        self.file = open(path, 'wb')
+        self.buffer = array(TYPECODES[dtype])
+        if self.buffer.itemsize != int(dtype[2:]):
+            raise TraceError('no {dtype} array type on this platform'.format(
+                dtype=dtype,
+            ))
+
+    def flush(self):
+        if sys.byteorder != 'little':
+            self.buffer.byteswap()
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class TraceWriter(object):
+    """
+    Records a run into the trace directory `path`, keeping at most
+    `buffer_rows` rows of a table in memory.
+
+    Engines call `record_step` for every simulated month and
+    `record_survivors` once the run is over. Close the writer, or use it as a
+    context manager, to write out the rows still buffered.
+    """
+
+    def __init__(self, path, buffer_rows=DEFAULT_BUFFER_ROWS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.buffer_rows = buffer_rows
+        # Last recorded month, at which survivors are recorded.
+        self.month = 0
+        self.tables = {
+            table: [
+                Column(get_column_path(path, table, name), dtype)
+                for (name, dtype) in columns
+            ]
+            for (table, columns) in TABLES.items()
+        }
+        # The header comes first, so the trace of a run that was killed can
+        # still be read up to its last written block.
+        write_atomically(
+            os.path.join(path, HEADER_NAME),
+            json.dumps({
+                'format': FORMAT_NAME,
+                'version': FORMAT_VERSION,
+                'death_types': list(DEATH_TYPES),
+                'tables': {
+                    table: [list(column) for column in columns]
+                    for (table, columns) in TABLES.items()
+                },
+            }, indent=2).encode(),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, table, row):
+        columns = self.tables[table]
+        for (column, value) in zip(columns, row):
+            column.buffer.append(value)
+        if len(columns[0].buffer) >= self.buffer_rows:
+            for column in columns:
+                column.flush()
+
+    def record_step(
+        self,
+        month,
+        population,
+        temperature,
+        births,
+        deaths,
+        dead=None,
+    ):
+        """
+        Record that `month` ended with `population` live animals, `births` of
+        them born that month, at `temperature`. `deaths` maps a death type to
+        the number of animals that died of it, and `dead` maps it to the
+        birth months of those animals, as taken by `get_birth_month_counts`.
+        """
+        self.month = int(month)
+        row = [int(month), int(population), float(temperature), int(births)]
+        row += [int(deaths.get(death_type, 0)) for death_type in DEATH_TYPES]
+        self.append(TABLE_MONTHS, row)
+        for (death_type, birth_months) in (dead or {}).items():
+            self.record_lives(month, CAUSE_CODES[death_type], birth_months)
+
+    def record_survivors(self, birth_months):
+        """
+        Record the animals still alive at the end of the run, given as for
+        `get_birth_month_counts`.
+        """
+        self.record_lives(self.month, CAUSE_ALIVE, birth_months)
+
+    def record_lives(self, month, cause, birth_months):
+        for (birth_month, count) in get_birth_month_counts(birth_months):
+            if count:
+                self.append(
+                    TABLE_LIVES,
+                    (int(birth_month), int(month), cause, int(count)),
+                )
+
+    def close(self):
+        for columns in self.tables.values():
+            for column in columns:
+                column.close()
+
+
+class TraceReader(object):
+    """
+    Reads the trace directory `path`. Columns are memory-mapped NumPy
+    arrays, so nothing is read until it is used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(os.path.join(path, HEADER_NAME)) as header_file:
+                header = json.load(header_file)
+        except (OSError, ValueError) as error:
+            raise TraceError('{path} is not a trace: {error}'.format(
+                path=path,
+                error=error,
+            ))
+        if header.get('format') != FORMAT_NAME:
+            raise TraceError('{path} is not a trace'.format(path=path))
+        if header.get('version') != FORMAT_VERSION:
+            raise TraceError(
+                '{path} has unsupported trace version {version}'.format(
+                    path=path,
+                    version=header.get('version'),
+                ),
+            )
+        self.death_types = tuple(header['death_types'])
+        self.tables = {
+            table: dict(columns)
+            for (table, columns) in header['tables'].items()
+        }
+
+    def get_row_count(self, table):
+        """
+        Return the number of complete rows of `table`. Columns of a run that
+        was killed may have been written up to different rows.
+        """
+        import numpy
+        return min(
+            os.path.getsize(get_column_path(self.path, table, name)) //
+            numpy.dtype(dtype).itemsize
+            for (name, dtype) in self.tables[table].items()
+        )
+
+    def get_column(self, table, column, start=0, stop=None):
+        """
+        Return rows `start` to `stop` of `column` of `table`, as a read-only
+        memory-mapped array.
+        """
+        import numpy
+        try:
+            dtype = numpy.dtype(self.tables[table][column])
+        except KeyError:
+            raise TraceError('{path} has no column {table}.{column}'.format(
+                path=self.path,
+                table=table,
+                column=column,
+            ))
+        (start, stop, _) = slice(start, stop).indices(
+            self.get_row_count(table),
+        )
+        if stop <= start:
+            # Empty files cannot be memory-mapped.
+            return numpy.empty(0, dtype)
+        return numpy.memmap(
+            get_column_path(self.path, table, column),
+            dtype,
+            mode='r',
+            offset=start * dtype.itemsize,
+            shape=(stop - start,),
+        )
+
+    def get_table(self, table, start=0, stop=None):
+        """
+        Return a mapping of every column name of `table` to its rows `start`
+        to `stop`.
+        """
+        return {
+            column: self.get_column(table, column, start, stop)
+            for column in self.tables[table]
+        }